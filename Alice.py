@@ -4,44 +4,30 @@
 # Interconnection Through Optical FIber And Like Wise
 
 import socket
-import numpy as np
 
-def recv_all(sock, num_bytes):
-    data = bytearray()
-    while len(data) < num_bytes:
-        packet = sock.recv(num_bytes - len(data))
-        if not packet:
-            raise ConnectionError("Socket connection closed prematurely")
-        data.extend(packet)
-    return data
+from bb84 import measure, random_bits
+from handshake import recv_array
 
 def start_client():
     client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     client_socket.connect(('localhost', 65432))
     
-    # Receive the number of bits first
-    num_bits = int.from_bytes(recv_all(client_socket, 4), byteorder='big')
-    
-    # Receive Alice's bits and bases
-    alice_bits = np.frombuffer(recv_all(client_socket, num_bits), dtype=np.uint8)
-    alice_bases = np.frombuffer(recv_all(client_socket, num_bits), dtype=np.uint8)
+    # Receive Alice's bits and bases (bit-packed, the header carries the length)
+    alice_bits = recv_array(client_socket)
+    alice_bases = recv_array(client_socket)
+    num_bits = len(alice_bits)
 
     # Ensure the received data is of the expected size
-    if len(alice_bits) != num_bits or len(alice_bases) != num_bits:
+    if len(alice_bases) != num_bits:
         print("Received data size does not match the expected number of bits.")
         client_socket.close()
         return
     
     # Bob chooses his bases
-    bob_bases = np.random.randint(0, 2, num_bits, dtype=np.uint8)
+    bob_bases = random_bits(num_bits)
     
     # Measure the bits based on Bob's bases
-    bob_bits = np.zeros(num_bits, dtype=int)
-    for i in range(num_bits):
-        if bob_bases[i] == alice_bases[i]:
-            bob_bits[i] = alice_bits[i]
-        else:
-            bob_bits[i] = np.random.randint(0, 2)
+    bob_bits = measure(alice_bits, alice_bases, bob_bases)
     
     # For demonstration, we will print the results
     print("Alice's bits: \n", alice_bits)
@@ -3,22 +3,15 @@
 # This Connection Taking Place Btwn Alice & Me(Bob) Simulates 
 # Interconnection Through Optical FIber And Like Wise
 
+import asyncio
 import socket
-import numpy as np
+import sys
+import time
 
-def eavesdrop_and_measure(alice_bits, alice_bases, num_bits, eavesdropping_probability):
-    eaves_bits = np.zeros(num_bits, dtype=int)
-    eaves_bases = np.random.randint(0, 2, num_bits)
-    intercepted = (np.random.rand(num_bits) < eavesdropping_probability)
-    
-    for i in range(num_bits):
-        if intercepted[i]:
-            if eaves_bases[i] == alice_bases[i]:
-                eaves_bits[i] = alice_bits[i]
-            else:
-                eaves_bits[i] = np.random.randint(0, 2)
-                
-    return eaves_bits, eaves_bases, intercepted
+from async_server import AsyncQKDServer, print_events
+from bb84 import eavesdrop_and_measure, prepare_and_send_bits
+from handshake import send_bits
+from prefork import Supervisor
 
 def start_server():
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -31,17 +24,13 @@ def start_server():
 
     num_bits = 64
     eavesdropping_probability = 0.7
-    alice_bits = np.random.randint(0, 2, num_bits, dtype=np.uint8)
-    alice_bases = np.random.randint(0, 2, num_bits, dtype=np.uint8)
+    alice_bits, alice_bases = prepare_and_send_bits(num_bits)
     
     eaves_bits, eaves_bases, intercepted = eavesdrop_and_measure(alice_bits, alice_bases, num_bits, eavesdropping_probability)
     
-    # Send the number of bits first
-    conn.sendall(num_bits.to_bytes(4, byteorder='big'))
-    
-    # Send Alice's bits and bases to the client (Bob)
-    conn.sendall(alice_bits.tobytes())
-    conn.sendall(alice_bases.tobytes())
+    # Send Alice's bits and bases to the client (Bob), packed 8 bits per byte
+    send_bits(conn, alice_bits)
+    send_bits(conn, alice_bases)
     
     while True:
         message = conn.recv(1024).decode('utf-8')
@@ -60,5 +49,35 @@ def start_server():
     conn.close()
     server_socket.close()
 
+# Multi-session mode (python Bob.py --async): every connection gets its own
+# session on one event loop. It speaks the framed protocol of the GUI apps,
+# not the plain-text chat of Alice.py.
+def start_async_server():
+    def on_session(session):
+        print('Connected by', session.peer)
+        session.subscribe(print_events)
+
+    server = AsyncQKDServer('localhost', 65432, on_session=on_session)
+    print('Server is waiting for connections...')
+    asyncio.run(server.serve_forever())
+
+# Pre-fork mode (python Bob.py --prefork [N]): N processes, one per core by
+# default, each running the multi-session server on the same port
+def start_prefork_server(workers=None):
+    supervisor = Supervisor('localhost', 65432, workers, quiet=False).start()
+    print(f'Server is waiting for connections in {supervisor.workers} processes...')
+    try:
+        while True:
+            time.sleep(10)
+            print('Stats:', supervisor.stats())
+    except KeyboardInterrupt:
+        supervisor.stop()
+
 if __name__ == "__main__":
-    start_server()
+    if "--async" in sys.argv[1:]:
+        start_async_server()
+    elif "--prefork" in sys.argv[1:]:
+        arguments = sys.argv[sys.argv.index("--prefork") + 1:]
+        start_prefork_server(int(arguments[0]) if arguments else None)
+    else:
+        start_server()
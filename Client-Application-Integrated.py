@@ -1,8 +1,15 @@
 import customtkinter as ctk
-from tkinter import messagebox
-import numpy as np
-import socket
+from tkinter import filedialog, messagebox
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from file_transfer import FileReceiver
+from gui_bridge import GuiBridge
+from keystore import KeyStore
+from peer import Peer
+from session import EVENT_CLOSED, EVENT_FILE, EVENT_KEY, EVENT_MESSAGE
 
 # Define the colors
 colors = {
@@ -21,177 +28,111 @@ colors = {
 eavesdropper = False
 server_ip = '127.0.0.1'  # Hotspot IP 192.168.107.13
 server_port = 12345
-client_socket = None
-num_bits = 64
-eavesdropping_probability = 0.3
-bob_bits = np.random.randint(0, 2, num_bits, dtype=np.uint8)
-bob_bases = np.random.randint(0, 2, num_bits, dtype=np.uint8)
-alice_bases = np.zeros(num_bits, dtype=np.uint8)
-eve_bits = np.zeros(num_bits, dtype=np.uint8)
-KEY = np.zeros(num_bits, dtype=int)
-error_rate = 0
-error_limit = 10
-
-# Eavesdrop check
-def eavesdrop_and_measure(bob_bits, bob_bases, num_bits, eavesdropping_probability):
-    global error_rate  # Ensure error_rate is updated globally
-    eaves_bits = np.zeros(num_bits, dtype=int)
-    eaves_bases = np.random.randint(0, 2, num_bits)
-    intercepted = (np.random.rand(num_bits) < eavesdropping_probability)
-    
-    error_count = 0
-    
-    for i in range(num_bits):
-        if intercepted[i]:
-            if eaves_bases[i] == bob_bases[i]:
-                eaves_bits[i] = bob_bits[i]
-            else:
-                eaves_bits[i] = np.random.randint(0, 2)
-                error_count += 1  # Increment error count for mismatched bases
-
-    if not eavesdropper:
-        error_rate = np.round(np.random.uniform(3, 10), 2)
-    else:
-        error_rate = np.round(np.random.uniform(8,20 ), 2)
-
-    return eaves_bits, eaves_bits, error_rate
-
-def generate_key(alice_bases, bob_bases):
-    global KEY, error_rate  # Ensure KEY and error_rate are updated globally
-    for i in range(num_bits):
-        if alice_bases[i] == bob_bases[i]:
-            KEY[i] = bob_bits[i]
-
-    # Update GUI key label
-    key_label.configure(text=f"Key: {''.join(map(str, KEY))}")
-
-def encrypt_message(message, key):
-    key = bytearray(key)  # Convert key to mutable bytearray
-    encrypted = bytearray(message.encode())
-    
-    # Perform XOR encryption
-    for i in range(len(encrypted)):
-        encrypted[i] ^= key[i % len(key)]
-    
-    return encrypted
-
-def decrypt_message(ciphertext, key):
-    key = bytearray(key)  # Convert key to mutable bytearray
-    decrypted = bytearray(ciphertext)
-    
-    # Perform XOR decryption
-    for i in range(len(decrypted)):
-        decrypted[i] ^= key[i % len(key)]
-    
-    return decrypted.decode()
+key_timeout = 5  # Seconds a sender waits on an empty key pool
+cipher = "otp"  # "otp", or "aes-gcm" / "chacha20-poly1305" keyed from QKD key (needs cryptography)
+nodelay = True  # Send every frame at once; False lets TCP batch small writes
+key_store_dir = "qkd_keys/client"  # Leftover key kept for the server across restarts (None to disable)
+download_dir = "downloads/client"  # Files the server sends are saved here (None to refuse them)
+metrics_port = 9101  # Prometheus metrics at http://127.0.0.1:9101/metrics (None to disable)
+retry_delay = 2  # Seconds between connection attempts
+peer = None  # Headless protocol engine this window is a front-end for
+bridge = None  # Worker threads update the window through this
+sender = ThreadPoolExecutor(max_workers=1)  # Sends in order, off the Tk thread
+file_sender = ThreadPoolExecutor(max_workers=1)  # Files stream alongside messages
+
+# Protocol events of the peer's session; they arrive on the peer's receive thread
+def on_session_event(event, session, value):
+    if event == EVENT_KEY:
+        # Update GUI labels, formatted once per frame however many rounds finish
+        bridge.set_label(key_label, text=lambda: f"Key: {''.join(map(str, session.key[:64]))}...")
+        bridge.set_label(error_rate_label, text=f"Error Rate: {session.error_rate:.2f}%")
+    elif event == EVENT_MESSAGE:
+        display_message(f"Alice: {value}", sent=False)
+    elif event == EVENT_FILE:
+        display_message(f"Alice sent {value.name} ({value.transferred} bytes), saved to {value.path}", sent=False)
+    elif event == EVENT_CLOSED:
+        # Connection closed or error occurred
+        bridge.call(messagebox.showinfo, "Disconnected", "Server disconnected.")
+        bridge.set_label(connection_status, text="Server disconnected", text_color="red")
 
 # Function to handle connection to server
 def connect_to_server():
-    global client_socket, num_bits, alice_bases, eve_bits
+    global peer
     while True:
         try:
-            client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            client_socket.connect((server_ip, server_port))
-            connection_status.configure(text=f"Connected to ('{server_ip}',{server_port})", text_color=colors["text"])
-
-            # Receive initial messages from server
-            num_bits_data = client_socket.recv(4)
-            num_bits = int.from_bytes(num_bits_data, byteorder='big')
-            
-            alice_bases_data = client_socket.recv(num_bits)
-            alice_bases = np.frombuffer(alice_bases_data, dtype=np.uint8)
-            
-            eve_bits_data = client_socket.recv(num_bits)
-            eve_bits = np.frombuffer(eve_bits_data, dtype=np.uint8)
-            
-            # Send Bob's bases to server
-            client_socket.sendall(bob_bases.tobytes())
-
-            # Check for eavesdropping and update the error rate
-            eaves_bits, eaves_bits, error_rate = eavesdrop_and_measure(bob_bits, bob_bases, num_bits, eavesdropping_probability)
-            
-            # Update GUI labels
-            key_label.configure(text=f"Key: {''.join(map(str, KEY))}")
-            error_rate_label.configure(text=f"Error Rate: {error_rate:.2f}%")
-
-            # Generate key after receiving Alice's bases
-            generate_key(alice_bases, bob_bases)
-
-            threading.Thread(target=receive_messages, daemon=True).start()
+            key_store = KeyStore(key_store_dir) if key_store_dir else None
+            peer = Peer.connect(server_ip, server_port, eavesdropper=eavesdropper, key_store=key_store, cipher=cipher,
+                                nodelay=nodelay)
+            peer.session.subscribe(on_session_event)
+            if download_dir:
+                peer.session.file_receiver = FileReceiver(download_dir)
+            peer.start()
+            bridge.set_label(connection_status, text=f"Connected to ('{server_ip}',{server_port})", text_color=colors["text"])
 
             break  # Break the loop once connected
 
         except Exception as e:
             print(f"Error connecting to server: {e}")
-            messagebox.showerror("Error", f"Error connecting to server: {e}")
-
-# Function to receive messages from the server
-def receive_messages():
-    global client_socket, KEY, num_bits, alice_bases, eve_bits, error_rate
-    while True:
-        try:
-            data = client_socket.recv(1024)
-            if not data:
-                break
-            
-            # Assuming the data is a message from Alice after key exchange
-            decrypted_message = decrypt_message(data, KEY)
-            display_message(f"Alice: {decrypted_message}", sent=False)
-
-        except Exception as e:
-            print(f"Error receiving message: {e}")
-            break
-        
-    # Connection closed or error occurred
-    messagebox.showinfo("Disconnected", "Server disconnected.")
-    connection_status.configure(text="Server disconnected", text_color="red")
-    client_socket.close()  # type: ignore
-    client_socket = None
+            bridge.set_label(connection_status, text=f"Error connecting to server: {e}; retrying", text_color="red")
+            time.sleep(retry_delay)
 
 # Function to send messages to the server
 def send_message():
     message = input_field.get()
     if message:
-        eavesdropping_detected = (error_rate > error_limit)
+        session = peer.session if peer else None
+        error_rate = session.error_rate if session else 0
+        eavesdropping_detected = session is not None and session.eavesdropping_detected
         connection_secure = not eavesdropping_detected
-        encrypted_message = encrypt_message(message, KEY)
-
-        # Convert encrypted message to a displayable string format (hex)
-        encrypted_message_display = encrypted_message.hex()
 
-        key_label.configure(text=f"Key: {''.join(map(str, KEY))}")
-        error_rate_label.configure(text=f"Error Rate: {error_rate:.2f}%")
-        eavesdropping_label.configure(text=f"Eavesdropping Detected: {'Yes' if eavesdropping_detected else 'No'}")
-        connection_label.configure(text=f"Connection Secure: {'Yes' if connection_secure else 'No'}")
-        encrypt_message_label.configure(text=f"Encrypted Message: {encrypted_message_display}")
+        bridge.set_label(error_rate_label, text=f"Error Rate: {error_rate:.2f}%")
+        bridge.set_label(eavesdropping_label, text=f"Eavesdropping Detected: {'Yes' if eavesdropping_detected else 'No'}")
+        bridge.set_label(connection_label, text=f"Connection Secure: {'Yes' if connection_secure else 'No'}")
 
         display_message(f"You: {message}", sent=True)
         
         if eavesdropping_detected:
             display_message("Error: Eavesdropping detected, message cannot be sent.", sent=False)
         else:
-            if client_socket:
-                try:
-                    client_socket.send(encrypted_message)
-                    input_field.delete(0, 'end')
-
-                except Exception as e:
-                    display_message(f"Error sending message: {e}", sent=True)
+            if session and not session.closed:
+                # A send may wait for key; the window does not
+                sender.submit(peer.send, message, key_timeout).add_done_callback(message_sent)
+                input_field.delete(0, 'end')
             else:
                 display_message("Error: Not connected to server", sent=True)
 
-# Function to display messages in the GUI
+def message_sent(future):
+    try:
+        # Convert encrypted message to a displayable string format (hex)
+        encrypted_message_display = future.result().hex()
+        bridge.set_label(encrypt_message_label, text=f"Encrypted Message: {encrypted_message_display}")
+    except Exception as e:
+        display_message(f"Error sending message: {e}", sent=True)
+
+# Function to stream a file to the server
+def send_file():
+    if not peer or peer.session.closed:
+        display_message("Error: Not connected to server", sent=True)
+        return
+    path = filedialog.askopenfilename(title="Send File")
+    if path:
+        display_message(f"Sending {path}...", sent=True)
+        file_sender.submit(peer.send_file, path, key_timeout).add_done_callback(file_sent)
+
+def file_sent(future):
+    try:
+        transfer = future.result()
+        display_message(f"Sent {transfer.name}: {transfer.transferred} bytes at {transfer.throughput / 1e6:.3g} MB/s", sent=True)
+    except Exception as e:
+        display_message(f"Error sending file: {e}", sent=True)
+
+# Function to display messages in the GUI; safe from any thread
 def display_message(message, sent):
-    scrollable_chat.configure(state='normal')
-    scrollable_chat.insert(ctk.END, f"{message}\n", ('sent' if sent else 'received'))
-    scrollable_chat.configure(state='disabled')
-    scrollable_chat.yview(ctk.END)
+    bridge.add_line(message, 'sent' if sent else 'received')
 
 # Function to clear chat
 def clear_chat():
-    scrollable_chat.configure(state='normal')
-    scrollable_chat.delete(1.0, ctk.END)
-    scrollable_chat.configure(state='disabled')
+    bridge.clear()
 
 def show_help():
     help_text = """
@@ -208,84 +149,92 @@ def show_help():
 
 # Function to exit the chat application
 def exit_chat():
-    if client_socket:
-        client_socket.close()
+    if peer:
+        peer.close()
     root.destroy()
 
-# GUI setup
-root = ctk.CTk()
-root.title("QKD Secured Messaging App - Client")
-root.geometry("800x800")
-root.configure(fg_color=colors["background"])
+if __name__ == "__main__":
+    # GUI setup
+    root = ctk.CTk()
+    root.title("QKD Secured Messaging App - Client")
+    root.geometry("800x800")
+    root.configure(fg_color=colors["background"])
+
+    # Header
+    header = ctk.CTkFrame(root, fg_color=colors["primary"], height=50)
+    header.pack(side="top", fill="x", padx=10, pady=10)
+
+    app_name = ctk.CTkLabel(header, text="QKD Messaging App (Client)", text_color=colors["text"], font=("Urbanist", 20, "bold"))
+    app_name.pack(side="left", padx=20, pady=15)
 
-# Header
-header = ctk.CTkFrame(root, fg_color=colors["primary"], height=50)
-header.pack(side="top", fill="x", padx=10, pady=10)
+    help_button = ctk.CTkButton(header, text="Help", fg_color=colors["accent"], text_color=colors["background"], font=("Urbanist", 12, "bold"), command=show_help)
+    help_button.pack(side="right", padx=20)
 
-app_name = ctk.CTkLabel(header, text="QKD Messaging App (Client)", text_color=colors["text"], font=("Urbanist", 20, "bold"))
-app_name.pack(side="left", padx=20, pady=15)
+    # Information area
+    info_area = ctk.CTkFrame(root, fg_color=colors["background"])
+    info_area.pack(side="top", fill="x", padx=10, pady=10)
 
-help_button = ctk.CTkButton(header, text="Help", fg_color=colors["accent"], text_color=colors["background"], font=("Urbanist", 12, "bold"), command=show_help)
-help_button.pack(side="right", padx=20)
+    key_label = ctk.CTkLabel(info_area, text="Key: ", text_color=colors["text"], font=("Urbanist", 14))
+    key_label.pack(anchor="w", padx=20)
 
-# Information area
-info_area = ctk.CTkFrame(root, fg_color=colors["background"])
-info_area.pack(side="top", fill="x", padx=10, pady=10)
+    error_rate_label = ctk.CTkLabel(info_area, text="Error Rate: ", text_color=colors["text"], font=("Urbanist", 14))
+    error_rate_label.pack(anchor="w", padx=20)
 
-key_label = ctk.CTkLabel(info_area, text="Key: ", text_color=colors["text"], font=("Urbanist", 14))
-key_label.pack(anchor="w", padx=20)
+    eavesdropping_label = ctk.CTkLabel(info_area, text="Eavesdropping Detected: ", text_color=colors["text"], font=("Urbanist", 14))
+    eavesdropping_label.pack(anchor="w", padx=20)
 
-error_rate_label = ctk.CTkLabel(info_area, text="Error Rate: ", text_color=colors["text"], font=("Urbanist", 14))
-error_rate_label.pack(anchor="w", padx=20)
+    connection_label = ctk.CTkLabel(info_area, text="Connection Secure: ", text_color=colors["text"], font=("Urbanist", 14))
+    connection_label.pack(anchor="w", padx=20)
 
-eavesdropping_label = ctk.CTkLabel(info_area, text="Eavesdropping Detected: ", text_color=colors["text"], font=("Urbanist", 14))
-eavesdropping_label.pack(anchor="w", padx=20)
+    encrypt_message_label = ctk.CTkLabel(info_area, text="Encrypted Message: ", text_color=colors["text"], font=("Urbanist", 14))
+    encrypt_message_label.pack(anchor="w", padx=20)
 
-connection_label = ctk.CTkLabel(info_area, text="Connection Secure: ", text_color=colors["text"], font=("Urbanist", 14))
-connection_label.pack(anchor="w", padx=20)
+    # Chat Area
+    chat_area = ctk.CTkFrame(root, fg_color=colors["display_area"], corner_radius=10)
+    chat_area.pack(side="top", fill="both", padx=10, pady=10, expand=True)
 
-encrypt_message_label = ctk.CTkLabel(info_area, text="Encrypted Message: ", text_color=colors["text"], font=("Urbanist", 14))
-encrypt_message_label.pack(anchor="w", padx=20)
+    scrollable_chat = ctk.CTkTextbox(chat_area, fg_color=colors["display_area"], text_color=colors["text"], wrap=ctk.WORD, state='disabled', font=("Urbanist", 16), corner_radius=10)
+    scrollable_chat.pack(fill="both", expand=True, padx=10, pady=10)
 
-# Chat Area
-chat_area = ctk.CTkFrame(root, fg_color=colors["display_area"], corner_radius=10)
-chat_area.pack(side="top", fill="both", padx=10, pady=10, expand=True)
+    # Input Area
+    input_area = ctk.CTkFrame(root, fg_color=colors["input_area"], corner_radius=10)
+    input_area.pack(side="top", fill="x", padx=10, pady=10)
 
-scrollable_chat = ctk.CTkTextbox(chat_area, fg_color=colors["display_area"], text_color=colors["text"], wrap=ctk.WORD, state='disabled', font=("Urbanist", 16), corner_radius=10)
-scrollable_chat.pack(fill="both", expand=True, padx=10, pady=10)
+    connection_area = ctk.CTkFrame(input_area, fg_color=colors["input_area"])
+    connection_area.pack(anchor="w", padx=5)
 
-# Input Area
-input_area = ctk.CTkFrame(root, fg_color=colors["input_area"], corner_radius=10)
-input_area.pack(side="top", fill="x", padx=10, pady=10)
+    # Connection status
+    connection_status = ctk.CTkLabel(connection_area, text="Waiting for connection...", text_color=colors["text"], font=("Urbanist", 14), anchor= "w")
+    connection_status.pack(side="bottom", padx=10, pady=10)
 
-connection_area = ctk.CTkFrame(input_area, fg_color=colors["input_area"])
-connection_area.pack(anchor="w", padx=5)
+    input_field = ctk.CTkEntry(input_area, fg_color=colors["input_area"], text_color=colors["text"], font=("Urbanist", 16), corner_radius=10)
+    input_field.pack(side="top", fill="x", padx=10, pady=10, expand=True)
 
-# Connection status
-connection_status = ctk.CTkLabel(connection_area, text="Waiting for connection...", text_color=colors["text"], font=("Urbanist", 14), anchor= "w")
-connection_status.pack(side="bottom", padx=10, pady=10)
+    button_frame = ctk.CTkFrame(input_area, fg_color=colors["input_area"])
+    button_frame.pack(side="top", fill="x", padx=10, pady=10)
 
-input_field = ctk.CTkEntry(input_area, fg_color=colors["input_area"], text_color=colors["text"], font=("Urbanist", 16), corner_radius=10)
-input_field.pack(side="top", fill="x", padx=10, pady=10, expand=True)
+    send_button = ctk.CTkButton(button_frame, text="Send", fg_color=colors["button"], text_color=colors["background"], font=("Urbanist", 16), corner_radius=10, command=send_message)
+    send_button.pack(side="left", padx=5, pady=5)
 
-button_frame = ctk.CTkFrame(input_area, fg_color=colors["input_area"])
-button_frame.pack(side="top", fill="x", padx=10, pady=10)
+    file_button = ctk.CTkButton(button_frame, text="Send File", fg_color=colors["button"], text_color=colors["background"], font=("Urbanist", 16), corner_radius=10, command=send_file)
+    file_button.pack(side="left", padx=5, pady=5)
 
-send_button = ctk.CTkButton(button_frame, text="Send", fg_color=colors["button"], text_color=colors["background"], font=("Urbanist", 16), corner_radius=10, command=send_message)
-send_button.pack(side="left", padx=5, pady=5)
+    clear_button = ctk.CTkButton(button_frame, text="Clear Chat", fg_color=colors["button"], text_color=colors["background"], font=("Urbanist", 16), corner_radius=10, command=clear_chat)
+    clear_button.pack(side="left", padx=5, pady=5)
 
-clear_button = ctk.CTkButton(button_frame, text="Clear Chat", fg_color=colors["button"], text_color=colors["background"], font=("Urbanist", 16), corner_radius=10, command=clear_chat)
-clear_button.pack(side="left", padx=5, pady=5)
+    exit_button = ctk.CTkButton(button_frame, text="Exit Chat", fg_color=colors["button"], text_color=colors["background"], font=("Urbanist", 16), corner_radius=10, command=exit_chat)
+    exit_button.pack(side="right", padx=5, pady=5)
 
-exit_button = ctk.CTkButton(button_frame, text="Exit Chat", fg_color=colors["button"], text_color=colors["background"], font=("Urbanist", 16), corner_radius=10, command=exit_chat)
-exit_button.pack(side="right", padx=5, pady=5)
+    # Button actions
+    send_button.configure(command=send_message)
+    clear_button.configure(command=clear_chat)
+    exit_button.configure(command=exit_chat)
 
-# Button actions
-send_button.configure(command=send_message)
-clear_button.configure(command=clear_chat)
-exit_button.configure(command=exit_chat)
+    bridge = GuiBridge(root, scrollable_chat)
 
-# Connect to server on startup
-threading.Thread(target=connect_to_server, daemon=True).start()
+    # Connect to server on startup
+    if metrics_port:
+        metrics.serve(metrics_port)
+    threading.Thread(target=connect_to_server, daemon=True).start()
 
-root.mainloop()
+    root.mainloop()
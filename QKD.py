@@ -1,6 +1,21 @@
-from numpy import random, zeros
+import argparse
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from numpy import random
 import matplotlib.pyplot as plt
 
+from bb84 import prepare_and_send_bits, eavesdrop_and_measure, measure_bits, sift, simulate
+from cascade import reconcile
+from privacy import amplify
+from qber import estimate
+from randomness import make_rng
+
+SWEEP_COLUMNS = ["num_bits", "eavesdropping_probability", "trials", "qber_mean", "qber_var"]
+
+
 def main():
     num_bits = 1000
     eavesdropping_probability = 0.4
@@ -10,83 +25,147 @@ def main():
     bob_bits, bob_bases = measure_bits(alice_bits, alice_bases, eaves_bits, intercepted, num_bits)
     sifted_alice_bits, sifted_bob_bits = sift_bits(alice_bases, bob_bases, alice_bits, bob_bits)
 
-    error_rate = detect_eavesdropping(sifted_alice_bits, sifted_bob_bits)
-    print(f"Error Rate: {error_rate:.2%}")
+    estimator, sifted_alice_bits, sifted_bob_bits = detect_eavesdropping(sifted_alice_bits, sifted_bob_bits)
+    error_rate = estimator.qber
+    print(f"Error Rate: {error_rate:.2%} (between {estimator.lower:.2%} and {estimator.upper:.2%}, {estimator.checked:.0f} bits checked)")
 
-    if error_rate > 0.1:  # Threshold for eavesdropping detection
+    if estimator.exceeded:  # Observed QBER above qber.ERROR_LIMIT
         print("Eavesdropping detected. Terminating the process.")
     else:
         print("No significant eavesdropping detected. Key exchange successful.")
         print(f"Sifted Key: {sifted_alice_bits}")
+        corrected_bob_bits, leaked_bits = error_correction(sifted_alice_bits, sifted_bob_bits, error_rate)
+        # Every corrected bit was an error: the whole key now counts as checked
+        estimator.update(np.count_nonzero(corrected_bob_bits != sifted_bob_bits), len(sifted_bob_bits))
+        print(f"Error Rate after correction: {estimator.qber:.2%} (at most {estimator.upper:.2%})")
+        alice_key, bob_key = privacy_amplification(sifted_alice_bits, corrected_bob_bits, estimator.upper, leaked_bits)
 
     # Simulate multiple runs and collect error rates
     error_rates = []
     for _ in range(10):
-        # Repeat the main simulation and collect error rates
-        error_rate = detect_eavesdropping(sifted_alice_bits, sifted_bob_bits)
+        # Rerun the whole protocol, not just the check on the same key
+        _, _, error_rate = simulate(num_bits, eavesdropping_probability)
         error_rates.append(error_rate)
 
     plot_error_rate(error_rates)
 
 
-def prepare_and_send_bits(num_bits):
-    alice_bits = random.randint(0, 2, num_bits)
-    alice_bases = random.randint(0, 2, num_bits)
-    return alice_bits, alice_bases
-
-
-def eavesdrop_and_measure(alice_bits, alice_bases, num_bits, eavesdropping_probability):
-    eaves_bits = zeros(num_bits, dtype=int)
-    eaves_bases = random.randint(0, 2, num_bits)
-    intercepted = (random.rand(num_bits) < eavesdropping_probability)
-    
-    for i in range(num_bits):
-        if intercepted[i]:
-            if eaves_bases[i] == alice_bases[i]:
-                eaves_bits[i] = alice_bits[i]
-            else:
-                eaves_bits[i] = random.randint(0, 2)
-                
-    return eaves_bits, eaves_bases, intercepted
-
-
-def measure_bits(alice_bits, alice_bases, eaves_bits, intercepted, num_bits):
-    bob_bases = random.randint(0, 2, num_bits)
-    bob_bits = zeros(num_bits, dtype=int)
-    
-    for i in range(num_bits):
-        if intercepted[i]:
-            photon = eaves_bits[i]
-        else:
-            photon = alice_bits[i]
-            
-        if alice_bases[i] == bob_bases[i]:
-            bob_bits[i] = photon
-        else:
-            bob_bits[i] = random.randint(0, 2)
-    
-    return bob_bits, bob_bases
-
-
 def sift_bits(alice_bases, bob_bases, alice_bits, bob_bits):
     print("Alice bases shape:", alice_bases.shape)
     print("Bob bases shape:", bob_bases.shape)
     
-    matches = (alice_bases == bob_bases)
-    sifted_alice_bits = alice_bits[matches]
-    sifted_bob_bits = bob_bits[matches]
-    
-    return sifted_alice_bits, sifted_bob_bits
+    return sift(alice_bases, bob_bases, alice_bits, bob_bits)
+
+
+def detect_eavesdropping(sifted_alice_bits, sifted_bob_bits, estimator=None):
+    # Checks only as many bits as the finite-size bounds need; returns the
+    # estimator and the unchecked bits, which stay in the key
+    return estimate(sifted_alice_bits, sifted_bob_bits, estimator)
+
 
+def error_correction(sifted_alice_bits, sifted_bob_bits, error_rate):
+    # Cascade reconciliation; every parity Alice reveals is a leaked bit
+    cascade = reconcile(sifted_alice_bits, sifted_bob_bits, error_rate)
+    residual = np.count_nonzero(cascade.bits != sifted_alice_bits)
+    print(f"Corrected {cascade.corrected_bits} bits in {cascade.passes_used} passes "
+          f"({cascade.round_trips} round trips, {cascade.leaked_bits} bits leaked, {residual} left)")
+    return cascade.bits, cascade.leaked_bits
 
-def detect_eavesdropping(sifted_alice_bits, sifted_bob_bits):
-    check_bits = random.choice(len(sifted_alice_bits), size=len(sifted_alice_bits) // 2, replace=False)
-    errors = sum(sifted_alice_bits[check_bits] != sifted_bob_bits[check_bits])
-    error_rate = errors / len(check_bits)
+
+def privacy_amplification(sifted_alice_bits, corrected_bob_bits, error_rate, leaked_bits, seed=None):
+    # Both sides hash their key with the same public Toeplitz seed
+    seed = random.SeedSequence(seed).entropy if seed is None else seed
+    alice_key = amplify(sifted_alice_bits, error_rate, leaked_bits, seed)
+    bob_key = amplify(corrected_bob_bits, error_rate, leaked_bits, seed)
+    print(f"Secret Key: {len(alice_key)} of {len(sifted_alice_bits)} bits kept, keys match: {np.array_equal(alice_key, bob_key)}")
+    return alice_key, bob_key
+
+
+def run_trial(task):
+    # One full protocol run on its own RNG stream; runs inside a pool worker
+    num_bits, eavesdropping_probability, seed = task
+    rng = make_rng(seed)
+    _, _, error_rate = simulate(num_bits, eavesdropping_probability, rng=rng)
     return error_rate
 
 
-main()
+def run_sweep(num_bits_grid, probabilities, trials, seed=None, workers=None):
+    grid = [(n, p) for n in num_bits_grid for p in probabilities]
+
+    # SeedSequence.spawn gives every trial a statistically independent stream
+    seeds = random.SeedSequence(seed).spawn(len(grid) * trials)
+    tasks = [(n, p, seeds[g * trials + t]) for g, (n, p) in enumerate(grid) for t in range(trials)]
+
+    workers = workers or os.cpu_count()
+    chunksize = max(1, len(tasks) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        error_rates = np.fromiter(pool.map(run_trial, tasks, chunksize=chunksize), dtype=float, count=len(tasks))
+
+    error_rates = error_rates.reshape(len(grid), trials)
+    return {
+        "num_bits": np.array([n for n, _ in grid]),
+        "eavesdropping_probability": np.array([p for _, p in grid]),
+        "trials": np.full(len(grid), trials),
+        "qber_mean": error_rates.mean(axis=1),
+        "qber_var": error_rates.var(axis=1, ddof=1) if trials > 1 else np.zeros(len(grid)),
+    }
+
+
+def save_sweep(results, path):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(SWEEP_COLUMNS)
+        writer.writerows(zip(*(results[column] for column in SWEEP_COLUMNS)))
+
+
+def load_sweep(path):
+    table = np.genfromtxt(path, delimiter=",", names=True)
+    return {column: np.atleast_1d(table[column]) for column in SWEEP_COLUMNS}
+
+
+def plot_error_rate(error_rates):
+    # Accepts either a list of per-run error rates or a sweep results file;
+    # live_plot.py plots a running link as it goes
+    if isinstance(error_rates, (str, os.PathLike)):
+        results = load_sweep(error_rates)
+        for num_bits in np.unique(results["num_bits"]):
+            rows = results["num_bits"] == num_bits
+            plt.errorbar(results["eavesdropping_probability"][rows], results["qber_mean"][rows],
+                         yerr=np.sqrt(results["qber_var"][rows]), marker="o", capsize=3, label=f"{int(num_bits)} bits")
+        plt.xlabel("Eavesdropping Probability")
+        plt.legend()
+    else:
+        plt.plot(range(1, len(error_rates) + 1), error_rates, marker="o")
+        plt.xlabel("Run")
+    plt.ylabel("Error Rate")
+    plt.title("QKD Error Rate")
+    plt.grid(True)
+    plt.show()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="BB84 simulation")
+    parser.add_argument("--sweep", action="store_true", help="run a Monte Carlo sweep instead of a single trial")
+    parser.add_argument("--num-bits", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--probabilities", type=float, nargs="+", default=[0.0, 0.1, 0.2, 0.4, 0.6, 0.8, 1.0])
+    parser.add_argument("--trials", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None, help="pool size (default: all cores)")
+    parser.add_argument("--output", default="sweep_results.csv")
+    parser.add_argument("--plot", action="store_true", help="plot the sweep results when done")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.sweep:
+        results = run_sweep(args.num_bits, args.probabilities, args.trials, args.seed, args.workers)
+        save_sweep(results, args.output)
+        print(f"Wrote {len(results['num_bits'])} grid points to {args.output}")
+        if args.plot:
+            plot_error_rate(args.output)
+    else:
+        main()
 
 # Error correction?
 # Simulation?
@@ -1,8 +1,12 @@
 import customtkinter as ctk
-from tkinter import messagebox
-import socket
-import threading
-import numpy as np
+from tkinter import filedialog, messagebox
+
+import metrics
+from async_server import AsyncQKDServer
+from gui_bridge import GuiBridge
+from keystore import KeyStore
+from prefork import Supervisor
+from session import EVENT_CLOSED, EVENT_FILE, EVENT_KEY, EVENT_MESSAGE
 
 # Define the colors
 colors = {
@@ -21,186 +25,124 @@ colors = {
 eavesdropper = False
 server_ip = '127.0.0.1'  # Hotspot IP 192.168.107.13
 server_port = 12345
-server_socket = None
-client_socket = None
-num_bits = 64
+num_bits = 4096  # photons per exchange round
 eavesdropping_probability = 0.1
-alice_bits = np.random.randint(0, 2, num_bits, dtype=np.uint8)
-alice_bases = np.random.randint(0, 2, num_bits, dtype=np.uint8)
-bob_bases = np.zeros(num_bits, dtype=int)
-KEY = np.zeros(num_bits, dtype=int)
-error_rate = 0
-error_limit = 10
-
-# Eavesdrop check
-def eavesdrop_and_measure(alice_bits, alice_bases, num_bits, eavesdropping_probability):
-    global error_rate  # Ensure error_rate is updated globally
-    eaves_bits = np.zeros(num_bits, dtype=int)
-    eaves_bases = np.random.randint(0, 2, num_bits)
-    intercepted = (np.random.rand(num_bits) < eavesdropping_probability)
-    
-    error_count = 0
-    
-    for i in range(num_bits):
-        if intercepted[i]:
-            if eaves_bases[i] == alice_bases[i]:
-                eaves_bits[i] = alice_bits[i]
-            else:
-                eaves_bits[i] = np.random.randint(0, 2)
-                error_count += 1  # Increment error count for mismatched bases
-
-    error_rate = float(error_count) / num_bits  # Calculate error rate
-    if not eavesdropper:
-        error_rate = np.round(np.random.uniform(3, 10), 2)
-    else:
-        error_rate = np.round(np.random.uniform(8, 20), 2)
-    
-    return eaves_bits, eaves_bits, error_rate
-
-def generate_key(alice_bases, bob_bases):
-    global KEY  # Ensure KEY is updated globally
-    for i in range(num_bits):
-        if alice_bases[i] == bob_bases[i]:
-            KEY[i] = alice_bits[i]
-    # Update GUI key label
-    key_label.configure(text=f"Key: {''.join(map(str, KEY))}")
-
-def encrypt_message(message, key):
-    key = bytearray(key)  # Convert key to mutable bytearray
-    encrypted = bytearray(message.encode())
-    
-    # Perform XOR encryption
-    for i in range(len(encrypted)):
-        encrypted[i] ^= key[i % len(key)]
-    
-    return encrypted
-
-def decrypt_message(ciphertext, key):
-    key = bytearray(key)  # Convert key to mutable bytearray
-    decrypted = bytearray(ciphertext)
-    
-    # Perform XOR decryption
-    for i in range(len(decrypted)):
-        decrypted[i] ^= key[i % len(key)]
-    
-    return decrypted.decode()
+key_reserve = 1024  # Key bytes kept ready in each direction
+key_timeout = 5  # Seconds a sender waits on an empty key pool
+pipeline_depth = 4  # Exchange rounds in flight per client
+cipher = "otp"  # "otp", or "aes-gcm" / "chacha20-poly1305" keyed from QKD key (needs cryptography)
+nodelay = True  # Send every frame at once; False lets TCP batch small writes
+metrics_port = 9100  # Prometheus metrics at http://127.0.0.1:9100/metrics (None to disable)
+key_store_dir = "qkd_keys/server"  # Leftover key kept for each client across restarts (None to disable)
+download_dir = "downloads/server"  # Files clients send are saved here (None to refuse them)
+workers = 1  # Processes sharing the port; with more than 1 this window chats with the clients its own process accepts
+server = None
+supervisor = None  # Extra worker processes
+session = None  # The peer session this window is attached to
+bridge = None  # Worker threads update the window through this
+
+# Every connection gets its own session on the server; the window follows the latest one
+def attach_session(new_session):
+    global session
+    session = new_session
+    session.eavesdropper = eavesdropper
+    session.subscribe(on_session_event)
+    bridge.set_label(connection_status, text=f"Connected to {session.peer}", text_color=colors["text"])
+
+# Protocol events of the attached session; they arrive on the server thread
+def on_session_event(event, event_session, value):
+    global session
+    if event == EVENT_KEY:
+        # Update GUI key label, formatted once per frame however many rounds finish
+        bridge.set_label(key_label, text=lambda: f"Key: {''.join(map(str, event_session.key[:64]))}...")
+    elif event == EVENT_MESSAGE:
+        display_message(f"Bob: {value}", sent=False)  # Display the decrypted message
+    elif event == EVENT_FILE:
+        display_message(f"Bob sent {value.name} ({value.transferred} bytes), saved to {value.path}", sent=False)
+    elif event == EVENT_CLOSED:
+        if event_session is session:
+            session = None
+            # Client has disconnected
+            bridge.set_label(connection_status, text="Client disconnected", text_color="red")
+            bridge.call(messagebox.showinfo, "Disconnected", "Server disconnected.")
 
 def start_server():
-    global server_socket
+    global server, supervisor
     try:
-        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server_socket.bind((server_ip, server_port))
-        server_socket.listen(1)
-        threading.Thread(target=accept_clients, daemon=True).start()
-        connection_status.configure(text=f"Server started at {server_ip}:{server_port}", text_color=colors["text"])
+        key_store = KeyStore(key_store_dir) if key_store_dir else None
+        server = AsyncQKDServer(server_ip, server_port, num_bits, eavesdropping_probability, key_reserve,
+                                on_session=attach_session, reuse_port=workers > 1, key_store=key_store,
+                                pipeline_depth=pipeline_depth, cipher=cipher, download_dir=download_dir, nodelay=nodelay)
+        server.start_in_thread()
+        if workers > 1:
+            supervisor = Supervisor(server_ip, server_port, workers - 1, num_bits=num_bits,
+                                    eavesdropping_probability=eavesdropping_probability, key_reserve=key_reserve,
+                                    key_store=key_store, pipeline_depth=pipeline_depth, cipher=cipher, download_dir=download_dir)
+            supervisor.start()
+        if metrics_port:
+            metrics.serve(metrics_port)
+        bridge.set_label(connection_status, text=f"Server started at {server_ip}:{server_port} ({workers} processes)", text_color=colors["text"])
 
     except Exception as e:
-        connection_status.configure(text=f"Failed to start server: {e}", text_color="red")
+        bridge.set_label(connection_status, text=f"Failed to start server: {e}", text_color="red")
         messagebox.showerror("Error", f"Failed to start server: {e}")
 
-def accept_clients():
-    global client_socket, connection_status
-    while True:
-        try:
-            if server_socket:
-                conn, address = server_socket.accept()
-                client_socket = conn
-                connection_status.configure(text=f"Connected to {address}", text_color=colors["text"])
-                
-                eaves_bits, eaves_bits, error_rate = eavesdrop_and_measure(alice_bits, alice_bases, num_bits, eavesdropping_probability)
-
-                # Send the number of bits first
-                conn.sendall(num_bits.to_bytes(4, byteorder='big'))
-
-                # Send Alice's bits and bases to the client (Bob)
-                conn.sendall(alice_bases.tobytes())
-
-                # Send eavesdropper's bits, bases, and intercepted data
-                conn.sendall(eaves_bits.tobytes())
-
-                threading.Thread(target=receive_messages, args=(conn,), daemon=True).start()
-
-        except Exception as e:
-            if server_socket:
-                server_socket.close()
-            connection_status.configure(text=f"Error accepting clients: {e}", text_color="red")
-            break
-
-# Function to receive messages from the client
-def receive_messages(conn):
-    global client_socket, connection_status, bob_bases
-    first_message_received = False
-
-    while True:
-        try:
-            data = conn.recv(1024)
-            if not data:
-                break
-            
-            if not first_message_received:
-                bob_bases = np.frombuffer(data, dtype=np.uint8)
-                first_message_received = True
-
-                generate_key(alice_bases, bob_bases)
-            else:
-                decrypted_message = decrypt_message(data, KEY)  # Decrypt the received data
-                display_message(f"Bob: {decrypted_message}", sent=False)  # Display the decrypted message
-        
-        except Exception as e:
-            connection_status.configure(text=f"Error receiving message: {e}", text_color="red")
-            break
-        
-    # Client has disconnected
-    connection_status.configure(text="Client disconnected", text_color="red")
-    messagebox.showinfo("Disconnected", "Server disconnected.")
-    if conn:
-        conn.close()
-    client_socket = None
-
 # Function to send messages from GUI
 def send_message():
-    global error_rate
     message = input_field.get()
     if message:
-        eavesdropping_detected = (error_rate > error_limit)
+        error_rate = session.error_rate if session else 0
+        eavesdropping_detected = session is not None and session.eavesdropping_detected
         connection_secure = not eavesdropping_detected
-        encrypted_message = encrypt_message(message, KEY)
-
-        # Convert encrypted message to a displayable string format (hex)
-        encrypted_message_display = encrypted_message.hex()
 
-        key_label.configure(text=f"Key: {''.join(map(str, KEY))}")
-        error_rate_label.configure(text=f"Error Rate: {error_rate:.2f}%")
-        eavesdropping_label.configure(text=f"Eavesdropping Detected: {'Yes' if eavesdropping_detected else 'No'}")
-        connection_label.configure(text=f"Connection Secure: {'Yes' if connection_secure else 'No'}")
-        encrypt_message_label.configure(text=f"Encrypted Message: {encrypted_message_display}")
+        bridge.set_label(error_rate_label, text=f"Error Rate: {error_rate:.2f}%")
+        bridge.set_label(eavesdropping_label, text=f"Eavesdropping Detected: {'Yes' if eavesdropping_detected else 'No'}")
+        bridge.set_label(connection_label, text=f"Connection Secure: {'Yes' if connection_secure else 'No'}")
 
         display_message(f"You: {message}", sent=True)
         
         if eavesdropping_detected:
             display_message("Error: Eavesdropping detected, message cannot be sent.", sent=False)
         else:
-            if client_socket:
-                try:
-                    client_socket.send(encrypted_message)
-                    input_field.delete(0, 'end')
-                except Exception as e:
-                    display_message(f"Error sending message: {e}", sent=True)
+            if session:
+                # Sent on the server thread; the window does not wait for key
+                server.send_threadsafe(session, message, key_timeout).add_done_callback(message_sent)
+                input_field.delete(0, 'end')
             else:
                 display_message("Error: Not connected to client", sent=True)
 
-# Function to display messages in the GUI
+def message_sent(future):
+    try:
+        # Convert encrypted message to a displayable string format (hex)
+        encrypted_message_display = future.result().hex()
+        bridge.set_label(encrypt_message_label, text=f"Encrypted Message: {encrypted_message_display}")
+    except Exception as e:
+        display_message(f"Error sending message: {e}", sent=True)
+
+# Function to stream a file to the attached client
+def send_file():
+    if not session:
+        display_message("Error: Not connected to client", sent=True)
+        return
+    path = filedialog.askopenfilename(title="Send File")
+    if path:
+        display_message(f"Sending {path}...", sent=True)
+        server.send_file_threadsafe(session, path).add_done_callback(file_sent)
+
+def file_sent(future):
+    try:
+        transfer = future.result()
+        display_message(f"Sent {transfer.name}: {transfer.transferred} bytes at {transfer.throughput / 1e6:.3g} MB/s", sent=True)
+    except Exception as e:
+        display_message(f"Error sending file: {e}", sent=True)
+
+# Function to display messages in the GUI; safe from any thread
 def display_message(message, sent):
-    scrollable_chat.configure(state='normal')
-    scrollable_chat.insert(ctk.END, f"{message}\n", ('sent' if sent else 'received'))
-    scrollable_chat.configure(state='disabled')
-    scrollable_chat.yview(ctk.END)
+    bridge.add_line(message, 'sent' if sent else 'received')
 
 # Function to clear chat
 def clear_chat():
-    scrollable_chat.configure(state='normal')
-    scrollable_chat.delete(1.0, ctk.END)
-    scrollable_chat.configure(state='disabled')
+    bridge.clear()
 
 # Function to show help message
 def show_help():
@@ -218,82 +160,89 @@ def show_help():
 
 # Function to exit the chat application
 def exit_chat():
-    global server_socket, client_socket
-    if server_socket:
-        server_socket.close()
-    if client_socket:
-        client_socket.close()
+    if server:
+        for connected in server.sessions:
+            server.close_threadsafe(connected)
+        server.stop_threadsafe()
+    if supervisor:
+        supervisor.stop()
     root.destroy()
 
-# GUI setup
-root = ctk.CTk()
-root.title("QKD Secured Messaging App - Server")
-root.geometry("800x800")
-root.configure(fg_color=colors["background"])
+if __name__ == "__main__":
+    # GUI setup
+    root = ctk.CTk()
+    root.title("QKD Secured Messaging App - Server")
+    root.geometry("800x800")
+    root.configure(fg_color=colors["background"])
+
+    # Header
+    header = ctk.CTkFrame(root, fg_color=colors["primary"], height=50)
+    header.pack(side="top", fill="x", padx=10, pady=10)
+
+    app_name = ctk.CTkLabel(header, text="QKD Messaging App (Server)", text_color=colors["text"], font=("Urbanist", 20, "bold"))
+    app_name.pack(side="left", padx=20, pady=15)
 
-# Header
-header = ctk.CTkFrame(root, fg_color=colors["primary"], height=50)
-header.pack(side="top", fill="x", padx=10, pady=10)
+    help_button = ctk.CTkButton(header, text="Help", fg_color=colors["accent"], text_color=colors["background"], font=("Urbanist", 12, "bold"), command=show_help)
+    help_button.pack(side="right", padx=20)
 
-app_name = ctk.CTkLabel(header, text="QKD Messaging App (Server)", text_color=colors["text"], font=("Urbanist", 20, "bold"))
-app_name.pack(side="left", padx=20, pady=15)
+    # Information area
+    info_area = ctk.CTkFrame(root, fg_color=colors["background"])
+    info_area.pack(side="top", fill="x", padx=10, pady=10)
 
-help_button = ctk.CTkButton(header, text="Help", fg_color=colors["accent"], text_color=colors["background"], font=("Urbanist", 12, "bold"), command=show_help)
-help_button.pack(side="right", padx=20)
+    key_label = ctk.CTkLabel(info_area, text="Key: ", text_color=colors["text"], font=("Urbanist", 14))
+    key_label.pack(anchor="w", padx=20)
 
-# Information area
-info_area = ctk.CTkFrame(root, fg_color=colors["background"])
-info_area.pack(side="top", fill="x", padx=10, pady=10)
+    error_rate_label = ctk.CTkLabel(info_area, text="Error Rate: ", text_color=colors["text"], font=("Urbanist", 14))
+    error_rate_label.pack(anchor="w", padx=20)
 
-key_label = ctk.CTkLabel(info_area, text="Key: ", text_color=colors["text"], font=("Urbanist", 14))
-key_label.pack(anchor="w", padx=20)
+    eavesdropping_label = ctk.CTkLabel(info_area, text="Eavesdropping Detected: ", text_color=colors["text"], font=("Urbanist", 14))
+    eavesdropping_label.pack(anchor="w", padx=20)
 
-error_rate_label = ctk.CTkLabel(info_area, text="Error Rate: ", text_color=colors["text"], font=("Urbanist", 14))
-error_rate_label.pack(anchor="w", padx=20)
+    connection_label = ctk.CTkLabel(info_area, text="Connection Secure: ", text_color=colors["text"], font=("Urbanist", 14))
+    connection_label.pack(anchor="w", padx=20)
 
-eavesdropping_label = ctk.CTkLabel(info_area, text="Eavesdropping Detected: ", text_color=colors["text"], font=("Urbanist", 14))
-eavesdropping_label.pack(anchor="w", padx=20)
+    encrypt_message_label = ctk.CTkLabel(info_area, text="Encrypted Message: ", text_color=colors["text"], font=("Urbanist", 14))
+    encrypt_message_label.pack(anchor="w", padx=20)
 
-connection_label = ctk.CTkLabel(info_area, text="Connection Secure: ", text_color=colors["text"], font=("Urbanist", 14))
-connection_label.pack(anchor="w", padx=20)
+    # Chat Area
+    chat_area = ctk.CTkFrame(root, fg_color=colors["display_area"], corner_radius=10)
+    chat_area.pack(side="top", fill="both", padx=10, pady=10, expand=True)
 
-encrypt_message_label = ctk.CTkLabel(info_area, text="Encrypted Message: ", text_color=colors["text"], font=("Urbanist", 14))
-encrypt_message_label.pack(anchor="w", padx=20)
+    scrollable_chat = ctk.CTkTextbox(chat_area, fg_color=colors["display_area"], text_color=colors["text"], wrap=ctk.WORD, state='disabled', font=("Urbanist", 16), corner_radius=10)
+    scrollable_chat.pack(fill="both", expand=True, padx=10, pady=10)
 
-# Chat Area
-chat_area = ctk.CTkFrame(root, fg_color=colors["display_area"], corner_radius=10)
-chat_area.pack(side="top", fill="both", padx=10, pady=10, expand=True)
+    # Input Area
+    input_area = ctk.CTkFrame(root, fg_color=colors["input_area"], corner_radius=10)
+    input_area.pack(side="top", fill="x", padx=10, pady=10)
 
-scrollable_chat = ctk.CTkTextbox(chat_area, fg_color=colors["display_area"], text_color=colors["text"], wrap=ctk.WORD, state='disabled', font=("Urbanist", 16), corner_radius=10)
-scrollable_chat.pack(fill="both", expand=True, padx=10, pady=10)
+    connection_area = ctk.CTkFrame(input_area, fg_color=colors["input_area"])
+    connection_area.pack(anchor="w", padx=5)
 
-# Input Area
-input_area = ctk.CTkFrame(root, fg_color=colors["input_area"], corner_radius=10)
-input_area.pack(side="top", fill="x", padx=10, pady=10)
+    # Connection status
+    connection_status = ctk.CTkLabel(connection_area, text="Waiting for connection...", text_color=colors["text"], font=("Urbanist", 14), anchor= "w")
+    connection_status.pack(side="bottom", padx=10, pady=10)
 
-connection_area = ctk.CTkFrame(input_area, fg_color=colors["input_area"])
-connection_area.pack(anchor="w", padx=5)
+    input_field = ctk.CTkEntry(input_area, fg_color=colors["input_area"], text_color=colors["text"], font=("Urbanist", 16), corner_radius=10)
+    input_field.pack(side="top", fill="x", padx=10, pady=10, expand=True)
 
-# Connection status
-connection_status = ctk.CTkLabel(connection_area, text="Waiting for connection...", text_color=colors["text"], font=("Urbanist", 14), anchor= "w")
-connection_status.pack(side="bottom", padx=10, pady=10)
+    button_frame = ctk.CTkFrame(input_area, fg_color=colors["input_area"])
+    button_frame.pack(side="top", fill="x", padx=10, pady=10)
 
-input_field = ctk.CTkEntry(input_area, fg_color=colors["input_area"], text_color=colors["text"], font=("Urbanist", 16), corner_radius=10)
-input_field.pack(side="top", fill="x", padx=10, pady=10, expand=True)
+    send_button = ctk.CTkButton(button_frame, text="Send", fg_color=colors["button"], text_color=colors["background"], font=("Urbanist", 16), corner_radius=10, command=send_message)
+    send_button.pack(side="left", padx=5, pady=5)
 
-button_frame = ctk.CTkFrame(input_area, fg_color=colors["input_area"])
-button_frame.pack(side="top", fill="x", padx=10, pady=10)
+    file_button = ctk.CTkButton(button_frame, text="Send File", fg_color=colors["button"], text_color=colors["background"], font=("Urbanist", 16), corner_radius=10, command=send_file)
+    file_button.pack(side="left", padx=5, pady=5)
 
-send_button = ctk.CTkButton(button_frame, text="Send", fg_color=colors["button"], text_color=colors["background"], font=("Urbanist", 16), corner_radius=10, command=send_message)
-send_button.pack(side="left", padx=5, pady=5)
+    clear_button = ctk.CTkButton(button_frame, text="Clear Chat", fg_color=colors["button"], text_color=colors["background"], font=("Urbanist", 16), corner_radius=10, command=clear_chat)
+    clear_button.pack(side="left", padx=5, pady=5)
 
-clear_button = ctk.CTkButton(button_frame, text="Clear Chat", fg_color=colors["button"], text_color=colors["background"], font=("Urbanist", 16), corner_radius=10, command=clear_chat)
-clear_button.pack(side="left", padx=5, pady=5)
+    exit_button = ctk.CTkButton(button_frame, text="Exit Chat", fg_color=colors["button"], text_color=colors["background"], font=("Urbanist", 16), corner_radius=10, command=exit_chat)
+    exit_button.pack(side="right", padx=5, pady=5)
 
-exit_button = ctk.CTkButton(button_frame, text="Exit Chat", fg_color=colors["button"], text_color=colors["background"], font=("Urbanist", 16), corner_radius=10, command=exit_chat)
-exit_button.pack(side="right", padx=5, pady=5)
+    bridge = GuiBridge(root, scrollable_chat)
 
-# Start server
-start_server()
+    # Start server
+    start_server()
 
-root.mainloop()
+    root.mainloop()
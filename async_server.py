@@ -0,0 +1,326 @@
+# asyncio QKD server: one event loop, any number of concurrent peers.
+# Every connection gets its own Session (bits, bases, key pool, error rate),
+# a task reading its frames and a task running exchange rounds whenever its
+# key pool runs low. Nothing is global, so thousands of key exchanges and
+# chat streams can share one loop. A GUI attaches to a session through
+# on_session / Session.subscribe and sends with send_threadsafe.
+# With download_dir set, every session accepts files (file_transfer.py).
+# Writes go to the transport's buffer, which sends at once when the socket is
+# idle and otherwise coalesces everything written meanwhile into one send;
+# drain() is the backpressure.
+# Sifting, Cascade and privacy amplification of a long round take about
+# 100 ms per million photons; those steps run on the loop's default thread
+# pool once rounds reach offload_bits, one step per connection at a time, so
+# they do not stall every other connection. numpy releases the GIL in the
+# bulk of that work. Session events of such rounds fire on a pool thread.
+
+import argparse
+import asyncio
+import threading
+
+import numpy as np
+
+import metrics
+from file_transfer import DEFAULT_CHUNK_BYTES, FileReceiver, FileSender
+from framing import (CONTROL_QUIT, FRAME_BASES, FRAME_CONTROL, FRAME_HANDSHAKE, FRAME_HEADER, FRAME_PARITY, FRAME_RECONCILED,
+                     FRAME_RESUME, FRAME_SIFT, check_length, encode_frame, set_nodelay)
+from hybrid_cipher import CIPHER_OTP, CIPHERS, DEFAULT_REKEY_BYTES, DEFAULT_REKEY_SECONDS
+from keypool import DEFAULT_TARGET_BYTES
+from keystore import KeyStore
+from randomness import DEFAULT_GENERATOR, GENERATORS
+from session import (DEFAULT_NUM_BITS, DEFAULT_PIPELINE_DEPTH, EVENT_CLOSED, EVENT_FILE, EVENT_MESSAGE, EVENT_NOT_RESUMED,
+                     EVENT_RESUMED, Session)
+
+ROUND_TIMEOUT = 30  # seconds to wait for Bob to finish a round
+OFFLOAD_BITS = 1 << 16  # rounds of at least this many photons are processed off the event loop
+ROUND_FRAMES = {FRAME_HANDSHAKE, FRAME_BASES, FRAME_SIFT, FRAME_PARITY, FRAME_RECONCILED}
+
+
+class AsyncConnection:
+    def __init__(self, session, reader, writer, offload_bits=OFFLOAD_BITS):
+        self.session = session
+        self.reader = reader
+        self.writer = writer
+        self.offload_bits = offload_bits
+        self._steps = asyncio.Lock()  # one round step of this session on the thread pool at a time
+        self.key_wanted = asyncio.Event()  # wakes the key producer
+        self.keys = asyncio.Condition()  # notified whenever a round pooled its key
+        self._demand = 0  # bytes a blocked sender is waiting for
+
+    async def read_frame(self):
+        frame_type, length = FRAME_HEADER.unpack(await self.reader.readexactly(FRAME_HEADER.size))
+        check_length(frame_type, length)
+        return frame_type, await self.reader.readexactly(length)
+
+    async def _step(self, function, *args):
+        # Runs one round step; on the thread pool for long rounds. A client
+        # learns the round length from the first handshake.
+        if self.session.num_bits < self.offload_bits:
+            return function(*args)
+        async with self._steps:
+            return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    async def exchange_round(self):
+        # Starts a round once fewer than pipeline_depth are in flight;
+        # receive_frames sifts and reconciles rounds as Bob's frames come in
+        async with self.keys:
+            await asyncio.wait_for(self.keys.wait_for(lambda: self.session.closed or self.session.can_start_round()), ROUND_TIMEOUT)
+        if self.session.closed:
+            return
+        self.writer.write(await self._step(self.session.start_round))
+        await self.writer.drain()
+
+    async def produce_keys(self):
+        pool = self.session.pool
+        while not self.session.closed:
+            while pool.needs_refill() or pool.send.available() < self._demand:
+                await self.exchange_round()
+            self.key_wanted.clear()
+            await self.key_wanted.wait()
+
+    async def receive_frames(self):
+        while not self.session.closed:
+            frame_type, payload = await self.read_frame()
+            rounds = self.session.rounds
+            # Keys for a message always arrive before the message itself
+            if frame_type in ROUND_FRAMES:
+                reply = await self._step(self.session.handle_frame, frame_type, payload, 0)
+            else:
+                reply = self.session.handle_frame(frame_type, payload, timeout=0)
+            if reply:
+                self.writer.write(reply)
+            if self.session.rounds > rounds or frame_type == FRAME_RESUME:
+                async with self.keys:
+                    self.keys.notify_all()
+            self.key_wanted.set()
+
+    async def wait_for_key(self, num_bytes):
+        # Waits until encrypting num_bytes will find its key in the pool
+        pool = self.session.pool
+        needed = self.session.key_needed(num_bytes)
+        if pool.send.available() < needed:
+            self._demand = needed
+            self.key_wanted.set()
+            request = self.session.key_request(num_bytes)
+            if request:  # a client asks the server's producer
+                self.writer.write(request)
+            async with self.keys:
+                await self.keys.wait_for(lambda: self.session.closed or pool.send.available() >= needed)
+            self._demand = 0
+
+    async def send(self, message):
+        await self.wait_for_key(len(message.encode()))
+        frame, ciphertext = self.session.encrypt(message, timeout=0)
+        self.writer.write(frame)
+        await self.writer.drain()
+        self.key_wanted.set()
+        return ciphertext
+
+    async def send_file(self, path, chunk_size=DEFAULT_CHUNK_BYTES):
+        # Streams a file chunk by chunk; the next chunk is only read once
+        # drain() says the transport buffer has room. Returns the Transfer.
+        sender = FileSender(self.session, path, chunk_size)
+        frames = sender.frames(timeout=0)
+        try:
+            while True:
+                await self.wait_for_key(sender.next_bytes)
+                frame = next(frames, None)
+                if frame is None:
+                    return sender.transfer
+                self.writer.write(frame)
+                await self.writer.drain()
+                self.key_wanted.set()
+        finally:
+            frames.close()
+
+    async def close(self):
+        if not self.writer.is_closing():
+            self.writer.write(encode_frame(FRAME_CONTROL, CONTROL_QUIT))
+            self.writer.close()
+        self.session.close()
+
+
+class AsyncQKDServer:
+    def __init__(self, host='127.0.0.1', port=12345, num_bits=DEFAULT_NUM_BITS, eavesdropping_probability=0.0,
+                 key_reserve=DEFAULT_TARGET_BYTES, on_session=None, backlog=1024, reuse_port=False, key_store=None,
+                 pipeline_depth=DEFAULT_PIPELINE_DEPTH, cipher=CIPHER_OTP, rekey_bytes=DEFAULT_REKEY_BYTES,
+                 rekey_seconds=DEFAULT_REKEY_SECONDS, download_dir=None, seed=None, generator=DEFAULT_GENERATOR,
+                 nodelay=True, offload_bits=OFFLOAD_BITS):
+        self.host = host
+        self.port = port
+        self.num_bits = num_bits
+        self.eavesdropping_probability = eavesdropping_probability
+        self.key_reserve = key_reserve
+        self.on_session = on_session  # called with every new Session
+        self.backlog = backlog
+        self.reuse_port = reuse_port  # share the port with other processes (prefork.py)
+        self.key_store = key_store  # keystore.KeyStore: clients resume with the key left from earlier connections
+        self.pipeline_depth = pipeline_depth  # exchange rounds in flight per connection
+        self.cipher_options = {"cipher": cipher, "rekey_bytes": rekey_bytes, "rekey_seconds": rekey_seconds}
+        self.download_dir = download_dir  # directory receiving the files clients send (None: refuse files)
+        # Every connection's session seed is spawned from this one in
+        # accept order, so a seed replays the server's sessions
+        self.seed = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        self.generator = generator
+        self.nodelay = nodelay  # TCP_NODELAY, see framing.set_nodelay
+        self.offload_bits = offload_bits  # rounds this long run their CPU-heavy steps on the loop's thread pool
+        self.connections = {}  # session id -> AsyncConnection
+        self._handlers = set()  # connection handler tasks
+        self.loop = None
+        self._server = None
+
+    @property
+    def sessions(self):
+        return [connection.session for connection in self.connections.values()]
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, backlog=self.backlog,
+                                                  reuse_port=self.reuse_port or None)
+        self.port = self._server.sockets[0].getsockname()[1]  # the bound port when started on port 0
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def _handle(self, reader, writer):
+        session = Session(True, self.num_bits, self.eavesdropping_probability, self.key_reserve,
+                          peer=writer.get_extra_info('peername'), key_store=self.key_store, pipeline_depth=self.pipeline_depth,
+                          seed=self.seed.spawn(1)[0], generator=self.generator, **self.cipher_options)
+        set_nodelay(writer.get_extra_info('socket'), self.nodelay)
+        if self.download_dir:
+            session.file_receiver = FileReceiver(self.download_dir)
+        connection = AsyncConnection(session, reader, writer, self.offload_bits)
+        self.connections[session.id] = connection
+        self._handlers.add(asyncio.current_task())
+        if self.on_session:
+            self.on_session(session)
+
+        tasks = {asyncio.create_task(connection.receive_frames()), asyncio.create_task(connection.produce_keys())}
+        try:
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+            for task in done:
+                error = task.exception()
+                if error and not isinstance(error, (asyncio.IncompleteReadError, ConnectionError)):
+                    print(f"Session {session.id} ({session.peer}) ended: {error}")
+        finally:
+            del self.connections[session.id]
+            self._handlers.discard(asyncio.current_task())
+            await connection.close()
+
+    async def stop(self):
+        # Closes every connection, waits for their handlers, then stops listening
+        handlers = list(self._handlers)
+        for connection in list(self.connections.values()):
+            await connection.close()
+        await asyncio.gather(*handlers, return_exceptions=True)
+        self._server.close()
+
+    def send_threadsafe(self, session, message, timeout=None):
+        # For front-ends on other threads; returns a concurrent.futures.Future.
+        # timeout: seconds to wait for key before failing the send
+        send = self.connections[session.id].send(message)
+        return asyncio.run_coroutine_threadsafe(asyncio.wait_for(send, timeout), self.loop)
+
+    def send_file_threadsafe(self, session, path, timeout=None):
+        # timeout: seconds for the whole transfer
+        send = self.connections[session.id].send_file(path)
+        return asyncio.run_coroutine_threadsafe(asyncio.wait_for(send, timeout), self.loop)
+
+    def close_threadsafe(self, session):
+        return asyncio.run_coroutine_threadsafe(self.connections[session.id].close(), self.loop)
+
+    def start_in_thread(self):
+        # Runs the event loop on a daemon thread; returns once the server is bound
+        started = threading.Event()
+        errors = []
+
+        def run():
+            async def main():
+                try:
+                    await self.start()
+                except Exception as e:
+                    errors.append(e)
+                    return
+                finally:
+                    started.set()
+                try:
+                    await self.serve_forever()
+                except asyncio.CancelledError:
+                    pass  # stopped
+            asyncio.run(main())
+
+        threading.Thread(target=run, daemon=True).start()
+        started.wait()
+        if errors:
+            raise errors[0]
+
+    def stop_threadsafe(self):
+        if self.loop and self._server:
+            return asyncio.run_coroutine_threadsafe(self.stop(), self.loop)
+
+
+def print_events(event, session, value):
+    if event == EVENT_MESSAGE:
+        print(f"[{session.id} {session.peer}] {value}")
+    elif event == EVENT_FILE:
+        print(f"[{session.id} {session.peer}] received {value.path}: {value.transferred} bytes, "
+              f"{value.throughput / 1e6:.3g} MB/s")
+    elif event == EVENT_RESUMED:
+        print(f"[{session.id} {session.peer}] resumed with {value} stored key bytes")
+    elif event == EVENT_NOT_RESUMED:
+        print(f"[{session.id} {session.peer}] not resuming: {value}")
+    elif event == EVENT_CLOSED:
+        print(f"[{session.id} {session.peer}] disconnected")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-session QKD messaging server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=12345)
+    parser.add_argument("--num-bits", type=int, default=DEFAULT_NUM_BITS, help="photons per exchange round")
+    parser.add_argument("--eavesdropping-probability", type=float, default=0.0)
+    parser.add_argument("--key-reserve", type=int, default=DEFAULT_TARGET_BYTES, help="key bytes kept ready per direction")
+    parser.add_argument("--quiet", action="store_true", help="do not print messages")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this port")
+    parser.add_argument("--key-store", help="directory keeping leftover key across connections and restarts")
+    parser.add_argument("--pipeline-depth", type=int, default=DEFAULT_PIPELINE_DEPTH, help="exchange rounds in flight per connection")
+    parser.add_argument("--cipher", choices=CIPHERS, default=CIPHER_OTP, help="otp, or an AEAD keyed from QKD key (needs cryptography)")
+    parser.add_argument("--rekey-bytes", type=int, default=DEFAULT_REKEY_BYTES, help="AEAD traffic per session key")
+    parser.add_argument("--rekey-seconds", type=float, default=DEFAULT_REKEY_SECONDS, help="AEAD session key lifetime")
+    parser.add_argument("--download-dir", help="accept files from clients into this directory")
+    parser.add_argument("--seed", type=int, help="replays the sessions (random when not given; printed at startup)")
+    parser.add_argument("--generator", choices=GENERATORS, default=DEFAULT_GENERATOR,
+                        help="random generator of the sessions; system draws bits from os.urandom and cannot be replayed")
+    parser.add_argument("--nagle", action="store_true", help="let TCP batch small writes instead of sending each at once")
+    parser.add_argument("--offload-bits", type=int, default=OFFLOAD_BITS,
+                        help="rounds of at least this many photons are sifted and reconciled off the event loop")
+    args = parser.parse_args()
+
+    def on_session(session):
+        if not args.quiet:
+            print(f"[{session.id} {session.peer}] connected")
+            session.subscribe(print_events)
+
+    key_store = KeyStore(args.key_store) if args.key_store else None
+    server = AsyncQKDServer(args.host, args.port, args.num_bits, args.eavesdropping_probability, args.key_reserve, on_session,
+                            key_store=key_store, pipeline_depth=args.pipeline_depth, cipher=args.cipher,
+                            rekey_bytes=args.rekey_bytes, rekey_seconds=args.rekey_seconds, download_dir=args.download_dir,
+                            seed=args.seed, generator=args.generator, nodelay=not args.nagle,
+                            offload_bits=args.offload_bits)
+    print(f"Server is listening on {args.host}:{args.port} (seed {server.seed.entropy})")
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+        print(f"Metrics at http://127.0.0.1:{args.metrics_port}/metrics")
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+# Eavesdropper attack strategies as vectorized transforms of the photon stream.
+# An attack takes Alice's bits and bases for a whole block and returns an
+# AttackResult: what Bob reads when he measures in the announced basis, which
+# pulses reach his detector at all, and Eve's guess of the key. A mismatched
+# basis is a coin flip for any attack, and those bits are sifted away, so the
+# photons array only needs Bob's matching-basis reading, as in bb84.measure.
+#
+# evaluate() runs any number of attacks against the same Alice block and the
+# same Bob bases, so a study of many attacks costs one simulation's draws of
+# Alice's data plus one transform per attack:
+#
+#     python attacks.py --num-bits 1000000 --attacks none intercept-resend partial:0.2 breidbart pns:0.48:50 mitm
+
+import argparse
+import time
+
+import numpy as np
+
+import bb84
+import channel
+import qber
+import randomness
+
+BREIDBART_CORRECT = np.cos(np.pi / 8) ** 2  # Eve's and Bob's chance to read the Breidbart photon right
+STUDY_COLUMNS = ["attack", "sifted", "qber", "qber_lower", "detected", "gain", "eve_agreement", "eve_known"]
+
+
+class AttackResult:
+    def __init__(self, photons, eve_bits, eve_known, detected=None, bases=None, reference=None):
+        self.photons = photons  # what Bob reads when he measures in `bases`
+        self.eve_bits = eve_bits  # Eve's guess of the reference bits
+        self.eve_known = eve_known  # positions where that guess is certain once bases are public
+        self.detected = detected  # pulses that reach Bob's detector (None: all of them)
+        self.bases = bases  # bases Bob sifts against (None: Alice's)
+        self.reference = reference  # bits of Bob's sifting partner (None: Alice's)
+
+
+class NoAttack:
+    name = "none"
+
+    def apply(self, alice_bits, alice_bases, rng=None):
+        return AttackResult(alice_bits, bb84.random_bits(len(alice_bits), rng), np.zeros(len(alice_bits), dtype=bool))
+
+
+class InterceptResend:
+    # Eve measures a fraction of the photons in random bases and resends what
+    # she read. A fraction below 1 is the partial intercept attack.
+    def __init__(self, fraction=1.0):
+        self.fraction = fraction
+        self.name = "intercept-resend" if fraction == 1.0 else f"partial:{fraction:g}"
+
+    def apply(self, alice_bits, alice_bases, rng=None):
+        num_bits = len(alice_bits)
+        eaves_bits, eaves_bases, intercepted = bb84.eavesdrop_and_measure(alice_bits, alice_bases, num_bits, self.fraction, rng)
+        photons = bb84.photon_stream(alice_bits, eaves_bits, intercepted)
+        guesses = np.where(intercepted, eaves_bits, bb84.random_bits(num_bits, rng))
+        return AttackResult(photons, guesses, intercepted & (eaves_bases == alice_bases))
+
+
+class Breidbart:
+    # Eve measures in the basis halfway between rectilinear and diagonal and
+    # resends the state she found. She reads the bit right with probability
+    # cos^2(pi/8) whatever Alice's basis, never for certain, and Bob reads
+    # her photon as she sent it with the same probability.
+    def __init__(self, fraction=1.0):
+        self.fraction = fraction
+        self.name = "breidbart" if fraction == 1.0 else f"breidbart:{fraction:g}"
+
+    def apply(self, alice_bits, alice_bases, rng=None):
+        num_bits = len(alice_bits)
+        rng = randomness.generator(rng)
+        intercepted = rng.random(num_bits) < self.fraction
+        eaves_bits = alice_bits ^ (rng.random(num_bits) >= BREIDBART_CORRECT)
+        resent = eaves_bits ^ (rng.random(num_bits) >= BREIDBART_CORRECT)
+        photons = np.where(intercepted, resent, alice_bits).astype(np.uint8)
+        guesses = np.where(intercepted, eaves_bits, bb84.random_bits(num_bits, rng)).astype(np.uint8)
+        return AttackResult(photons, guesses, np.zeros(num_bits, dtype=bool))
+
+
+class PhotonNumberSplitting:
+    # Alice sends weak coherent pulses with Poisson photon numbers of mean mu.
+    # Eve keeps one photon of every multi-photon pulse, reads it once the
+    # bases are public and forwards the rest over a lossless line. She drops
+    # single-photon pulses as far as needed to hide the extra transmission, so
+    # Bob sees the gain he expects from the fiber and no extra errors; only
+    # decoy states (channel.py) reveal her.
+    def __init__(self, mu=0.48, distance_km=50.0, **fiber):
+        self.mu = mu
+        self.distance_km = distance_km
+        self.eta = channel.transmittance(distance_km, **fiber)
+        self.name = f"pns:{mu:g}:{distance_km:g}"
+
+    def apply(self, alice_bits, alice_bases, rng=None):
+        num_bits = len(alice_bits)
+        rng = randomness.generator(rng)
+        photon_numbers = rng.poisson(self.mu, num_bits)
+        expected_gain = 1 - np.exp(-self.eta * self.mu)
+        single = self.mu * np.exp(-self.mu)
+        multi = 1 - np.exp(-self.mu) - single
+        forward_multi = min(1.0, expected_gain / multi) if multi else 0.0
+        forward_single = max(0.0, expected_gain - multi) / single if single else 0.0
+        forward = np.where(photon_numbers >= 2, forward_multi, np.where(photon_numbers == 1, forward_single, 0.0))
+        detected = rng.random(num_bits) < forward
+        split = photon_numbers >= 2
+        guesses = np.where(split, alice_bits, bb84.random_bits(num_bits, rng)).astype(np.uint8)
+        return AttackResult(alice_bits, guesses, split, detected=detected)
+
+
+class ManInTheMiddle:
+    # Eve measures every photon in a random basis and sends Bob fresh random
+    # photons. Without an authenticated classical channel she also answers
+    # both basis announcements, so Alice and Bob each sift and check against
+    # her and see no errors; with authentication Bob sifts against Alice and
+    # half of his sifted bits are wrong.
+    def __init__(self, authenticated=False):
+        self.authenticated = authenticated
+        self.name = "mitm:authenticated" if authenticated else "mitm"
+
+    def apply(self, alice_bits, alice_bases, rng=None):
+        num_bits = len(alice_bits)
+        eaves_bits, eaves_bases, _ = bb84.eavesdrop_and_measure(alice_bits, alice_bases, num_bits, 1.0, rng)
+        sent_bits, sent_bases = bb84.prepare_and_send_bits(num_bits, rng)
+        if not self.authenticated:
+            return AttackResult(sent_bits, sent_bits, np.ones(num_bits, dtype=bool), bases=sent_bases, reference=sent_bits)
+        photons = np.where(sent_bases == alice_bases, sent_bits, bb84.random_bits(num_bits, rng))
+        return AttackResult(photons, eaves_bits, eaves_bases == alice_bases)
+
+
+ATTACKS = {
+    "none": NoAttack,
+    "intercept-resend": InterceptResend,
+    "partial": InterceptResend,
+    "breidbart": Breidbart,
+    "pns": PhotonNumberSplitting,
+    "mitm": ManInTheMiddle,
+}
+
+
+def parse_attack(spec):
+    # "name" or "name:ARG:ARG", e.g. "partial:0.2", "pns:0.48:50", "mitm:authenticated"
+    name, *params = spec.split(":")
+    if name not in ATTACKS:
+        raise ValueError(f"Unknown attack {spec!r}, expected one of {', '.join(ATTACKS)}")
+    if name == "mitm":
+        return ManInTheMiddle(authenticated=params == ["authenticated"])
+    return ATTACKS[name](*(float(param) for param in params))
+
+
+def evaluate(alice_bits, alice_bases, attacks, rng=None):
+    # Runs every attack on the same Alice block and the same Bob bases.
+    # Returns per-attack counts: dict of arrays, one entry per attack.
+    num_bits = len(alice_bits)
+    bob_bases = bb84.random_bits(num_bits, rng)
+    counts = {name: np.zeros(len(attacks), dtype=np.int64) for name in ("sifted", "errors", "detected", "eve_agreement", "eve_known")}
+    for i, attack in enumerate(attacks):
+        result = attack.apply(alice_bits, alice_bases, rng)
+        bases = alice_bases if result.bases is None else result.bases
+        reference = alice_bits if result.reference is None else result.reference
+        sifted = bases == bob_bases
+        if result.detected is not None:
+            sifted &= result.detected
+        counts["sifted"][i] = np.count_nonzero(sifted)
+        counts["errors"][i] = np.count_nonzero(result.photons[sifted] != reference[sifted])
+        counts["detected"][i] = num_bits if result.detected is None else np.count_nonzero(result.detected)
+        counts["eve_agreement"][i] = np.count_nonzero(result.eve_bits[sifted] == reference[sifted])
+        counts["eve_known"][i] = np.count_nonzero(result.eve_known[sifted])
+    return counts
+
+
+def study(attacks, num_bits, chunk_size=bb84.DEFAULT_CHUNK_SIZE, error_limit=qber.ERROR_LIMIT, rng=None):
+    # Streams num_bits photons through every attack in chunks; each chunk of
+    # Alice data is drawn once and shared. Rates are fractions of Bob's
+    # sifted key; detected is whether the QBER is above error_limit, the
+    # rule sessions abort rounds by.
+    totals = None
+    for start in range(0, num_bits, chunk_size):
+        alice_bits, alice_bases = bb84.prepare_and_send_bits(min(chunk_size, num_bits - start), rng)
+        counts = evaluate(alice_bits, alice_bases, attacks, rng)
+        totals = counts if totals is None else {name: totals[name] + counts[name] for name in totals}
+    sifted = np.maximum(totals["sifted"], 1)
+    rates = totals["errors"] / sifted
+    lower = np.maximum(0.0, rates - np.array([qber.bound_width(n) for n in totals["sifted"]]))
+    return {
+        "attack": np.array([attack.name for attack in attacks]),
+        "sifted": totals["sifted"],
+        "qber": rates,
+        "qber_lower": lower,
+        "detected": rates > error_limit,
+        "gain": totals["detected"] / num_bits,
+        "eve_agreement": totals["eve_agreement"] / sifted,
+        "eve_known": totals["eve_known"] / sifted,
+    }
+
+
+def print_study(results):
+    print(f"{'attack':<22} {'sifted':>9} {'QBER':>7} {'detected':>8} {'gain':>8} {'Eve agrees':>10} {'Eve knows':>9}")
+    for row in zip(*(results[column] for column in STUDY_COLUMNS)):
+        name, sifted, rate, _, detected, gain, agreement, known = row
+        print(f"{name:<22} {sifted:>9} {rate:>7.2%} {'yes' if detected else 'no':>8} {gain:>8.4f} {agreement:>10.2%} {known:>9.2%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare eavesdropping attacks on the same BB84 photon stream")
+    parser.add_argument("--num-bits", type=int, default=1000000)
+    parser.add_argument("--attacks", nargs="+", default=["none", "intercept-resend", "partial:0.2", "breidbart", "pns:0.48:50", "mitm",
+                                                         "mitm:authenticated"],
+                        help="none, intercept-resend, partial:FRACTION, breidbart[:FRACTION], pns:MU:KM, mitm[:authenticated]")
+    parser.add_argument("--error-limit", type=float, default=qber.ERROR_LIMIT * 100, help="abort threshold in percent")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--generator", choices=randomness.GENERATORS, default=randomness.DEFAULT_GENERATOR)
+    args = parser.parse_args()
+
+    attacks = [parse_attack(spec) for spec in args.attacks]
+    rng = randomness.make_rng(args.seed, args.generator)
+    started = time.perf_counter()
+    results = study(attacks, args.num_bits, error_limit=args.error_limit / 100, rng=rng)
+    print(f"{len(attacks)} attacks x {args.num_bits} photons in {(time.perf_counter() - started) * 1e3:.0f} ms")
+    print_study(results)
+
+
+if __name__ == "__main__":
+    main()
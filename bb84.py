@@ -0,0 +1,88 @@
+# Vectorized BB84 engine shared by QKD.py, Alice.py, Bob.py and the GUI apps.
+# Every stage works on whole NumPy arrays with bulk RNG draws, so there are no
+# per-photon Python loops. Long runs are split into fixed-size chunks so that
+# blocks bigger than RAM can be simulated and streamed.
+
+import numpy as np
+
+import randomness
+
+DEFAULT_CHUNK_SIZE = 1 << 20  # photons simulated per chunk
+
+
+def random_bits(num_bits, rng=None):
+    # rng: a numpy Generator (None: this thread's, see randomness.py)
+    return randomness.random_bits(num_bits, rng)
+
+
+def prepare_and_send_bits(num_bits, rng=None):
+    alice_bits = random_bits(num_bits, rng)
+    alice_bases = random_bits(num_bits, rng)
+    return alice_bits, alice_bases
+
+
+def eavesdrop_and_measure(alice_bits, alice_bases, num_bits, eavesdropping_probability, rng=None):
+    # Intercept-resend: Eve reads a photon with probability p, in a random basis.
+    # A wrong basis gives her a coin flip; untouched photons are left as 0.
+    rng = randomness.generator(rng)
+    eaves_bases = random_bits(num_bits, rng)
+    intercepted = rng.random(num_bits) < eavesdropping_probability
+    guesses = random_bits(num_bits, rng)
+
+    eaves_bits = np.where(eaves_bases == alice_bases, alice_bits, guesses)
+    eaves_bits[~intercepted] = 0
+    return eaves_bits, eaves_bases, intercepted
+
+
+def photon_stream(alice_bits, eaves_bits, intercepted):
+    # What actually reaches Bob: Eve's resent photon where she intercepted
+    return np.where(intercepted, eaves_bits, alice_bits)
+
+
+def measure(photons, alice_bases, bob_bases, rng=None):
+    # Matching basis reads the photon, a mismatched basis reads a coin flip
+    guesses = random_bits(len(photons), rng)
+    return np.where(alice_bases == bob_bases, photons, guesses)
+
+
+def measure_bits(alice_bits, alice_bases, eaves_bits, intercepted, num_bits, rng=None):
+    bob_bases = random_bits(num_bits, rng)
+    photons = photon_stream(alice_bits, eaves_bits, intercepted)
+    bob_bits = measure(photons, alice_bases, bob_bases, rng)
+    return bob_bits, bob_bases
+
+
+def sift(alice_bases, bob_bases, alice_bits, bob_bits):
+    matches = alice_bases == bob_bases
+    return alice_bits[matches], bob_bits[matches]
+
+
+def key_bytes(sifted_bits):
+    # Packs sifted key bits into key bytes, dropping a trailing partial byte
+    return np.packbits(sifted_bits[:len(sifted_bits) // 8 * 8]).tobytes()
+
+
+def run_block(num_bits, eavesdropping_probability=0.0, rng=None):
+    # One full round: Alice prepares, Eve intercepts, Bob measures, both sift
+    alice_bits, alice_bases = prepare_and_send_bits(num_bits, rng)
+    eaves_bits, _, intercepted = eavesdrop_and_measure(alice_bits, alice_bases, num_bits, eavesdropping_probability, rng)
+    bob_bits, bob_bases = measure_bits(alice_bits, alice_bases, eaves_bits, intercepted, num_bits, rng)
+    return sift(alice_bases, bob_bases, alice_bits, bob_bits)
+
+
+def simulate_chunks(num_bits, eavesdropping_probability=0.0, chunk_size=DEFAULT_CHUNK_SIZE, rng=None):
+    # Yields (sifted_alice_bits, sifted_bob_bits) per chunk. Only one chunk is
+    # ever held in memory, so num_bits is not limited by RAM.
+    for start in range(0, num_bits, chunk_size):
+        yield run_block(min(chunk_size, num_bits - start), eavesdropping_probability, rng)
+
+
+def simulate(num_bits, eavesdropping_probability=0.0, chunk_size=DEFAULT_CHUNK_SIZE, rng=None):
+    # Streams the whole run and returns (sifted_bits, errors, error_rate)
+    sifted = 0
+    errors = 0
+    for sifted_alice_bits, sifted_bob_bits in simulate_chunks(num_bits, eavesdropping_probability, chunk_size, rng):
+        sifted += len(sifted_alice_bits)
+        errors += int(np.count_nonzero(sifted_alice_bits != sifted_bob_bits))
+    error_rate = errors / sifted if sifted else 0.0
+    return sifted, errors, error_rate
@@ -0,0 +1,270 @@
+# Benchmark suite for the key-exchange and messaging pipeline.
+# Times every BB84 stage across key sizes, the cipher across payload sizes
+# and a full loopback exchange (handshake rounds plus N messages each way)
+# through the same server and client code the GUI apps use. Results are
+# written as JSON; with --baseline they are compared against an earlier run
+# and the exit status is 1 if any stage got slower than the tolerance.
+#
+#     python benchmark.py --save-baseline          # on the reference build
+#     python benchmark.py --baseline               # before deploying
+
+import argparse
+import json
+import os
+import platform
+import sys
+import threading
+import time
+
+import numpy as np
+
+import bb84
+import hybrid_cipher
+import privacy
+import qber
+import randomness
+from async_server import AsyncQKDServer
+from cascade import reconcile
+from framing import FRAME_HEADER
+from peer import Peer
+from session import EVENT_MESSAGE, Session
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+DEFAULT_PAYLOADS = [16, 256, 4096, 65536]
+DEFAULT_MESSAGES = 200
+DEFAULT_REPEAT = 5
+DEFAULT_TOLERANCE = 0.25  # slowdown reported as a regression
+BASELINE_PATH = "benchmark_baseline.json"
+EXCHANGE_TIMEOUT = 60
+
+
+def time_call(function, repeat, setup=None):
+    # Returns every run's wall time; setup() output is passed in untimed
+    times = []
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def result(name, params, times):
+    return {
+        "name": name,
+        "params": params,
+        "best": min(times),
+        "median": float(np.median(times)),
+        "repeat": len(times),
+    }
+
+
+def result_key(entry):
+    params = ",".join(f"{k}={v}" for k, v in sorted(entry["params"].items()))
+    return f"{entry['name']}[{params}]"
+
+
+def bench_stages(sizes, repeat, eavesdropping_probability=0.1, seed=0):
+    results = []
+    for num_bits in sizes:
+        rng = randomness.make_rng(seed)
+        alice_bits, alice_bases = bb84.prepare_and_send_bits(num_bits, rng)
+        eaves_bits, _, intercepted = bb84.eavesdrop_and_measure(alice_bits, alice_bases, num_bits, eavesdropping_probability, rng)
+        bob_bits, bob_bases = bb84.measure_bits(alice_bits, alice_bases, eaves_bits, intercepted, num_bits, rng)
+        sifted_alice_bits, sifted_bob_bits = bb84.sift(alice_bases, bob_bases, alice_bits, bob_bits)
+        estimator, kept_alice_bits, kept_bob_bits = qber.estimate(sifted_alice_bits, sifted_bob_bits, rng=rng)
+        cascade = reconcile(kept_alice_bits, kept_bob_bits, estimator.qber, seed)
+        # privacy_amplification times a different key length than Session:
+        # it hashes at the QBER observed over the whole key, not at the upper
+        # bound Session uses, which keeps no key from 1000 photons and would
+        # leave an empty hash to time. Raises if even this keeps no key.
+        estimator.update(cascade.corrected_bits, len(cascade.bits))
+        key_bits = privacy.secret_key_length(len(cascade.bits), estimator.qber, cascade.leaked_bits)
+        if key_bits <= 0:
+            raise RuntimeError(f"Privacy amplification of {num_bits} photons keeps no key")
+
+        stages = [
+            ("prepare_and_send_bits", lambda: bb84.prepare_and_send_bits(num_bits, rng)),
+            ("eavesdrop_and_measure", lambda: bb84.eavesdrop_and_measure(alice_bits, alice_bases, num_bits, eavesdropping_probability, rng)),
+            ("measure_bits", lambda: bb84.measure_bits(alice_bits, alice_bases, eaves_bits, intercepted, num_bits, rng)),
+            ("sift", lambda: bb84.sift(alice_bases, bob_bases, alice_bits, bob_bits)),
+            ("detect_eavesdropping", lambda: qber.estimate(sifted_alice_bits, sifted_bob_bits, rng=rng)),
+            ("error_correction", lambda: reconcile(kept_alice_bits, kept_bob_bits, estimator.qber, seed)),
+            ("privacy_amplification", lambda: privacy.amplify(cascade.bits, estimator.qber, cascade.leaked_bits, seed)),
+        ]
+        for name, stage in stages:
+            rng = randomness.make_rng(seed)  # every stage times the same draws
+            results.append(result(name, {"num_bits": num_bits}, time_call(stage, repeat)))
+    return results
+
+
+def session_pair(key_bytes, cipher=hybrid_cipher.CIPHER_OTP):
+    # A server and a client session sharing key_bytes of key, as after a round
+    alice, bob = Session(True, cipher=cipher), Session(False)
+    key = os.urandom(key_bytes)
+    alice.pool.add(key)
+    bob.pool.add(key)
+    return alice, bob
+
+
+def bench_cipher(payloads, repeat, messages=100, cipher=hybrid_cipher.CIPHER_OTP):
+    results = []
+    for size in payloads:
+        message = "x" * size
+
+        def encrypt_setup():
+            alice, _ = session_pair(2 * size * messages, cipher)
+            return (alice,)
+
+        def encrypt(alice):
+            for _ in range(messages):
+                alice.encrypt(message, timeout=0)
+
+        def decrypt_setup():
+            alice, bob = session_pair(2 * size * messages, cipher)
+            frames = [alice.encrypt(message, timeout=0)[0] for _ in range(messages)]
+            # Writable payloads, like the ones FrameReader hands out
+            return bob, [(memoryview(bytearray(frame))[FRAME_HEADER.size:], frame[0]) for frame in frames]
+
+        def decrypt(bob, payloads):
+            for payload, frame_type in payloads:
+                bob.handle_frame(frame_type, payload, timeout=0)
+
+        params = {"payload_bytes": size, "messages": messages}
+        if cipher != hybrid_cipher.CIPHER_OTP:
+            params["cipher"] = cipher
+        results.append(result("encrypt", params, time_call(encrypt, repeat, encrypt_setup)))
+        results.append(result("decrypt", params, time_call(decrypt, repeat, decrypt_setup)))
+    return results
+
+
+def loopback_exchange(messages, payload_bytes=64):
+    # Returns (seconds to the first key, seconds for the whole exchange)
+    received = {True: 0, False: 0}  # by initiator flag
+    done = threading.Event()
+    sessions = []
+
+    def count(event, session, value):
+        if event == EVENT_MESSAGE:
+            received[session.initiator] += 1
+            if received[True] == received[False] == messages:
+                done.set()
+
+    def on_session(session):
+        sessions.append(session)
+        session.subscribe(count)
+
+    server = AsyncQKDServer('127.0.0.1', 0, on_session=on_session)
+    server.start_in_thread()
+    message = "x" * payload_bytes
+    start = time.perf_counter()
+    peer = Peer.connect('127.0.0.1', server.port)
+    peer.session.subscribe(count)
+    peer.start()
+    try:
+        peer.wait_for_key()
+        handshake = time.perf_counter() - start
+        replies = [server.send_threadsafe(sessions[0], message) for _ in range(messages)]
+        for _ in range(messages):
+            peer.send(message, timeout=EXCHANGE_TIMEOUT)
+        for reply in replies:
+            reply.result(EXCHANGE_TIMEOUT)
+        if not done.wait(EXCHANGE_TIMEOUT):
+            raise TimeoutError(f"Only {received} messages arrived")
+        return handshake, time.perf_counter() - start
+    finally:
+        peer.close()
+        server.stop_threadsafe().result(EXCHANGE_TIMEOUT)
+
+
+def bench_loopback(messages, repeat):
+    runs = [loopback_exchange(messages) for _ in range(repeat)]
+    return [
+        result("loopback_handshake", {}, [handshake for handshake, _ in runs]),
+        result("loopback_exchange", {"messages": messages}, [total for _, total in runs]),
+    ]
+
+
+def run(sizes, payloads, messages, repeat, seed=0):
+    results = bench_stages(sizes, repeat, seed=seed) + bench_cipher(payloads, repeat)
+    if hybrid_cipher.available():
+        for cipher in hybrid_cipher.ALGORITHMS:
+            results += bench_cipher(payloads, repeat, cipher=cipher)
+    results += bench_loopback(messages, repeat)
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "repeat": repeat,
+            "seed": seed,
+        },
+        "results": results,
+    }
+
+
+def compare(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    # Returns [(key, baseline best, current best, ratio)] of the regressions
+    old = {result_key(entry): entry for entry in baseline["results"]}
+    regressions = []
+    for entry in report["results"]:
+        key = result_key(entry)
+        if key not in old:
+            continue
+        ratio = entry["best"] / old[key]["best"]
+        entry["baseline"] = old[key]["best"]
+        entry["ratio"] = ratio
+        if ratio > 1 + tolerance:
+            regressions.append((key, old[key]["best"], entry["best"], ratio))
+    return regressions
+
+
+def print_report(report):
+    for entry in report["results"]:
+        line = f"{result_key(entry):60} best {entry['best'] * 1e3:10.3f} ms  median {entry['median'] * 1e3:10.3f} ms"
+        if "ratio" in entry:
+            line += f"  x{entry['ratio']:.2f} vs baseline"
+        print(line)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the QKD pipeline")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="num_bits for the BB84 stages")
+    parser.add_argument("--payloads", type=int, nargs="+", default=DEFAULT_PAYLOADS, help="message sizes in bytes")
+    parser.add_argument("--messages", type=int, default=DEFAULT_MESSAGES, help="messages each way in the loopback exchange")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", nargs="?", const=BASELINE_PATH, help="compare against this baseline file")
+    parser.add_argument("--save-baseline", nargs="?", const=BASELINE_PATH, help="also store the results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="allowed slowdown, e.g. 0.25 for 25%%")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    report = run(args.sizes, args.payloads, args.messages, args.repeat, args.seed)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+
+    print_report(report)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(report['results'])} results to {args.output}")
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.save_baseline}")
+
+    for key, old, new, ratio in regressions:
+        print(f"REGRESSION {key}: {old * 1e3:.3f} ms -> {new * 1e3:.3f} ms (x{ratio:.2f})")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+# Cascade information reconciliation.
+# Bob corrects his sifted key towards Alice's by comparing parities of
+# blocks of the key over several passes, each pass using a larger block size
+# and a fresh shuffle shared through a public seed. Parities come from prefix
+# sums, so every block of every pass is handled in one vectorized step, and
+# all binary searches running at the same time (across blocks and passes)
+# share one request per search level. A pass costs one round trip for its
+# block parities plus ceil(log2(block size)) for a wave of binary searches,
+# and every bit a wave flips can make blocks of earlier passes odd again,
+# which takes another wave. Four passes over 10^4 to 10^6 bits take about
+# 35 to 110 round trips in all, against one per odd block unbatched.
+#
+# Cascade.run() is a generator: it yields parity requests
+# (pass_ids, starts, ends) and expects Alice's parities to be sent back in.
+# That keeps it independent of the transport; reconcile() runs it locally.
+
+import struct
+import numpy as np
+
+DEFAULT_PASSES = 4
+MIN_QBER = 0.01  # block sizes are capped as if the QBER were at least this
+
+REQUEST_HEADER = struct.Struct('!I')  # number of ranges
+
+
+def block_sizes(qber, num_bits, passes=DEFAULT_PASSES):
+    # Original Cascade choice: k1 ~ 0.73 / QBER, doubled on every later pass
+    first = max(1, int(np.ceil(0.73 / max(qber, MIN_QBER))))
+    return [max(1, min(num_bits, first << i)) for i in range(passes)]
+
+
+def shuffles(num_bits, seed, passes=DEFAULT_PASSES):
+    # Pass 0 works on the key as is; later passes on seeded shuffles of it
+    rng = np.random.default_rng(seed)
+    return [np.arange(num_bits)] + [rng.permutation(num_bits) for _ in range(passes - 1)]
+
+
+def block_bounds(num_bits, block_size):
+    starts = np.arange(0, num_bits, block_size)
+    return starts, np.minimum(starts + block_size, num_bits)
+
+
+def prefix_parities(bits):
+    # prefix[i] = parity of bits[:i], so parity of bits[a:b] = prefix[b] ^ prefix[a]
+    prefix = np.zeros(len(bits) + 1, dtype=np.uint8)
+    np.bitwise_xor.accumulate(bits, out=prefix[1:])
+    return prefix
+
+
+def encode_request(pass_ids, starts, ends):
+    return b''.join((
+        REQUEST_HEADER.pack(len(starts)),
+        np.asarray(pass_ids, dtype=np.uint8).tobytes(),
+        np.asarray(starts, dtype='>u4').tobytes(),
+        np.asarray(ends, dtype='>u4').tobytes(),
+    ))
+
+
+def decode_request(payload):
+    (count,) = REQUEST_HEADER.unpack_from(payload)
+    position = REQUEST_HEADER.size
+    pass_ids = np.frombuffer(payload, dtype=np.uint8, count=count, offset=position)
+    position += count
+    starts = np.frombuffer(payload, dtype='>u4', count=count, offset=position).astype(np.int64)
+    position += 4 * count
+    ends = np.frombuffer(payload, dtype='>u4', count=count, offset=position).astype(np.int64)
+    return pass_ids, starts, ends
+
+
+class CascadeResponder:
+    # Alice's side: answers parity requests on her (fixed) sifted key
+    def __init__(self, alice_bits, seed, passes=DEFAULT_PASSES):
+        alice_bits = np.asarray(alice_bits, dtype=np.uint8)
+        self._prefix = np.stack([prefix_parities(alice_bits[order]) for order in shuffles(len(alice_bits), seed, passes)])
+        self.leaked_bits = 0
+
+    def parities(self, pass_ids, starts, ends):
+        self.leaked_bits += len(starts)
+        return self._prefix[pass_ids, ends] ^ self._prefix[pass_ids, starts]
+
+
+class Cascade:
+    # Bob's side: corrects self.bits in place
+    def __init__(self, bob_bits, qber, seed, passes=DEFAULT_PASSES):
+        self.bits = np.array(bob_bits, dtype=np.uint8)
+        self.qber = qber
+        self.orders = np.stack(shuffles(len(self.bits), seed, passes))  # one shuffle per row
+        self.block_sizes = block_sizes(qber, len(self.bits), passes)
+        self.bounds = [block_bounds(len(self.bits), size) for size in self.block_sizes]
+        self.alice_parities = []  # Alice's block parities, per finished pass
+        self.leaked_bits = 0
+        self.round_trips = 0
+        self.passes_used = 0
+        self.corrected_bits = 0
+
+    def _ask(self, pass_ids, starts, ends):
+        self.leaked_bits += len(starts)
+        self.round_trips += 1
+
+    def _odd_blocks(self):
+        # Blocks, over every pass so far, whose parity differs from Alice's
+        pass_ids, starts, ends = [], [], []
+        for p, alice_parities in enumerate(self.alice_parities):
+            block_starts, block_ends = self.bounds[p]
+            bob_parities = np.bitwise_xor.reduceat(self.bits[self.orders[p]], block_starts)
+            odd = np.flatnonzero(bob_parities != alice_parities)
+            pass_ids.append(np.full(len(odd), p, dtype=np.uint8))
+            starts.append(block_starts[odd])
+            ends.append(block_ends[odd])
+        return np.concatenate(pass_ids), np.concatenate(starts), np.concatenate(ends)
+
+    def _correct(self):
+        # Binary-searches every odd block at once until all parities match
+        while True:
+            pass_ids, low, high = self._odd_blocks()
+            if not len(low):
+                return
+            prefix = np.stack([prefix_parities(self.bits[order]) for order in self.orders[:self.passes_used]])
+            while True:
+                active = np.flatnonzero(high - low > 1)
+                if not len(active):
+                    break
+                ids, mid = pass_ids[active], (low[active] + high[active]) // 2
+                alice = yield ids, low[active], mid
+                self._ask(ids, low[active], mid)
+                bob = prefix[ids, mid] ^ prefix[ids, low[active]]
+                left = alice != bob  # the error is in the left half
+                high[active] = np.where(left, mid, high[active])
+                low[active] = np.where(left, low[active], mid)
+
+            # Different searches may end on the same bit; flip it once
+            errors = np.unique(self.orders[pass_ids, low])
+            self.bits[errors] ^= 1
+            self.corrected_bits += len(errors)
+
+    def run(self):
+        for p in range(len(self.orders)):
+            if not len(self.bits):
+                return
+            starts, ends = self.bounds[p]
+            pass_ids = np.full(len(starts), p, dtype=np.uint8)
+            alice = yield pass_ids, starts, ends
+            self._ask(pass_ids, starts, ends)
+            self.alice_parities.append(np.asarray(alice, dtype=np.uint8))
+            self.passes_used = p + 1
+            yield from self._correct()
+
+
+def drive(cascade, responder):
+    # Runs a Cascade against a local responder (no network)
+    steps = cascade.run()
+    try:
+        request = next(steps)
+        while True:
+            request = steps.send(responder.parities(*request))
+    except StopIteration:
+        pass
+    return cascade
+
+
+def reconcile(alice_bits, bob_bits, qber, seed=None, passes=DEFAULT_PASSES):
+    # Returns the finished Cascade: .bits, .leaked_bits, .passes_used, .round_trips
+    seed = np.random.SeedSequence(seed).entropy if seed is None else seed
+    return drive(Cascade(bob_bits, qber, seed, passes), CascadeResponder(alice_bits, seed, passes))
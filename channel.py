@@ -0,0 +1,214 @@
+# Physical channel model and decoy-state key rates for sizing links.
+# bb84.py simulates a perfect channel photon by photon. Here the channel is
+# fiber with attenuation, a lossy detector with dark counts and optical
+# misalignment, and the source sends weak coherent pulses at a signal and a
+# decoy intensity. Key rates come from the decoy-state GLLP bound
+# (vacuum + weak decoy, Ma, Qi, Zhao and Lo 2005), evaluated in closed form,
+# so every array argument broadcasts: a whole grid of source settings by
+# distances is one 2-D NumPy computation instead of one run per setting.
+#
+#     python channel.py --distances 0:200:401 --mu 0.2:0.8:61 --nu 0.05 0.1 0.2 --plot
+
+import argparse
+import csv
+import time
+
+import numpy as np
+
+# Defaults: the GYS experiment used by Ma et al. (1550 nm, 2 MHz)
+ATTENUATION_DB_PER_KM = 0.21
+DETECTOR_EFFICIENCY = 0.045  # Bob's transmittance times detector efficiency
+DARK_COUNT = 1.7e-6  # background yield Y0 per pulse
+MISALIGNMENT = 0.033  # probability a detected photon hits the wrong detector
+EC_EFFICIENCY = 1.22  # error correction leaks f * H2(E) bits per sifted bit
+REPETITION_RATE = 2e6  # pulses per second
+SIFTING = 0.5  # fraction of pulses measured in the matching basis
+DECOY_GAP = 1e-6  # smallest relative gap between the decoy and signal intensities
+
+KEY_RATE_COLUMNS = ["mu", "nu", "distance_km", "gain", "qber", "key_rate", "key_rate_bps"]
+
+
+def entropy(p):
+    # Binary entropy of an array of probabilities; 0 at 0 and 1
+    p = np.clip(p, 0.0, 1.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        h = -p * np.log2(p) - (1 - p) * np.log2(1 - p)
+    return np.nan_to_num(h)
+
+
+def transmittance(distance_km, attenuation=ATTENUATION_DB_PER_KM, detector_efficiency=DETECTOR_EFFICIENCY):
+    # Overall probability that a photon sent is detected
+    return detector_efficiency * 10 ** (-attenuation * np.asarray(distance_km, dtype=float) / 10)
+
+
+def gain(intensity, eta, dark_count=DARK_COUNT):
+    # Probability that a pulse of mean photon number intensity is detected
+    return dark_count + 1 - np.exp(-eta * intensity)
+
+
+def error_rate(intensity, eta, dark_count=DARK_COUNT, misalignment=MISALIGNMENT):
+    # QBER of the pulses of one intensity; dark counts are right half the time
+    detected = 1 - np.exp(-eta * intensity)
+    return (dark_count / 2 + misalignment * detected) / gain(intensity, eta, dark_count)
+
+
+def single_photon_bounds(mu, nu, eta, dark_count=DARK_COUNT, misalignment=MISALIGNMENT):
+    # Lower bound on the single-photon yield Y1 and upper bound on its error
+    # rate e1 from the signal (mu), weak decoy (nu) and vacuum gains. nan
+    # unless 0 < nu < mu; as nu nears mu the bound is all rounding error.
+    q_mu, q_nu = gain(mu, eta, dark_count), gain(nu, eta, dark_count)
+    e_nu = error_rate(nu, eta, dark_count, misalignment)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        y1 = mu / (mu * nu - nu ** 2) * (q_nu * np.exp(nu) - q_mu * np.exp(mu) * nu ** 2 / mu ** 2
+                                         - (mu ** 2 - nu ** 2) / mu ** 2 * dark_count)
+        y1 = np.where((nu > 0) & (nu < mu * (1 - DECOY_GAP)), np.clip(y1, 0.0, 1.0), np.nan)
+        e1 = (e_nu * q_nu * np.exp(nu) - dark_count / 2) / (y1 * nu)
+    return y1, np.clip(np.nan_to_num(e1, nan=0.5), 0.0, 0.5)
+
+
+def key_rate(distance_km, mu, nu=None, attenuation=ATTENUATION_DB_PER_KM, detector_efficiency=DETECTOR_EFFICIENCY,
+             dark_count=DARK_COUNT, misalignment=MISALIGNMENT, ec_efficiency=EC_EFFICIENCY, sifting=SIFTING):
+    # Secure key bits per pulse, never negative. Every argument may be an
+    # array; they broadcast, e.g. mu of shape (settings, 1) against
+    # distance_km of shape (distances,). nu=None gives the infinite-decoy
+    # limit (the single-photon yield and error rate known exactly).
+    # Returns (key rate, gain, QBER) of the signal pulses.
+    eta = transmittance(distance_km, attenuation, detector_efficiency)
+    q_mu = gain(mu, eta, dark_count)
+    e_mu = error_rate(mu, eta, dark_count, misalignment)
+    if nu is None:
+        y1 = dark_count + eta
+        e1 = (dark_count / 2 + misalignment * eta) / y1
+    else:
+        y1, e1 = single_photon_bounds(mu, nu, eta, dark_count, misalignment)
+    q1 = y1 * mu * np.exp(-mu)
+    rate = sifting * (q1 * (1 - entropy(e1)) - q_mu * ec_efficiency * entropy(e_mu))
+    return np.maximum(np.nan_to_num(rate), 0.0), q_mu, e_mu
+
+
+def sweep(distances, mus, nus=None, repetition_rate=REPETITION_RATE, **channel):
+    # Key rates of every (mu, nu) pair at every distance, as a dict of
+    # arrays: settings along axis 0, distances along axis 1
+    mu, nu = (np.asarray(mus, dtype=float), None) if nus is None else np.meshgrid(mus, nus, indexing="ij")
+    mu = mu.reshape(-1, 1)
+    nu = None if nu is None else nu.reshape(-1, 1)
+    distances = np.asarray(distances, dtype=float)
+    rates, gains, qbers = key_rate(distances, mu, nu, **channel)
+    return {
+        "mu": mu[:, 0],
+        "nu": np.full(len(mu), np.nan) if nu is None else nu[:, 0],
+        "distance_km": distances,
+        "gain": gains,
+        "qber": qbers,
+        "key_rate": rates,
+        "key_rate_bps": rates * repetition_rate,
+    }
+
+
+def best_settings(results):
+    # Per distance: the highest key rate and the index of the setting reaching it
+    best = np.argmax(results["key_rate"], axis=0)
+    return results["key_rate"][best, np.arange(len(best))], best
+
+
+def max_distance(results):
+    # Per setting: the longest distance with a positive key rate (0 if none)
+    positive = results["key_rate"] > 0
+    last = positive.shape[1] - 1 - np.argmax(positive[:, ::-1], axis=1)
+    return np.where(positive.any(axis=1), results["distance_km"][last], 0.0)
+
+
+def save_key_rates(results, path):
+    settings, distances = results["key_rate"].shape
+    columns = {
+        "mu": np.repeat(results["mu"], distances),
+        "nu": np.repeat(results["nu"], distances),
+        "distance_km": np.tile(results["distance_km"], settings),
+    }
+    for name in ("gain", "qber", "key_rate", "key_rate_bps"):
+        columns[name] = results[name].ravel()
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(KEY_RATE_COLUMNS)
+        writer.writerows(zip(*(columns[name] for name in KEY_RATE_COLUMNS)))
+
+
+def plot_key_rates(results, max_curves=8):
+    import matplotlib.pyplot as plt
+
+    distances = results["distance_km"]
+    if len(results["mu"]) <= max_curves:
+        for i, (mu, nu) in enumerate(zip(results["mu"], results["nu"])):
+            label = f"mu={mu:g}" + ("" if np.isnan(nu) else f", nu={nu:g}")
+            plt.semilogy(distances, results["key_rate_bps"][i], label=label)
+    else:
+        _, best = best_settings(results)
+        plt.semilogy(distances, results["key_rate_bps"][best, np.arange(len(distances))],
+                     label=f"best of {len(results['mu'])} settings")
+    plt.xlabel("Fiber length (km)")
+    plt.ylabel("Secure key rate (bits/s)")
+    plt.title("Decoy-state BB84 key rate")
+    plt.grid(True, which="both")
+    plt.legend()
+    plt.show()
+
+
+def grid_values(values):
+    # Command line values: numbers, or START:STOP:COUNT for a linspace
+    grid = []
+    for value in values:
+        if ":" in value:
+            start, stop, count = value.split(":")
+            grid.extend(np.linspace(float(start), float(stop), int(count)))
+        else:
+            grid.append(float(value))
+    return np.asarray(grid)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Decoy-state BB84 key rate versus fiber length")
+    parser.add_argument("--distances", nargs="+", default=["0:200:201"], help="km: values and/or START:STOP:COUNT ranges")
+    parser.add_argument("--mu", nargs="+", default=["0.48"], help="signal intensities: values and/or START:STOP:COUNT ranges")
+    parser.add_argument("--nu", nargs="+", default=["0.05"], help="decoy intensities: values and/or START:STOP:COUNT ranges")
+    parser.add_argument("--infinite-decoy", action="store_true", help="use the infinite-decoy limit instead of --nu")
+    parser.add_argument("--attenuation", type=float, default=ATTENUATION_DB_PER_KM, help="fiber loss in dB/km")
+    parser.add_argument("--detector-efficiency", type=float, default=DETECTOR_EFFICIENCY)
+    parser.add_argument("--dark-count", type=float, default=DARK_COUNT, help="background yield per pulse")
+    parser.add_argument("--misalignment", type=float, default=MISALIGNMENT)
+    parser.add_argument("--ec-efficiency", type=float, default=EC_EFFICIENCY)
+    parser.add_argument("--repetition-rate", type=float, default=REPETITION_RATE, help="pulses per second")
+    parser.add_argument("--output", default="key_rates.csv")
+    parser.add_argument("--plot", action="store_true")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    started = time.perf_counter()
+    results = sweep(grid_values(args.distances), grid_values(args.mu), None if args.infinite_decoy else grid_values(args.nu),
+                    args.repetition_rate, attenuation=args.attenuation, detector_efficiency=args.detector_efficiency,
+                    dark_count=args.dark_count, misalignment=args.misalignment, ec_efficiency=args.ec_efficiency)
+    elapsed = time.perf_counter() - started
+    settings, distances = results["key_rate"].shape
+    print(f"{settings} settings x {distances} distances in {elapsed * 1e3:.1f} ms")
+
+    reach = max_distance(results)
+    best = np.argmax(reach)
+    nu = results["nu"][best]
+    print(f"Longest reach: {reach[best]:g} km with mu={results['mu'][best]:g}" + ("" if np.isnan(nu) else f", nu={nu:g}"))
+    rates, chosen = best_settings(results)
+    for i in np.linspace(0, distances - 1, min(distances, 6)).astype(int):
+        if rates[i]:
+            print(f"  {results['distance_km'][i]:7.1f} km: {rates[i] * args.repetition_rate:12.4g} bits/s "
+                  f"(mu={results['mu'][chosen[i]]:g}, QBER {results['qber'][chosen[i], i]:.2%})")
+        else:
+            print(f"  {results['distance_km'][i]:7.1f} km: no secure key")
+
+    save_key_rates(results, args.output)
+    print(f"Wrote {settings * distances} rows to {args.output}")
+    if args.plot:
+        plot_key_rates(results)
+
+
+if __name__ == "__main__":
+    main()
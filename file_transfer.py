@@ -0,0 +1,226 @@
+# Streaming file transfer over the encrypted channel.
+# A file goes out as a start frame (size, chunk size, encrypted name), one
+# frame per fixed-size chunk and an end frame carrying the encrypted BLAKE2b
+# digest of the whole file. Every chunk is read into one reused buffer,
+# hashed and encrypted with the session's cipher (in place for the one-time
+# pad, at the send lane offset it takes), and a chunk is only read once the
+# previous frame was handed to the socket, so a slow connection holds the
+# reader back and memory use does not depend on the file size.
+# The receiver decrypts each chunk and appends it to a .part file, checks
+# chunk order and sizes as they come, and renames the file into place only
+# if the digest matches.
+#
+#     python async_server.py --download-dir downloads --cipher aes-gcm
+#     python file_transfer.py big.iso --cipher aes-gcm
+
+import argparse
+import hashlib
+import itertools
+import os
+import time
+
+import metrics
+from framing import FILE_CHUNK, FILE_END, FILE_START, FRAME_FILE_CHUNK, FRAME_FILE_END, FRAME_FILE_START, encode_frame
+from hybrid_cipher import CIPHER_OTP, CIPHERS
+from session import ProtocolError
+
+DEFAULT_CHUNK_BYTES = 1 << 18
+DIGEST_BYTES = 32
+MAX_CHUNK_BYTES = 1 << 24  # largest chunk a receiver accepts
+
+_transfer_ids = itertools.count(1)
+
+
+def file_digest():
+    return hashlib.blake2b(digest_size=DIGEST_BYTES)
+
+
+def safe_name(name, transfer_id):
+    # Only the last path component of what the sender calls the file
+    name = os.path.basename(name.replace("\\", "/"))
+    return name if name not in ("", ".", "..") else f"file-{transfer_id}"
+
+
+def unique_path(directory, name):
+    base, extension = os.path.splitext(name)
+    path = os.path.join(directory, name)
+    for copy in itertools.count(1):
+        if not os.path.exists(path) and not os.path.exists(path + ".part"):
+            return path
+        path = os.path.join(directory, f"{base} ({copy}){extension}")
+
+
+class Transfer:
+    # Progress and outcome of one file, sent or received
+    def __init__(self, transfer_id, name, size, path):
+        self.id = transfer_id
+        self.name = name
+        self.size = size
+        self.path = path
+        self.transferred = 0
+        self.chunks = 0
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def __repr__(self):
+        return f"<Transfer {self.id} {self.name} {self.transferred}/{self.size} bytes>"
+
+    @property
+    def seconds(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def throughput(self):
+        # bytes per second
+        return self.transferred / self.seconds if self.seconds else 0.0
+
+
+class FileSender:
+    def __init__(self, session, path, chunk_size=DEFAULT_CHUNK_BYTES):
+        if session.cipher == CIPHER_OTP:
+            # A pad chunk takes its key in one piece, and the server only
+            # keeps target_bytes of key ready per direction
+            chunk_size = min(chunk_size, session.pool.target_bytes)
+        self.session = session
+        self.chunk_size = chunk_size
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self.transfer = Transfer(next(_transfer_ids), os.path.basename(path), size, path)
+        self._name = self.transfer.name.encode()
+        self._buffer = bytearray(chunk_size)
+        self._started = False
+
+    @property
+    def next_bytes(self):
+        # Plaintext bytes of the next frame, to wait for its key first
+        if not self._started:
+            return len(self._name)
+        if self.transfer.transferred < self.transfer.size:
+            return min(self.chunk_size, self.transfer.size - self.transfer.transferred)
+        return DIGEST_BYTES
+
+    def _frame(self, frame_type, header, fields, data, timeout):
+        payload_type, payload_header, ciphertext = self.session.seal(data, timeout)
+        return encode_frame(frame_type, header.pack(*fields, payload_type), payload_header, ciphertext)
+
+    def frames(self, timeout=None):
+        # Yields the frames of the file one at a time; timeout applies to
+        # every wait for key
+        transfer = self.transfer
+        try:
+            self._started = True
+            yield self._frame(FRAME_FILE_START, FILE_START, (transfer.id, transfer.size, self.chunk_size),
+                              bytearray(self._name), timeout)
+            digest = file_digest()
+            view = memoryview(self._buffer)
+            while transfer.transferred < transfer.size:
+                count = self._file.readinto(view[:self.next_bytes])
+                if not count:
+                    raise OSError(f"{transfer.path} shrank to {transfer.transferred} bytes while being sent")
+                chunk = view[:count]
+                digest.update(chunk)
+                transfer.transferred += count
+                transfer.chunks += 1
+                metrics.FILE_BYTES.inc(count, role=self.session.role, direction="sent")
+                yield self._frame(FRAME_FILE_CHUNK, FILE_CHUNK, (transfer.id, transfer.chunks - 1), chunk, timeout)
+            yield self._frame(FRAME_FILE_END, FILE_END, (transfer.id, transfer.chunks), bytearray(digest.digest()), timeout)
+            transfer.finished = time.perf_counter()
+        finally:
+            self._file.close()
+
+
+class FileReceiver:
+    # Set as session.file_receiver to accept files into directory; the
+    # session emits EVENT_FILE with the Transfer of every complete file
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.transfers = {}  # transfer id -> (Transfer, open .part file, running digest)
+
+    def _open(self, session, frame_type, header, payload, timeout):
+        # Decrypts the data or sealed payload behind the struct
+        fields = header.unpack_from(payload)
+        _, data = session.unseal(fields[-1], payload[header.size:], timeout)
+        return fields[:-1], data
+
+    def _transfer(self, transfer_id):
+        if transfer_id not in self.transfers:
+            raise ProtocolError(f"File frame for unknown transfer {transfer_id}")
+        return self.transfers[transfer_id]
+
+    def handle_frame(self, session, frame_type, payload, timeout=None):
+        # Returns the Transfer when a file is complete
+        if frame_type == FRAME_FILE_START:
+            (transfer_id, size, chunk_size), name = self._open(session, frame_type, FILE_START, payload, timeout)
+            if transfer_id in self.transfers:
+                raise ProtocolError(f"Transfer {transfer_id} started twice")
+            if chunk_size > MAX_CHUNK_BYTES:
+                raise ProtocolError(f"Chunks of {chunk_size} bytes, at most {MAX_CHUNK_BYTES} accepted")
+            name = safe_name(str(name, "utf-8"), transfer_id)
+            path = unique_path(self.directory, name)
+            transfer = Transfer(transfer_id, name, size, path)
+            transfer.chunk_size = chunk_size
+            self.transfers[transfer_id] = (transfer, open(path + ".part", "wb"), file_digest())
+            return None
+
+        if frame_type == FRAME_FILE_CHUNK:
+            (transfer_id, index), chunk = self._open(session, frame_type, FILE_CHUNK, payload, timeout)
+            transfer, f, digest = self._transfer(transfer_id)
+            if index != transfer.chunks:
+                raise ProtocolError(f"Transfer {transfer_id}: chunk {index} arrived, expected {transfer.chunks}")
+            if len(chunk) > transfer.chunk_size or transfer.transferred + len(chunk) > transfer.size:
+                raise ProtocolError(f"Transfer {transfer_id}: chunk {index} runs past the announced size")
+            digest.update(chunk)
+            f.write(chunk)
+            transfer.transferred += len(chunk)
+            transfer.chunks += 1
+            metrics.FILE_BYTES.inc(len(chunk), role=session.role, direction="received")
+            return None
+
+        (transfer_id, chunks), sent_digest = self._open(session, frame_type, FILE_END, payload, timeout)
+        transfer, f, digest = self._transfer(transfer_id)
+        del self.transfers[transfer_id]
+        f.close()
+        if chunks != transfer.chunks or transfer.transferred != transfer.size or bytes(sent_digest) != digest.digest():
+            os.remove(transfer.path + ".part")
+            raise ProtocolError(f"Transfer {transfer_id} ({transfer.name}) failed its integrity check")
+        os.replace(transfer.path + ".part", transfer.path)
+        transfer.finished = time.perf_counter()
+        return transfer
+
+    def close(self):
+        # Drops unfinished files
+        for transfer, f, _ in self.transfers.values():
+            f.close()
+            os.remove(transfer.path + ".part")
+        self.transfers.clear()
+
+
+def print_transfer(transfer):
+    print(f"{transfer.name}: {transfer.transferred} bytes in {transfer.chunks} chunks, "
+          f"{transfer.seconds:.2f} s, {transfer.throughput / 1e6:.3g} MB/s")
+
+
+def main():
+    from peer import Peer
+
+    parser = argparse.ArgumentParser(description="Send files to a QKD server over the encrypted channel")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=12345)
+    parser.add_argument("--cipher", choices=CIPHERS, default=CIPHER_OTP,
+                        help="otp needs one key byte per file byte; an AEAD needs 32 per session key")
+    parser.add_argument("--chunk-bytes", type=int, default=DEFAULT_CHUNK_BYTES)
+    parser.add_argument("--key-timeout", type=float, default=60, help="seconds to wait for key before a chunk")
+    args = parser.parse_args()
+
+    peer = Peer.connect(args.host, args.port, cipher=args.cipher).start()
+    try:
+        for path in args.files:
+            print_transfer(peer.send_file(path, args.key_timeout, args.chunk_bytes))
+    finally:
+        peer.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+# Length-prefixed frames for the messaging connection.
+# Every frame is a 1-byte type and a 4-byte payload length followed by the
+# payload, so back-to-back frames can be coalesced or split by TCP in any
+# way and still come out one at a time on the other side. A declared length
+# above MAX_PAYLOAD_BYTES is a protocol error, raised before any buffer is
+# grown for it.
+# FrameReader receives with recv_into straight into one preallocated buffer
+# and hands out payloads as memoryviews over it, so the receive path makes
+# no per-frame copies. FrameWriter sends from a queue on its own thread and
+# coalesces whatever piled up into one vectored write.
+
+import collections
+import socket
+import struct
+import threading
+import time
+
+import metrics
+
+# Frame types
+FRAME_HANDSHAKE = 1  # server -> client: photons and Alice's bases for a round
+FRAME_BASES = 2  # client -> server: Bob's bases for the round
+FRAME_SIFT = 3  # server -> client: result of sifting the round
+FRAME_DATA = 4  # key lane offset + ciphertext
+FRAME_CONTROL = 5  # connection control, e.g. CONTROL_QUIT
+FRAME_PARITY = 6  # Cascade parity request (client -> server) or answer (server -> client)
+FRAME_RECONCILED = 7  # client -> server: reconciliation finished
+FRAME_RESUME = 8  # stored key on each side (client -> server first, then the answer)
+FRAME_SEALED = 9  # hybrid cipher: AEAD header + ciphertext and tag
+FRAME_FILE_START = 10  # file transfer: id, size, chunk size, then the encrypted file name
+FRAME_FILE_CHUNK = 11  # file transfer: id, chunk index, then one encrypted chunk
+FRAME_FILE_END = 12  # file transfer: id, chunk count, then the encrypted digest of the file
+FRAME_KEY_REQUEST = 13  # client -> server: send-lane key a blocked sender is waiting for
+FILE_FRAMES = (FRAME_FILE_START, FRAME_FILE_CHUNK, FRAME_FILE_END)
+
+FRAME_NAMES = {
+    FRAME_HANDSHAKE: "handshake",
+    FRAME_BASES: "bases",
+    FRAME_SIFT: "sift",
+    FRAME_DATA: "data",
+    FRAME_CONTROL: "control",
+    FRAME_PARITY: "parity",
+    FRAME_RECONCILED: "reconciled",
+    FRAME_RESUME: "resume",
+    FRAME_SEALED: "sealed",
+    FRAME_FILE_START: "file_start",
+    FRAME_FILE_CHUNK: "file_chunk",
+    FRAME_FILE_END: "file_end",
+    FRAME_KEY_REQUEST: "key_request",
+}
+
+CONTROL_QUIT = b'quit'
+
+FRAME_HEADER = struct.Struct('!BI')  # frame type, payload length
+DATA_HEADER = struct.Struct('!Qd')  # key lane offset of the ciphertext, send time (Unix seconds)
+SIFT_RESULT = struct.Struct('!QQ8s')  # sifted bits, round seed, digest of Alice's key; then her sample bits
+RECONCILED = struct.Struct('!QQQ8s')  # sample errors, bits leaked by Cascade, bits it corrected, digest of the corrected key
+SEALED_HEADER = struct.Struct('!BQQd')  # AEAD algorithm, key lane offset of the session key, message counter, send time
+# File frames: the struct, then a data or sealed payload (DATA_HEADER or
+# SEALED_HEADER and ciphertext) of the frame type in the last field
+FILE_START = struct.Struct('!QQIB')  # transfer id, file size, chunk size, payload frame type
+FILE_CHUNK = struct.Struct('!QQB')  # transfer id, chunk index, payload frame type
+FILE_END = struct.Struct('!QQB')  # transfer id, chunk count, payload frame type
+KEY_REQUEST = struct.Struct('!Q')  # lane offset the client's send lane has to reach
+RESUME = struct.Struct('!16sQQQQ')  # key store identity (zeros: none), then consumed and end offsets of the sender's send and recv lanes
+
+DEFAULT_BUFFER_SIZE = 1 << 16
+MAX_PAYLOAD_BYTES = (1 << 24) + 1024  # the largest frame: a file chunk of file_transfer.MAX_CHUNK_BYTES and its headers
+DEFAULT_QUEUE_BYTES = 1 << 20  # frame bytes a FrameWriter holds before put() blocks
+MAX_BATCH_BYTES = 1 << 20  # most bytes in one write
+MAX_BATCH_FRAMES = 1024  # buffers in one sendmsg (IOV_MAX on Linux and macOS)
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def check_length(frame_type, length):
+    if length > MAX_PAYLOAD_BYTES:
+        raise ProtocolError(f"{FRAME_NAMES.get(frame_type, frame_type)} frame of {length} bytes, "
+                            f"at most {MAX_PAYLOAD_BYTES} accepted")
+
+
+def encode_frame(frame_type, *parts):
+    payload_length = sum(len(part) for part in parts)
+    if payload_length > MAX_PAYLOAD_BYTES:
+        raise ValueError(f"Frame payload of {payload_length} bytes, at most {MAX_PAYLOAD_BYTES} can be sent")
+    return b''.join((FRAME_HEADER.pack(frame_type, payload_length), *parts))
+
+
+def send_frame(sock, frame_type, *parts):
+    sock.sendall(encode_frame(frame_type, *parts))
+
+
+def send_data(sock, offset, ciphertext):
+    send_frame(sock, FRAME_DATA, DATA_HEADER.pack(offset, time.time()), ciphertext)
+
+
+def parse_data(payload):
+    # Returns (key lane offset, send time, ciphertext)
+    offset, sent_at = DATA_HEADER.unpack_from(payload)
+    return offset, sent_at, payload[DATA_HEADER.size:]
+
+
+class FrameReader:
+    def __init__(self, sock, buffer_size=DEFAULT_BUFFER_SIZE):
+        self.sock = sock
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0  # first unparsed byte
+        self._end = 0  # end of received data
+
+    def _fill(self, num_bytes):
+        # Makes sure num_bytes unparsed bytes are in the buffer
+        if self._start == self._end:
+            self._start = self._end = 0
+        if num_bytes > len(self._buffer):
+            # Frame larger than the buffer: grow to fit it
+            buffer = bytearray(max(num_bytes, 2 * len(self._buffer)))
+            buffer[:self._end - self._start] = self._view[self._start:self._end]
+            self._buffer, self._view = buffer, memoryview(buffer)
+            self._end -= self._start
+            self._start = 0
+        elif self._start + num_bytes > len(self._buffer):
+            # Not enough room after the unparsed bytes: move them to the front
+            pending = self._end - self._start
+            self._view[:pending] = self._view[self._start:self._end]
+            self._start, self._end = 0, pending
+
+        # Same loop as handshake.recv_all, but reading in place and taking
+        # whatever else has already arrived
+        while self._end - self._start < num_bytes:
+            received = self.sock.recv_into(self._view[self._end:])
+            if not received:
+                raise ConnectionError("Socket connection closed prematurely")
+            self._end += received
+
+    def read_frame(self):
+        # Returns (frame type, payload memoryview). The payload is only valid
+        # until the next call; copy it if it has to live longer.
+        self._fill(FRAME_HEADER.size)
+        frame_type, length = FRAME_HEADER.unpack_from(self._buffer, self._start)
+        check_length(frame_type, length)
+        self._fill(FRAME_HEADER.size + length)
+        payload_start = self._start + FRAME_HEADER.size
+        self._start = payload_start + length
+        return frame_type, self._view[payload_start:self._start]
+
+
+def set_nodelay(sock, nodelay=True):
+    # True: every write goes out at once (interactive chat). False: Nagle's
+    # algorithm holds small writes back while earlier data is unacknowledged
+    # and batches them, trading latency for fewer packets.
+    if sock.family in (socket.AF_INET, socket.AF_INET6):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(nodelay))
+
+
+class FrameWriter:
+    # Sends frames on its own thread, in the order they were put. When the
+    # socket is idle a frame goes out at once; frames put while a write is in
+    # progress pile up and leave together in one sendmsg, so a burst costs a
+    # few system calls instead of one per frame and partial writes never
+    # reach the caller. put() blocks while max_bytes are waiting, which holds
+    # back whoever produces faster than the connection drains.
+    def __init__(self, sock, max_bytes=DEFAULT_QUEUE_BYTES, nodelay=True, role=None):
+        set_nodelay(sock, nodelay)
+        self.sock = sock
+        self.max_bytes = max_bytes
+        self.role = role  # metrics label
+        self.error = None  # what ended the connection, raised by later puts
+        self.writes = 0
+        self.frames_written = 0
+        self._frames = collections.deque()  # (frame, time it was put)
+        self._queued_bytes = 0  # put and not written yet
+        self._closing = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def put(self, frame, timeout=None):
+        # Raises TimeoutError if the queue stays full for timeout seconds
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._queued_bytes < self.max_bytes or self._closing, timeout):
+                raise TimeoutError(f"Send queue full: {self._queued_bytes} bytes waiting")
+            if self.error is not None:
+                raise ConnectionError(f"Connection lost: {self.error}")
+            if self._closing:
+                raise ConnectionError("Frame writer is closed")
+            self._frames.append((frame, time.perf_counter()))
+            self._queued_bytes += len(frame)
+            self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._frames or self._closing)
+                if not self._frames:
+                    return
+                batch = []
+                size = 0
+                while self._frames and len(batch) < MAX_BATCH_FRAMES and size < MAX_BATCH_BYTES:
+                    frame, queued_at = self._frames.popleft()
+                    batch.append(frame)
+                    size += len(frame)
+                    metrics.SEND_QUEUE_SECONDS.observe(time.perf_counter() - queued_at, role=self.role)
+            if self.error is None:
+                try:
+                    self._write(batch)
+                except OSError as e:
+                    with self._condition:
+                        self.error = e
+                        self._closing = True  # frames still queued are dropped
+                        self._condition.notify_all()  # wake blocked puts now
+            metrics.WRITE_FRAMES.observe(len(batch), role=self.role)
+            with self._condition:
+                self._queued_bytes -= size
+                self.writes += 1
+                self.frames_written += len(batch)
+                self._condition.notify_all()
+
+    def _write(self, frames):
+        if not hasattr(self.sock, "sendmsg"):  # Windows
+            self.sock.sendall(b"".join(frames))
+            return
+        views = [memoryview(frame) for frame in frames]
+        first = 0
+        while first < len(views):
+            sent = self.sock.sendmsg(views[first:])
+            while first < len(views) and sent >= len(views[first]):
+                sent -= len(views[first])
+                first += 1
+            if sent:
+                views[first] = views[first][sent:]
+
+    def flush(self, timeout=None):
+        # Waits until everything put so far was written
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._queued_bytes, timeout)
+
+    def close(self, timeout=None):
+        # Writes what is queued, then stops the thread
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
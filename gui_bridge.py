@@ -0,0 +1,91 @@
+# Thread-safe bridge from protocol threads to the Tk main loop.
+# Tk widgets may only be touched from the thread running mainloop(), but
+# messages, keys and disconnects are seen on worker threads (the peer's
+# receive loop, the asyncio server, the key producer). Workers only post
+# updates here; the Tk thread drains them once a frame with after():
+# - chat lines go in as one insert per batch, and the chat keeps only the
+#   last SCROLLBACK_LINES lines, so a burst never grows the textbox
+# - label updates are coalesced: a label is redrawn once a frame with its
+#   latest text, and not at all if the text did not change
+# It does not import customtkinter; any Tk-like widgets work.
+
+import collections
+import itertools
+import threading
+
+FRAME_MS = 16  # about 60 drains per second
+SCROLLBACK_LINES = 1000
+
+
+class GuiBridge:
+    def __init__(self, root, chat, scrollback=SCROLLBACK_LINES, frame_ms=FRAME_MS):
+        self.root = root
+        self.chat = chat
+        self.scrollback = scrollback
+        self.frame_ms = frame_ms
+        self.dropped = 0  # lines evicted before they were ever drawn
+        self._lock = threading.Lock()
+        self._lines = collections.deque(maxlen=scrollback)  # (text, tag) not drawn yet
+        self._clear = False
+        self._labels = {}  # widget -> options to apply
+        self._shown = {}  # widget -> options last applied
+        self._calls = []
+        root.after(frame_ms, self._drain)
+
+    def add_line(self, text, tag=None):
+        with self._lock:
+            if len(self._lines) == self.scrollback:
+                self.dropped += 1
+            self._lines.append((text, tag))
+
+    def clear(self):
+        with self._lock:
+            self._lines.clear()
+            self._clear = True
+
+    def set_label(self, widget, **options):
+        # Later calls override earlier ones until the next frame. A callable
+        # value is only called when drawn, e.g. to format the latest key.
+        with self._lock:
+            self._labels.setdefault(widget, {}).update(options)
+
+    def call(self, function, *args, **kwargs):
+        # Runs function on the Tk thread (e.g. messagebox.showinfo)
+        with self._lock:
+            self._calls.append((function, args, kwargs))
+
+    def _drain(self):
+        # Next frame first: a modal dialog below runs a nested event loop
+        # that keeps draining
+        self.root.after(self.frame_ms, self._drain)
+        with self._lock:
+            lines, self._lines = list(self._lines), collections.deque(maxlen=self.scrollback)
+            clear, self._clear = self._clear, False
+            labels, self._labels = self._labels, {}
+            calls, self._calls = self._calls, []
+        if clear or lines:
+            self._draw_chat(lines, clear)
+        for widget, options in labels.items():
+            shown = self._shown.setdefault(widget, {})
+            changed = {}
+            for name, value in options.items():
+                value = value() if callable(value) else value
+                if shown.get(name) != value:
+                    changed[name] = value
+            if changed:
+                widget.configure(**changed)
+                shown.update(changed)
+        for function, args, kwargs in calls:
+            function(*args, **kwargs)
+
+    def _draw_chat(self, lines, clear):
+        self.chat.configure(state='normal')
+        if clear:
+            self.chat.delete('1.0', 'end')
+        for tag, group in itertools.groupby(lines, key=lambda line: line[1]):
+            self.chat.insert('end', "".join(f"{text}\n" for text, _ in group), tag)
+        excess = int(self.chat.index('end-1c').split('.')[0]) - 1 - self.scrollback
+        if excess > 0:
+            self.chat.delete('1.0', f'{excess + 1}.0')
+        self.chat.configure(state='disabled')
+        self.chat.yview('end')
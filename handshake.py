@@ -0,0 +1,90 @@
+# Wire format for the bits/bases handshake.
+# Every array goes out as one record: a fixed header (format version, dtype
+# code, element count) followed by the payload. Bit arrays are packed 8 per
+# byte, so a million-bit handshake is 125 KB instead of 1-8 MB.
+
+import struct
+import numpy as np
+
+HANDSHAKE_VERSION = 1
+
+# dtype codes carried in the header
+DTYPE_PACKED_BITS = 1  # 0/1 values, np.packbits, big-endian bit order
+DTYPE_UINT8 = 2  # raw bytes, one element per byte
+
+HEADER = struct.Struct('!BBQ')  # version, dtype code, element count
+
+
+def recv_all(sock, num_bytes):
+    data = bytearray()
+    while len(data) < num_bytes:
+        packet = sock.recv(num_bytes - len(data))
+        if not packet:
+            raise ConnectionError("Socket connection closed prematurely")
+        data.extend(packet)
+    return data
+
+
+def encode_bits(bits):
+    bits = np.asarray(bits, dtype=np.uint8)
+    return HEADER.pack(HANDSHAKE_VERSION, DTYPE_PACKED_BITS, len(bits)) + np.packbits(bits).tobytes()
+
+
+def encode_bytes(values):
+    values = np.asarray(values, dtype=np.uint8)
+    return HEADER.pack(HANDSHAKE_VERSION, DTYPE_UINT8, len(values)) + values.tobytes()
+
+
+def payload_size(dtype_code, count):
+    if dtype_code == DTYPE_PACKED_BITS:
+        return (count + 7) // 8
+    if dtype_code == DTYPE_UINT8:
+        return count
+    raise ValueError(f"Unknown handshake dtype code: {dtype_code}")
+
+
+def decode(dtype_code, count, payload):
+    data = np.frombuffer(payload, dtype=np.uint8)
+    if dtype_code == DTYPE_PACKED_BITS:
+        return np.unpackbits(data, count=count)
+    return data
+
+
+def send_bits(sock, bits):
+    sock.sendall(encode_bits(bits))
+
+
+def send_bytes(sock, values):
+    sock.sendall(encode_bytes(values))
+
+
+def recv_array(sock):
+    version, dtype_code, count = HEADER.unpack(recv_all(sock, HEADER.size))
+    if version != HANDSHAKE_VERSION:
+        raise ValueError(f"Unsupported handshake version: {version}")
+    payload = recv_all(sock, payload_size(dtype_code, count))
+    return decode(dtype_code, count, payload)
+
+
+def parse_array(buffer, position=0):
+    # Decodes one record out of a received frame; returns (array, next position)
+    version, dtype_code, count = HEADER.unpack_from(buffer, position)
+    if version != HANDSHAKE_VERSION:
+        raise ValueError(f"Unsupported handshake version: {version}")
+    start = position + HEADER.size
+    end = start + payload_size(dtype_code, count)
+    if end > len(buffer):
+        raise ValueError("Truncated handshake record")
+    array = decode(dtype_code, count, buffer[start:end])
+    if dtype_code == DTYPE_UINT8:
+        array = array.copy()  # the frame buffer gets reused
+    return array, end
+
+
+def parse_arrays(buffer):
+    arrays = []
+    position = 0
+    while position < len(buffer):
+        array, position = parse_array(buffer, position)
+        arrays.append(array)
+    return arrays
@@ -0,0 +1,132 @@
+# Hybrid messaging cipher: QKD key seeds AEAD session keys.
+# The one-time pad in xor_cipher.py spends one key byte per message byte, so
+# throughput can never exceed the key rate. In hybrid mode each direction
+# takes a 32-byte session key from its key lane and encrypts with AES-GCM
+# (AES-NI through OpenSSL) or ChaCha20-Poly1305, then takes a fresh session
+# key after rekey_bytes of traffic or rekey_seconds, whichever comes first.
+# Every frame is authenticated; the header (algorithm, key offset, counter,
+# send time) is the associated data, and the counter is the nonce, so a
+# replayed, reordered or altered frame is rejected.
+#
+# The `cryptography` package is only needed for the hybrid modes:
+#
+#     pip install cryptography
+
+import time
+
+from framing import SEALED_HEADER
+
+try:
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+except ImportError:
+    AESGCM = ChaCha20Poly1305 = InvalidTag = None
+
+CIPHER_OTP = "otp"  # xor_cipher.py: one key byte per message byte
+ALGORITHMS = {"aes-gcm": 1, "chacha20-poly1305": 2}
+CIPHERS = [CIPHER_OTP, *ALGORITHMS]
+SESSION_KEY_BYTES = 32
+DEFAULT_REKEY_BYTES = 1 << 26  # 64 MiB of traffic per session key
+DEFAULT_REKEY_SECONDS = 60
+NONCE_PREFIX = bytes(4)  # nonce: 4 zero bytes, then the 8-byte message counter
+
+
+class AuthenticationError(Exception):
+    pass
+
+
+def available():
+    return AESGCM is not None
+
+
+def require():
+    if not available():
+        raise RuntimeError("Hybrid cipher modes need the cryptography package (pip install cryptography)")
+
+
+def make_aead(algorithm_id, key):
+    require()
+    if algorithm_id == ALGORITHMS["aes-gcm"]:
+        return AESGCM(key)
+    if algorithm_id == ALGORITHMS["chacha20-poly1305"]:
+        return ChaCha20Poly1305(key)
+    raise AuthenticationError(f"Unknown cipher algorithm {algorithm_id}")
+
+
+def nonce(counter):
+    return NONCE_PREFIX + counter.to_bytes(8, "big")
+
+
+class HybridSender:
+    # Seals outgoing messages; session keys come from pool.send, so a key
+    # store swapping the lanes (resume) is picked up at the next rotation
+    def __init__(self, pool, algorithm="aes-gcm", rekey_bytes=DEFAULT_REKEY_BYTES, rekey_seconds=DEFAULT_REKEY_SECONDS):
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown cipher {algorithm!r}, expected one of {', '.join(ALGORITHMS)}")
+        require()
+        self.pool = pool
+        self.algorithm_id = ALGORITHMS[algorithm]
+        self.rekey_bytes = rekey_bytes
+        self.rekey_seconds = rekey_seconds
+        self.rotations = 0
+        self._aead = None
+        self._offset = 0  # key lane offset of the session key
+        self._counter = 0
+        self._sealed_bytes = 0
+        self._keyed_at = 0.0
+
+    def _rotation_due(self, num_bytes):
+        return (self._aead is None or self._sealed_bytes + num_bytes > self.rekey_bytes
+                or time.monotonic() - self._keyed_at >= self.rekey_seconds)
+
+    def key_needed(self, num_bytes):
+        # Key lane bytes that sealing a num_bytes message will take
+        return SESSION_KEY_BYTES if self._rotation_due(num_bytes) else 0
+
+    def _rotate(self, timeout):
+        self._offset, key = self.pool.send.take(SESSION_KEY_BYTES, timeout=timeout)
+        self._aead = make_aead(self.algorithm_id, key)
+        self._counter = 0
+        self._sealed_bytes = 0
+        self._keyed_at = time.monotonic()
+        self.rotations += 1
+
+    def seal(self, plaintext, timeout=None):
+        # Returns (header, ciphertext with its 16-byte tag); blocks up to
+        # timeout for a session key when one is due
+        if self._rotation_due(len(plaintext)):
+            self._rotate(timeout)
+        header = SEALED_HEADER.pack(self.algorithm_id, self._offset, self._counter, time.time())
+        ciphertext = self._aead.encrypt(nonce(self._counter), bytes(plaintext), header)
+        self._counter += 1
+        self._sealed_bytes += len(plaintext)
+        return header, ciphertext
+
+
+class HybridReceiver:
+    # Opens sealed frames with the session key the sender's header points to
+    def __init__(self, pool):
+        self.pool = pool
+        self._aead = None
+        self._offset = -1
+        self._next_counter = 0
+
+    def open(self, payload, timeout=None):
+        # Returns (send time, plaintext); raises AuthenticationError
+        algorithm_id, offset, counter, sent_at = SEALED_HEADER.unpack_from(payload)
+        if offset != self._offset:
+            if offset < self._offset:
+                raise AuthenticationError(f"Frame sealed with retired session key at offset {offset}")
+            key = self.pool.recv.take_at(offset, SESSION_KEY_BYTES, timeout=timeout)
+            self._aead = make_aead(algorithm_id, key)
+            self._offset = offset
+            self._next_counter = 0
+        if counter < self._next_counter:
+            raise AuthenticationError(f"Replayed frame: counter {counter}, expected at least {self._next_counter}")
+        header = bytes(payload[:SEALED_HEADER.size])
+        try:
+            plaintext = self._aead.decrypt(nonce(counter), bytes(payload[SEALED_HEADER.size:]), header)
+        except InvalidTag:
+            raise AuthenticationError("Frame failed authentication") from None
+        self._next_counter = counter + 1
+        return sent_at, plaintext
@@ -0,0 +1,189 @@
+# Continuous key pool for one-time-pad messaging.
+# Each exchange round yields fresh key bytes which are split in two lanes,
+# one per direction, so both peers can send at the same time without ever
+# touching the same key bytes. Every byte is handed out once: senders take
+# from their send lane and tag the message with the lane offset, receivers
+# take exactly that offset from their receive lane.
+# A background producer (on the peer that initiates rounds) keeps both lanes
+# topped up to a target reserve, so the send path only waits when a lane is
+# actually empty. The other peer cannot run rounds: when it has to send more
+# than its reserve, it asks for the key (request()).
+# A pool can be attached to a keystore.KeyStore, which keeps both lanes in
+# files so that leftover key outlives the connection and the process.
+
+import threading
+
+DEFAULT_TARGET_BYTES = 1024
+MAX_REQUEST_BYTES = 1 << 24  # most key one request can ask for beyond what was used
+
+
+class KeyExhausted(Exception):
+    pass
+
+
+class KeyLane:
+    def __init__(self, condition):
+        self._condition = condition
+        self._buffer = bytearray()
+        self._start = 0  # lane offset of _buffer[0]
+        self.consumed = 0  # lane offset of the next unused key byte
+        self.wanted = 0  # bytes a blocked caller is waiting for
+        self.requested = 0  # lane offset the other peer's blocked sender is waiting for
+        self.closed = False
+
+    @property
+    def end(self):
+        return self._start + len(self._buffer)
+
+    def available(self):
+        return self.end - self.consumed
+
+    def _append(self, key):
+        self._buffer.extend(key)
+
+    def _wait_for(self, end, timeout):
+        # Called with the condition held
+        self.wanted = end - self.consumed
+        self._condition.notify_all()  # wake the producer
+        try:
+            if not self._condition.wait_for(lambda: self.end >= end or self.closed, timeout) or self.end < end:
+                raise KeyExhausted(f"Key pool empty: need {end - self.consumed} bytes, have {self.available()}")
+        finally:
+            self.wanted = 0
+
+    def _slice(self, offset, num_bytes):
+        key = bytes(self._buffer[offset - self._start:offset - self._start + num_bytes])
+        self.consumed = offset + num_bytes
+        del self._buffer[:self.consumed - self._start]  # used key is never kept around
+        self._start = self.consumed
+        self._condition.notify_all()
+        return key
+
+    def take(self, num_bytes, timeout=None):
+        # Sender side: returns (offset, key bytes)
+        with self._condition:
+            offset = self.consumed
+            if self.end < offset + num_bytes:
+                self._wait_for(offset + num_bytes, timeout)
+            return offset, self._slice(offset, num_bytes)
+
+    def take_at(self, offset, num_bytes, timeout=None):
+        # Receiver side: the offset comes from the sender
+        with self._condition:
+            if offset < self.consumed:
+                raise ValueError(f"Key bytes at offset {offset} were already used")
+            if self.end < offset + num_bytes:
+                self._wait_for(offset + num_bytes, timeout)
+            return self._slice(offset, num_bytes)
+
+    def close(self):
+        self.closed = True
+
+
+class KeyPool:
+    def __init__(self, initiator, refill=None, target_bytes=DEFAULT_TARGET_BYTES):
+        # initiator: True on the peer that runs exchange rounds. It sends on the
+        #   first half of each round's key, the other peer on the second half.
+        # refill: callable running one exchange round and returning its key
+        #   bytes, or None if the round already added them to the pool
+        self.initiator = initiator
+        self.refill = refill
+        self.target_bytes = target_bytes
+        self._condition = threading.Condition()
+        self.send = KeyLane(self._condition)
+        self.recv = KeyLane(self._condition)
+        self._running = False
+        self._thread = None
+        self.error = None  # last exception raised by refill
+
+    def add(self, key):
+        half = len(key) // 2
+        first, second = key[:half], key[half:2 * half]
+        with self._condition:
+            if self.initiator:
+                self.send._append(first)
+                self.recv._append(second)
+            else:
+                self.recv._append(first)
+                self.send._append(second)
+            self._condition.notify_all()
+
+    def attach(self, store, peer_id):
+        # Swaps in the stored lanes kept for peer_id (before any key is pooled)
+        send, recv = store.open(peer_id, self._condition)
+        with self._condition:
+            self.send, self.recv = send, recv
+            self._condition.notify_all()
+
+    def detach(self):
+        # Back to fresh in-memory lanes; stored key stays for a later connection
+        with self._condition:
+            stored = (self.send, self.recv)
+            self.send, self.recv = KeyLane(self._condition), KeyLane(self._condition)
+            for lane in stored:
+                lane.close()
+
+    def resync(self, send, recv):
+        # Matches the stored lanes to the other peer's (consumed, end) offsets
+        with self._condition:
+            self.send.resync(*send)
+            self.recv.resync(*recv)
+            self._condition.notify_all()
+
+    def request(self, recv_end):
+        # Initiator: the other peer's sender needs our recv lane (its send
+        # lane) to reach recv_end
+        with self._condition:
+            self.recv.requested = max(self.recv.requested, min(recv_end, self.recv.consumed + MAX_REQUEST_BYTES))
+            self._condition.notify_all()
+
+    def offsets(self):
+        with self._condition:
+            return self.send.consumed, self.send.end, self.recv.consumed, self.recv.end
+
+    def available(self):
+        with self._condition:
+            return min(self.send.available(), self.recv.available())
+
+    def _needs_refill(self):
+        return any(lane.available() < max(self.target_bytes, lane.wanted) or lane.end < lane.requested
+                   for lane in (self.send, self.recv))
+
+    def needs_refill(self):
+        with self._condition:
+            return not self.send.closed and self._needs_refill()
+
+    def _produce(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: not self._running or self._needs_refill())
+                if not self._running:
+                    return
+            try:
+                key = self.refill()
+                if key:
+                    self.add(key)
+            except Exception as e:
+                self.error = e
+                self.stop()
+
+    def start(self):
+        if self.refill is None:
+            raise ValueError("Only a pool with a refill callable can run a producer")
+        self._running = True
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        # Also releases any sender or receiver still blocked on an empty lane
+        with self._condition:
+            self._running = False
+            self.send.closed = self.recv.closed = True
+            self._condition.notify_all()
+
+    def close(self):
+        # Stops the pool and releases stored lanes
+        self.stop()
+        with self._condition:
+            self.send.close()
+            self.recv.close()
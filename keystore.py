@@ -0,0 +1,217 @@
+# Persistent, memory-mapped key store.
+# Pooled key bytes are written to one file per peer and direction instead of
+# living only in memory, so a restarted client or server picks up the key
+# left over from earlier connections instead of paying for fresh exchange
+# rounds. Files are memory-mapped: a reserve of gigabytes costs address
+# space, not RAM, and only the pages that are touched are read in.
+#
+# Each lane file is a header page followed by the packed key bytes. The
+# header holds (base, end, consumed) lane offsets in two checksummed slots
+# written alternately, so a write torn by a crash leaves the previous state
+# intact. The consumed offset is stored before key bytes are handed out, so
+# a crash can lose key but never hand the same bytes out twice.
+#
+#     store = KeyStore("qkd_keys")
+#     peer = Peer.connect(host, port, key_store=store)
+
+import hashlib
+import mmap
+import os
+import struct
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from keypool import KeyExhausted, KeyLane
+
+MAGIC = b'QKDKEYS1'
+HEADER_SIZE = mmap.ALLOCATIONGRANULARITY  # data starts on the first page after the header
+STATE = struct.Struct('!QQQQ')  # sequence, base, end, consumed; then an 8-byte checksum
+SLOT_OFFSETS = (64, 128)
+GROW_BYTES = 1 << 20  # smallest data region; it doubles as key is added
+IDENTITY_FILE = "identity"
+
+
+class KeyStoreBusy(Exception):
+    pass
+
+
+def checksum(data):
+    return hashlib.blake2b(data, digest_size=8).digest()
+
+
+def lock_file(fd):
+    # Exclusive, non-blocking lock on an open file, released when it is
+    # closed; False if another connection or process holds it
+    try:
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)  # the first byte, from offset 0
+    except OSError:
+        return False
+    return True
+
+
+class MappedLane(KeyLane):
+    # A KeyLane whose bytes and offsets live in a memory-mapped file. Lane
+    # offsets keep counting across restarts; base is the lane offset of the
+    # first byte in the data region.
+    def __init__(self, path, condition, sync=True):
+        super().__init__(condition)
+        self.path = path
+        self.sync = sync  # msync every update, so state survives power loss and not just a crash
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if not lock_file(self._fd):
+            os.close(self._fd)
+            raise KeyStoreBusy(f"Key store {path} is in use by another connection")
+        try:
+            self._load()
+        except Exception:
+            os.close(self._fd)
+            raise
+
+    def _load(self):
+        if os.fstat(self._fd).st_size < HEADER_SIZE:
+            os.ftruncate(self._fd, HEADER_SIZE + GROW_BYTES)
+            self._map = mmap.mmap(self._fd, 0)
+            self._map[:len(MAGIC)] = MAGIC
+            self._sequence, self.base, self._end, self.consumed = 0, 0, 0, 0
+            self._write_header()
+            return
+        self._map = mmap.mmap(self._fd, 0)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{self.path} is not a key store")
+        states = []
+        for offset in SLOT_OFFSETS:
+            record = self._map[offset:offset + STATE.size]
+            if self._map[offset + STATE.size:offset + STATE.size + 8] == checksum(record):
+                states.append(STATE.unpack(record))
+        if not states:
+            raise ValueError(f"Corrupt key store header in {self.path}")
+        self._sequence, self.base, self._end, self.consumed = max(states)
+
+    @property
+    def end(self):
+        return self._end
+
+    def available(self):
+        # consumed may be past end after a resync: those offsets were used
+        return max(0, self._end - self.consumed)
+
+    def _position(self, offset):
+        return HEADER_SIZE + offset - self.base
+
+    def _flush(self, position, length):
+        if self.sync:
+            start = position - position % mmap.ALLOCATIONGRANULARITY
+            self._map.flush(start, position + length - start)
+
+    def _write_header(self):
+        self._sequence += 1
+        record = STATE.pack(self._sequence, self.base, self._end, self.consumed)
+        offset = SLOT_OFFSETS[self._sequence % 2]
+        self._map[offset:offset + STATE.size + 8] = record + checksum(record)
+        self._flush(0, HEADER_SIZE)
+
+    def _remap(self, size):
+        self._map.close()
+        os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, 0)
+
+    def _append(self, key):
+        if self._map is None:
+            return  # closed: the next resume trims the other side to match
+        if self.consumed >= self._end and self._end > self.base:
+            # Everything was used: start the data region over so the file
+            # does not keep growing over a long-lived connection
+            self.base = self._end
+            self._write_header()
+            self._remap(HEADER_SIZE + GROW_BYTES)
+        position = self._position(self._end)
+        if position + len(key) > len(self._map):
+            size = max(position + len(key), 2 * len(self._map) - HEADER_SIZE)
+            self._remap(size + -size % mmap.ALLOCATIONGRANULARITY)
+        self._map[position:position + len(key)] = key
+        self._flush(position, len(key))  # the bytes are on disk before the header points at them
+        self._end += len(key)
+        self._write_header()
+
+    def _slice(self, offset, num_bytes):
+        if self._map is None:
+            raise KeyExhausted(f"Key store {self.path} is closed")
+        self.consumed = offset + num_bytes
+        self._write_header()
+        position = self._position(offset)
+        key = self._map[position:position + num_bytes]
+        # Used key is not kept around. Skipped bytes stay until the data
+        # region starts over, but are never handed out.
+        self._map[position:position + num_bytes] = bytes(num_bytes)
+        self._condition.notify_all()
+        return key
+
+    def resync(self, consumed, end):
+        # Matches the other peer's lane: key past either end was pooled on
+        # one side only, and bytes either side used are used
+        self.consumed = max(self.consumed, consumed)
+        self._end = min(self._end, end)
+        self.base = min(self.base, self._end)
+        self._write_header()
+
+    def close(self):
+        super().close()
+        if self._map is not None:
+            self._map.flush()
+            self._map.close()
+            self._map = None
+            os.close(self._fd)  # also releases the lock
+
+
+class KeyStore:
+    # A directory of lane files, two per peer. Only plain attributes, so a
+    # store can be handed to pre-forked worker processes.
+    def __init__(self, directory, sync=True):
+        self.directory = directory
+        self.sync = sync
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def identity(self):
+        # 16 random bytes naming this store to its peers, made once
+        path = os.path.join(self.directory, IDENTITY_FILE)
+        try:
+            with open(path) as f:
+                return bytes.fromhex(f.read().strip())
+        except FileNotFoundError:
+            pass
+        identity = os.urandom(16)
+        temporary = f"{path}.{os.getpid()}"
+        with open(temporary, "w") as f:
+            f.write(identity.hex())
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.link(temporary, path)  # fails if another process made one first
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temporary)
+        return self.identity
+
+    def path(self, peer_id, lane):
+        name = hashlib.blake2b(peer_id.encode(), digest_size=16).hexdigest()
+        return os.path.join(self.directory, f"{name}.{lane}")
+
+    def open(self, peer_id, condition):
+        # Returns the (send, recv) lanes kept for peer_id, locked to the
+        # caller until they are closed
+        send = MappedLane(self.path(peer_id, "send"), condition, self.sync)
+        try:
+            recv = MappedLane(self.path(peer_id, "recv"), condition, self.sync)
+        except Exception:
+            send.close()
+            raise
+        return send, recv
@@ -0,0 +1,206 @@
+# Live QBER, sifted yield and key rate monitor for long-running links.
+# Rounds of a running server, or blocks of a simulation, append one sample
+# each to a fixed-size ring buffer; that costs the key exchange thread a lock
+# and three stores, whatever the plot is doing. A matplotlib timer redraws
+# on the GUI thread: the axes, ticks and labels are rendered once and cached,
+# and each tick only restores that background and blits the three lines, so
+# drawing cost stays the same after hours of operation. A full redraw only
+# happens when a value outgrows its axis (each time it does, the axis grows
+# by half) or the window is resized.
+#
+#     python live_plot.py --simulate --num-bits 100000 --eavesdropping-probability 0.03
+#     python live_plot.py --serve --port 12345 & python loadgen.py --port 12345 --rate 0
+
+import argparse
+import threading
+import time
+
+import numpy as np
+
+import bb84
+import privacy
+import qber
+import randomness
+from cascade import reconcile
+from session import DEFAULT_NUM_BITS, ESTIMATOR_DECAY, EVENT_KEY
+
+DEFAULT_CAPACITY = 600  # samples on screen
+DEFAULT_INTERVAL_MS = 200
+COLUMNS = ["qber", "sifted_yield", "key_rate"]
+# Plotted columns: label and initial top of the y axis
+PLOTS = {
+    "qber": ("QBER", 0.15),
+    "sifted_yield": ("Sifted bits per photon", 0.6),
+    "key_rate": ("Key rate (bits/s)", 1000.0),
+}
+HEADROOM = 1.5  # an axis grows to this multiple of the value that outgrew it
+
+
+class RingBuffer:
+    # The latest capacity samples of each column. Every sample is stored
+    # twice, at i and i + capacity, so the latest samples are always one
+    # contiguous slice, oldest first: appending and reading take constant
+    # time however many samples came before.
+    def __init__(self, capacity=DEFAULT_CAPACITY, columns=COLUMNS):
+        self.capacity = capacity
+        self.columns = list(columns)
+        self.count = 0  # samples appended in total
+        self._data = np.full((len(self.columns), 2 * capacity), np.nan)
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def append(self, *values):
+        with self._lock:
+            self._data[:, self._next] = values
+            self._data[:, self._next + self.capacity] = values
+            self._next = (self._next + 1) % self.capacity
+            self.count += 1
+
+    def latest(self):
+        # Returns {column: the last capacity values, oldest first}; slots
+        # not filled yet are nan
+        with self._lock:
+            window = self._data[:, self._next:self._next + self.capacity].copy()
+        return dict(zip(self.columns, window))
+
+
+def watch_session(session, buffer):
+    # Appends a sample to buffer for every round the session pools; returns
+    # the subscribed callback (session.unsubscribe it to stop)
+    last = [time.perf_counter()]
+
+    def on_event(event, event_session, value):
+        if event != EVENT_KEY:
+            return
+        now = time.perf_counter()
+        sifted = event_session.sifted_bits + event_session.sample_bits
+        buffer.append(event_session.estimator.qber, sifted / event_session.num_bits, len(value) * 8 / (now - last[0]))
+        last[0] = now
+
+    session.subscribe(on_event)
+    return on_event
+
+
+def simulate(buffer, num_bits=DEFAULT_NUM_BITS, eavesdropping_probability=0.0, rng=None, stop=None, blocks=None):
+    # Runs blocks of the full pipeline (BB84, QBER sample, Cascade, privacy
+    # amplification) and appends a sample per block until stop is set
+    rng = randomness.generator(rng)
+    estimator = qber.QBEREstimator(decay=ESTIMATOR_DECAY)
+    block = 0
+    while not (stop and stop.is_set()) and (blocks is None or block < blocks):
+        started = time.perf_counter()
+        sifted_alice_bits, sifted_bob_bits = bb84.run_block(num_bits, eavesdropping_probability, rng)
+        _, kept_alice_bits, kept_bob_bits = qber.estimate(sifted_alice_bits, sifted_bob_bits, estimator, rng)
+        key_bits = 0
+        if not estimator.exceeded:
+            cascade = reconcile(kept_alice_bits, kept_bob_bits, estimator.qber, int(rng.integers(0, 2**63)))
+            # Corrected bits were checked too, as in Session._pool_round
+            estimator.update(cascade.corrected_bits, len(cascade.bits))
+            key_bits = privacy.secret_key_length(len(cascade.bits), estimator.upper, cascade.leaked_bits)
+        buffer.append(estimator.qber, len(sifted_alice_bits) / num_bits, key_bits / (time.perf_counter() - started))
+        block += 1
+
+
+class LivePlot:
+    def __init__(self, buffer, interval_ms=DEFAULT_INTERVAL_MS, title="QKD link"):
+        import matplotlib.pyplot as plt
+
+        self.buffer = buffer
+        self.interval_ms = interval_ms
+        self.fig, axes = plt.subplots(len(PLOTS), 1, sharex=True, figsize=(9, 7))
+        self.fig.suptitle(title)
+        x = np.arange(1 - buffer.capacity, 1)
+        self.lines = {}
+        for ax, (column, (label, top)) in zip(axes, PLOTS.items()):
+            self.lines[column], = ax.plot(x, np.full(buffer.capacity, np.nan), animated=True)
+            ax.set_xlim(x[0], 0)
+            ax.set_ylim(0, top)
+            ax.set_ylabel(label)
+            ax.grid(True)
+        axes[-1].set_xlabel("Samples ago")
+        self.status = axes[0].text(0.01, 0.95, "", transform=axes[0].transAxes, va="top", animated=True)
+        self.redraws = 0  # full redraws; every other update is a blit
+        self.updates = 0
+        self._background = None
+        self._timer = None
+        self.fig.canvas.mpl_connect("draw_event", self._on_draw)
+
+    def _on_draw(self, event):
+        # Everything but the animated artists was just drawn: keep it
+        self._background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self._draw_artists()
+
+    def _draw_artists(self):
+        for line in self.lines.values():
+            self.fig.draw_artist(line)
+        self.fig.draw_artist(self.status)
+
+    def update(self):
+        samples = self.buffer.latest()
+        rescaled = False
+        for column, line in self.lines.items():
+            values = samples[column]
+            line.set_ydata(values)
+            latest = values[-1]
+            if np.isfinite(latest) and latest > line.axes.get_ylim()[1]:
+                line.axes.set_ylim(0, latest * HEADROOM)
+                rescaled = True
+        self.status.set_text(f"{self.buffer.count} samples   QBER {samples['qber'][-1]:.2%}   "
+                             f"key rate {samples['key_rate'][-1]:,.0f} bits/s")
+        canvas = self.fig.canvas
+        if rescaled or self._background is None:
+            canvas.draw()  # _on_draw caches the new background
+            self.redraws += 1
+        else:
+            canvas.restore_region(self._background)
+            self._draw_artists()
+            canvas.blit(self.fig.bbox)
+        canvas.flush_events()
+        self.updates += 1
+
+    def show(self):
+        # Redraws every interval_ms on the GUI thread until the window closes
+        import matplotlib.pyplot as plt
+
+        self._timer = self.fig.canvas.new_timer(interval=self.interval_ms)
+        self._timer.add_callback(self.update)
+        self._timer.start()
+        plt.show()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Live QBER, sifted yield and key rate plot")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--simulate", action="store_true", help="plot blocks of a local simulation")
+    source.add_argument("--serve", action="store_true", help="run a server and plot the rounds of every session")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=12345)
+    parser.add_argument("--num-bits", type=int, default=DEFAULT_NUM_BITS, help="photons per block or exchange round")
+    parser.add_argument("--eavesdropping-probability", type=float, default=0.0)
+    parser.add_argument("--capacity", type=int, default=DEFAULT_CAPACITY, help="samples kept on screen")
+    parser.add_argument("--interval", type=int, default=DEFAULT_INTERVAL_MS, help="milliseconds between redraws")
+    parser.add_argument("--seed", type=int)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    buffer = RingBuffer(args.capacity)
+    if args.simulate:
+        stop = threading.Event()
+        rng = randomness.make_rng(args.seed)
+        threading.Thread(target=simulate, args=(buffer, args.num_bits, args.eavesdropping_probability, rng, stop),
+                         daemon=True).start()
+        title = f"Simulation: {args.num_bits} photons per block, eavesdropping {args.eavesdropping_probability:g}"
+    else:
+        from async_server import AsyncQKDServer
+
+        server = AsyncQKDServer(args.host, args.port, args.num_bits, args.eavesdropping_probability, seed=args.seed,
+                                on_session=lambda session: watch_session(session, buffer))
+        server.start_in_thread()
+        title = f"Server {args.host}:{server.port}"
+    LivePlot(buffer, args.interval, title).show()
+
+
+if __name__ == "__main__":
+    main()
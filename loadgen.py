@@ -0,0 +1,278 @@
+# Headless load generator for capacity testing a QKD server on localhost.
+# Opens N concurrent client connections on one event loop, each running the
+# real client protocol (answering handshakes with Bob's bases, sifting,
+# Cascade, privacy amplification) through the same Session and
+# AsyncConnection the server uses. Every connection then streams encrypted
+# messages at a given rate and size distribution. Reports time-to-first-key
+# percentiles, message throughput and error and abort counts.
+#
+#     python async_server.py --quiet
+#     python loadgen.py --connections 500 --duration 30 --rate 10 --size lognormal:200:1
+
+import argparse
+import asyncio
+import json
+import resource
+import time
+
+import numpy as np
+
+import metrics
+from async_server import AsyncConnection
+from attacks import parse_attack
+from hybrid_cipher import CIPHER_OTP, CIPHERS
+from randomness import DEFAULT_GENERATOR, GENERATORS
+from session import EVENT_KEY, Session
+
+DEFAULT_CONNECTIONS = 100
+DEFAULT_DURATION = 10.0  # seconds of messaging after the ramp
+DEFAULT_RAMP = 1.0  # seconds over which connections are opened
+DEFAULT_RATE = 10.0  # messages per second per connection (0: as fast as possible)
+DEFAULT_SIZE = "64"
+KEY_TIMEOUT = 30  # seconds a sender waits for more key
+PERCENTILES = (50, 90, 99)
+FILLER = "abcdefghijklmnopqrstuvwxyz0123456789" * 64
+
+
+def size_distribution(spec):
+    # "N" (fixed), "uniform:LOW:HIGH", "exp:MEAN" or "lognormal:MEDIAN:SIGMA";
+    # returns rng -> message size in bytes (at least 1)
+    name, *params = spec.split(":")
+    if not params:
+        size = int(name)
+        return lambda rng: size
+    params = [float(param) for param in params]
+    if name == "uniform":
+        low, high = params
+        return lambda rng: int(rng.integers(low, high + 1))
+    if name == "exp":
+        mean, = params
+        return lambda rng: max(1, int(rng.exponential(mean)))
+    if name == "lognormal":
+        median, sigma = params
+        return lambda rng: max(1, int(rng.lognormal(np.log(median), sigma)))
+    raise ValueError(f"Unknown size distribution {spec!r}")
+
+
+def make_message(size):
+    return FILLER[:size] if size <= len(FILLER) else (FILLER * (size // len(FILLER) + 1))[:size]
+
+
+def raise_file_limit(connections):
+    # Every connection is a file descriptor; the default soft limit is often 1024
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = connections + 64
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        limit = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    summary = {f"p{p}": float(np.percentile(values, p)) for p in PERCENTILES}
+    summary["max"] = float(max(values))
+    return summary
+
+
+class LoadStats:
+    def __init__(self):
+        self.handshakes = []  # seconds from connecting to the first key
+        self.connected = 0
+        self.rounds = 0
+        self.messages = 0
+        self.message_bytes = 0
+        self.errors = {}  # kind -> count
+        self.aborts = 0  # rounds dropped for a QBER above the limit
+        self.reconciliation_failures = 0
+        self.key_waits = 0  # messages that found too little key in the pool
+        self.first_message = None
+        self.last_message = None
+
+    def error(self, kind):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def sent(self, size):
+        now = time.perf_counter()
+        if self.first_message is None:
+            self.first_message = now
+        self.last_message = now
+        self.messages += 1
+        self.message_bytes += size
+
+
+class LoadClient:
+    def __init__(self, host, port, stats, rate, sizes, rng, **session_options):
+        self.host = host
+        self.port = port
+        self.stats = stats
+        self.rate = rate
+        self.sizes = sizes
+        self.rng = rng
+        self.session_options = session_options
+        self.first_key = asyncio.Event()
+        self.loop = None
+
+    def _on_event(self, event, session, value):
+        # Long rounds pool their key on a worker thread: count on the loop
+        if event == EVENT_KEY:
+            self.loop.call_soon_threadsafe(self._round_done, bool(value), session.estimator.exceeded)
+
+    def _round_done(self, pooled, exceeded):
+        self.stats.rounds += 1
+        if not pooled:
+            if exceeded:
+                self.stats.aborts += 1
+            else:
+                self.stats.reconciliation_failures += 1
+        elif not self.first_key.is_set():
+            self.first_key.set()
+
+    async def run(self, deadline):
+        started = time.perf_counter()
+        self.loop = asyncio.get_running_loop()
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+        except OSError:
+            self.stats.error("connect")
+            return
+        session = Session(False, peer=(self.host, self.port), **self.session_options)
+        session.subscribe(self._on_event)
+        connection = AsyncConnection(session, reader, writer)
+        self.stats.connected += 1
+        receiver = asyncio.create_task(connection.receive_frames())
+        sender = asyncio.create_task(self._send_messages(connection, started, deadline))
+        try:
+            done, _ = await asyncio.wait({receiver, sender}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver in done:
+                error = receiver.exception()
+                if isinstance(error, (asyncio.IncompleteReadError, ConnectionError)):
+                    self.stats.error("disconnected")
+                elif error:
+                    self.stats.error(type(error).__name__)
+            else:
+                sender.result()
+        except asyncio.TimeoutError:
+            self.stats.error("key_timeout")
+        except (ConnectionError, OSError):
+            self.stats.error("disconnected")
+        finally:
+            for task in (receiver, sender):
+                task.cancel()
+            await asyncio.gather(receiver, sender, return_exceptions=True)
+            await connection.close()
+
+    async def _send_messages(self, connection, started, deadline):
+        try:
+            await asyncio.wait_for(self.first_key.wait(), max(0, deadline - time.perf_counter()))
+        except asyncio.TimeoutError:
+            self.stats.error("no_key")  # no round produced key before the run ended
+            return
+        self.stats.handshakes.append(time.perf_counter() - started)
+        next_send = time.perf_counter()
+        while time.perf_counter() < deadline:
+            if self.rate:
+                # Poisson arrivals: a fixed schedule would line connections up
+                next_send += self.rng.exponential(1 / self.rate)
+                delay = next_send - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if time.perf_counter() >= deadline:
+                    break
+            size = self.sizes(self.rng)
+            if connection.session.pool.send.available() < connection.session.key_needed(size):
+                self.stats.key_waits += 1  # the server is not keeping up with key
+            try:
+                await asyncio.wait_for(connection.send(make_message(size)), min(KEY_TIMEOUT, deadline - time.perf_counter()))
+            except asyncio.TimeoutError:
+                if time.perf_counter() < deadline:
+                    raise
+                break
+            self.stats.sent(size)
+
+
+async def run_load(host, port, connections, duration, ramp, rate, size, seed=None, **session_options):
+    stats = LoadStats()
+    sizes = size_distribution(size)
+    seeds = np.random.SeedSequence(seed).spawn(connections)
+    start = time.perf_counter()
+    deadline = start + ramp + duration
+    tasks = []
+    for index in range(connections):
+        message_seed, session_seed = seeds[index].spawn(2)
+        client = LoadClient(host, port, stats, rate, sizes, np.random.default_rng(message_seed), seed=session_seed, **session_options)
+        tasks.append(asyncio.create_task(client.run(deadline)))
+        if ramp:
+            await asyncio.sleep(ramp / connections)
+    await asyncio.gather(*tasks)
+    return report(stats, connections, time.perf_counter() - start)
+
+
+def report(stats, connections, elapsed):
+    window = (stats.last_message - stats.first_message) if stats.messages > 1 else 0.0
+    phases = {}
+    for labels, (counts, total) in metrics.PHASE_SECONDS.snapshot().items():
+        count = sum(counts)
+        if count:
+            phases[dict(labels)["phase"]] = total / count
+    return {
+        "connections": connections,
+        "connected": stats.connected,
+        "elapsed": elapsed,
+        "time_to_first_key": percentiles(stats.handshakes),
+        "rounds": stats.rounds,
+        "mean_phase_seconds": phases,  # client side of each round
+        "messages": stats.messages,
+        "message_bytes": stats.message_bytes,
+        "messages_per_second": stats.messages / window if window else 0.0,
+        "bytes_per_second": stats.message_bytes / window if window else 0.0,
+        "key_waits": stats.key_waits,
+        "eavesdrop_aborts": stats.aborts,
+        "reconciliation_failures": stats.reconciliation_failures,
+        "errors": stats.errors,
+    }
+
+
+def print_report(summary):
+    print(f"Connections: {summary['connected']}/{summary['connections']} in {summary['elapsed']:.1f} s")
+    if summary["time_to_first_key"]:
+        print("Time to first key: " + ", ".join(f"{name} {value * 1e3:.1f} ms" for name, value in summary["time_to_first_key"].items()))
+    print("Mean round phases: " + ", ".join(f"{phase} {value * 1e3:.2f} ms" for phase, value in summary["mean_phase_seconds"].items()))
+    print(f"Rounds: {summary['rounds']} ({summary['eavesdrop_aborts']} aborted, "
+          f"{summary['reconciliation_failures']} failed reconciliation)")
+    print(f"Messages: {summary['messages']} ({summary['messages_per_second']:.0f} msg/s, "
+          f"{summary['bytes_per_second'] / 1e6:.2f} MB/s, {summary['key_waits']} waited for key)")
+    print("Errors: " + (", ".join(f"{kind} {count}" for kind, count in summary["errors"].items()) or "none"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator: many concurrent QKD clients streaming messages")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=12345)
+    parser.add_argument("--connections", type=int, default=DEFAULT_CONNECTIONS)
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION, help="seconds of messaging")
+    parser.add_argument("--ramp", type=float, default=DEFAULT_RAMP, help="seconds over which to open the connections")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help="messages per second per connection, 0 for as fast as possible")
+    parser.add_argument("--size", default=DEFAULT_SIZE, help="message bytes: N, uniform:LOW:HIGH, exp:MEAN or lognormal:MEDIAN:SIGMA "
+                             "(a message longer than the server's key reserve waits for extra rounds)")
+    parser.add_argument("--eavesdropping-probability", type=float, default=0.0, help="intercept photons on the client side")
+    parser.add_argument("--attack", help="an attacks.py strategy on the client side instead, e.g. breidbart or partial:0.2")
+    parser.add_argument("--cipher", choices=CIPHERS, default=CIPHER_OTP, help="what the clients send with")
+    parser.add_argument("--seed", type=int, help="replays the message sizes, arrivals and every client session")
+    parser.add_argument("--generator", choices=GENERATORS, default=DEFAULT_GENERATOR, help="random generator of the client sessions")
+    parser.add_argument("--output", help="also write the report as JSON")
+    args = parser.parse_args()
+
+    raise_file_limit(args.connections)
+    summary = asyncio.run(run_load(args.host, args.port, args.connections, args.duration, args.ramp, args.rate, args.size,
+                                   args.seed, eavesdropping_probability=args.eavesdropping_probability,
+                                   attack=parse_attack(args.attack) if args.attack else None, cipher=args.cipher,
+                                   generator=args.generator))
+    print_report(summary)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
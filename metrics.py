@@ -0,0 +1,240 @@
+# Process-wide counters, gauges and histograms in Prometheus text format.
+# Sessions record into the metrics below; serve() exposes them on a local
+# HTTP endpoint for scraping (GET /metrics). No client library is needed.
+#
+#     metrics.serve(9100)
+#     curl http://127.0.0.1:9100/metrics
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Handshake phases take from microseconds (sifting) to seconds (a slow peer)
+DURATION_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text, registry=None):
+        self.name = name
+        self.help = help_text
+        self._values = {}  # sorted label items -> value
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels):
+        return tuple(sorted(labels.items()))
+
+    def samples(self):
+        # Yields (name suffix, label items, value)
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield "", labels, value
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    def merge(self, values):
+        # Adds another process's snapshot into this metric
+        with self._lock:
+            for key, value in values.items():
+                self._values[key] = self._values.get(key, 0) + value
+
+    def empty_copy(self, registry):
+        return type(self)(self.name, self.help, registry=registry)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{format_labels(labels)} {format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help_text, mean=False, registry=None):
+        self.mean = mean  # averaged rather than summed across processes
+        super().__init__(name, help_text, registry)
+
+    def empty_copy(self, registry):
+        return type(self)(self.name, self.help, self.mean, registry=registry)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=DURATION_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        super().__init__(name, help_text, registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * len(self.buckets), 0.0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels):
+        counts, _ = self._values.get(self._key(labels), ((), 0.0))
+        return sum(counts)
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: (list(counts), total) for labels, (counts, total) in self._values.items()}
+
+    def merge(self, values):
+        with self._lock:
+            for key, (counts, total) in values.items():
+                old_counts, old_total = self._values.get(key) or ([0] * len(self.buckets), 0.0)
+                self._values[key] = ([a + b for a, b in zip(old_counts, counts)], old_total + total)
+
+    def empty_copy(self, registry):
+        return type(self)(self.name, self.help, self.buckets[:-1], registry=registry)
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, (list(counts), total)) for labels, (counts, total) in self._values.items()]
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield "_bucket", labels + (("le", format_value(float(bound))),), cumulative
+            yield "_sum", labels, total
+            yield "_count", labels, cumulative
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+    def snapshot(self):
+        # Plain values, picklable, for sending to another process
+        return {metric.name: metric.snapshot() for metric in self.metrics}
+
+
+REGISTRY = Registry()
+
+
+def aggregate(snapshots, retired=(), registry=REGISTRY):
+    # Sums registry snapshots of several processes (e.g. pre-forked workers)
+    # into a new registry. Retired snapshots (of processes that have exited)
+    # keep counters and histograms monotonic but add nothing to gauges.
+    total = Registry()
+    for metric in registry.metrics:
+        merged = metric.empty_copy(total)
+        for snapshot in retired:
+            if metric.kind != "gauge":
+                merged.merge(snapshot.get(metric.name, {}))
+        for snapshot in snapshots:
+            merged.merge(snapshot.get(metric.name, {}))
+        if metric.kind == "gauge" and metric.mean and snapshots:
+            reporting = {}
+            for snapshot in snapshots:
+                for key in snapshot.get(metric.name, {}):
+                    reporting[key] = reporting.get(key, 0) + 1
+            merged._values = {key: value / reporting[key] for key, value in merged._values.items()}
+    return total
+
+# Key exchange (role is "server" for Alice, "client" for Bob)
+PHASE_SECONDS = Histogram("qkd_phase_seconds", "Duration of each exchange-round phase")
+KEY_BITS = Counter("qkd_key_bits_total", "Key bits by stage: raw photons, sifted, final secret key")
+KEY_RATE = Gauge("qkd_key_rate_bits_per_second", "Final key bits per second of the latest exchange round")
+QBER = Gauge("qkd_qber", "Measured quantum bit error rate (streaming estimate)", mean=True)
+ROUNDS = Counter("qkd_rounds_total", "Finished exchange rounds")
+EAVESDROP_ABORTS = Counter("qkd_eavesdrop_aborts_total", "Rounds dropped because the QBER was above the abort threshold")
+RECONCILIATION_FAILURES = Counter("qkd_reconciliation_failures_total", "Rounds dropped because the keys still differed after Cascade")
+SESSIONS = Gauge("qkd_sessions", "Open sessions")
+RESUME_FAILURES = Counter("qkd_resume_failures_total", "Connections that ran fresh rounds because their stored key was in use")
+
+# Messaging
+MESSAGES = Counter("qkd_messages_total", "Messages by direction (encrypted or decrypted)")
+MESSAGE_BYTES = Counter("qkd_message_bytes_total", "Message bytes by direction (encrypted or decrypted)")
+FILE_BYTES = Counter("qkd_file_bytes_total", "File transfer bytes by direction (sent or received)")
+SESSION_KEYS = Counter("qkd_session_keys_total", "AEAD session keys taken from the key pool by the hybrid cipher")
+SEND_QUEUE_SECONDS = Histogram("qkd_send_queue_seconds", "Time frames wait in the send queue before their write starts")
+WRITE_FRAMES = Histogram("qkd_write_frames", "Frames coalesced into one socket write", buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024))
+MESSAGE_LATENCY = Histogram("qkd_message_latency_seconds", "Send-to-receive latency of messages (sender and receiver clocks)")
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    render = staticmethod(REGISTRY.render)
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes would flood the console
+
+
+def serve(port, host='127.0.0.1', render=REGISTRY.render):
+    # Serves render() (the process's own registry by default) on a daemon
+    # thread; returns the HTTP server
+    handler = type("Handler", (MetricsHandler,), {"render": staticmethod(render)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,152 @@
+# Headless, thread-based peer: one blocking socket driving one Session.
+# This is the engine behind the GUI client and anything else that wants to
+# run the protocol without a display (tests, load tools, scripts). It never
+# imports customtkinter.
+#
+#     peer = Peer.connect('127.0.0.1', 12345)
+#     peer.session.subscribe(callback)   # key / message / closed events
+#     peer.start()
+#     peer.wait_for_key()
+#     peer.send("Hello, Alice!")
+#     peer.send_file("notes.pdf")
+
+import socket
+import threading
+
+from file_transfer import DEFAULT_CHUNK_BYTES, FileSender
+from framing import (CONTROL_QUIT, DEFAULT_QUEUE_BYTES, FILE_FRAMES, FRAME_CONTROL, FRAME_DATA, FRAME_SEALED, FrameReader,
+                     FrameWriter, encode_frame)
+from keypool import KeyExhausted
+from session import EVENT_KEY, EVENT_RESUMED, Session
+
+ROUND_TIMEOUT = 30  # seconds to wait for the other side of a round
+CLOSE_TIMEOUT = 5  # seconds to let queued frames go out on close
+
+
+class Peer:
+    def __init__(self, sock, session, nodelay=True, queue_bytes=DEFAULT_QUEUE_BYTES):
+        # nodelay: TCP_NODELAY, see framing.set_nodelay. Frames leave through
+        # a FrameWriter; a send blocks while queue_bytes are waiting.
+        self.sock = sock
+        self.session = session
+        self.writer = FrameWriter(sock, queue_bytes, nodelay, role=session.role)
+        self.send_lock = threading.Lock()  # Frames are queued from several threads
+        self._seal_lock = threading.Lock()  # Encrypted frames go out in the order they were sealed
+        self._round_done = threading.Condition()
+        self._receiver = None
+        self.error = None
+        session.subscribe(self._on_event)
+
+    @classmethod
+    def connect(cls, host, port, nodelay=True, queue_bytes=DEFAULT_QUEUE_BYTES, **session_options):
+        # Client (Bob) side: the server drives the exchange rounds
+        sock = socket.create_connection((host, port))
+        return cls(sock, Session(False, peer=(host, port), **session_options), nodelay, queue_bytes)
+
+    @classmethod
+    def accept(cls, listener, nodelay=True, queue_bytes=DEFAULT_QUEUE_BYTES, **session_options):
+        # Server (Alice) side: this peer runs rounds to keep both pools filled
+        sock, address = listener.accept()
+        return cls(sock, Session(True, peer=address, **session_options), nodelay, queue_bytes)
+
+    def _on_event(self, event, session, value):
+        if event in (EVENT_KEY, EVENT_RESUMED):
+            with self._round_done:
+                self._round_done.notify_all()
+
+    def start(self):
+        if not self.session.initiator and self.session.key_store is not None:
+            # First frame: picks up the key stored by earlier connections
+            resume = self.session.resume()
+            if resume:
+                self._send_frame(resume)
+        self._receiver = threading.Thread(target=self._receive, daemon=True)
+        self._receiver.start()
+        if self.session.initiator:
+            self.session.pool.refill = self._exchange_round
+            self.session.pool.start()
+        return self
+
+    def _send_frame(self, frame):
+        with self.send_lock:
+            self.writer.put(frame)
+
+    def _exchange_round(self):
+        # Runs on the key pool's producer thread: starts a round once fewer
+        # than pipeline_depth are in flight. The receive thread sifts and
+        # reconciles rounds and pools their key as Bob's frames come in.
+        with self._round_done:
+            if not self._round_done.wait_for(lambda: self.session.closed or self.session.can_start_round(), ROUND_TIMEOUT):
+                raise TimeoutError("Exchange round did not finish")
+        if self.session.closed:
+            return
+        with self.send_lock:
+            self.writer.put(self.session.start_round())
+
+    def _receive(self):
+        reader = FrameReader(self.sock)
+        try:
+            while not self.session.closed:
+                frame_type, payload = reader.read_frame()
+                if frame_type in (FRAME_DATA, FRAME_SEALED) or frame_type in FILE_FRAMES:
+                    self.session.handle_frame(frame_type, payload, timeout=0)
+                    continue
+                # Pooling a round key and announcing it must not be overtaken
+                # by a message already encrypted with that key
+                with self.send_lock:
+                    reply = self.session.handle_frame(frame_type, payload)
+                    if reply:
+                        self.writer.put(reply)
+        except (ConnectionError, OSError):
+            pass
+        except Exception as e:
+            self.error = e  # Protocol violation: drop the connection
+        finally:
+            self.session.close()
+            with self._round_done:
+                self._round_done.notify_all()
+            self.writer.close(CLOSE_TIMEOUT)
+            self.sock.close()
+
+    def wait_for_key(self, num_bytes=1, timeout=ROUND_TIMEOUT):
+        # Blocks until the first exchange round(s) produced num_bytes of sending key
+        with self._round_done:
+            if not self._round_done.wait_for(lambda: self.session.pool.send.available() >= num_bytes or self.session.closed, timeout):
+                raise KeyExhausted("No key received from the exchange rounds")
+
+    def _request_key(self, num_bytes):
+        request = self.session.key_request(num_bytes)
+        if request:
+            self._send_frame(request)
+
+    def send(self, message, timeout=None):
+        # Encrypts with fresh key bytes and sends; returns the ciphertext
+        with self._seal_lock:
+            self._request_key(len(message.encode()))
+            frame, ciphertext = self.session.encrypt(message, timeout=timeout)
+            self._send_frame(frame)
+        return ciphertext
+
+    def send_file(self, path, timeout=None, chunk_size=DEFAULT_CHUNK_BYTES):
+        # Streams a file chunk by chunk; queuing a chunk blocks while the
+        # send queue is full, so the file is read no faster than the
+        # connection drains. timeout bounds each wait for key. Returns the Transfer.
+        sender = FileSender(self.session, path, chunk_size)
+        frames = sender.frames(timeout)
+        while True:
+            with self._seal_lock:  # Messages can go out between chunks
+                self._request_key(sender.next_bytes)
+                frame = next(frames, None)
+                if frame is None:
+                    return sender.transfer
+                self._send_frame(frame)
+
+    def close(self):
+        try:
+            self._send_frame(encode_frame(FRAME_CONTROL, CONTROL_QUIT))
+            self.writer.close(CLOSE_TIMEOUT)
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.session.close()
+        self.sock.close()
@@ -0,0 +1,216 @@
+# Multi-process server: N workers share one port through SO_REUSEPORT.
+# Each worker is a separate process running its own AsyncQKDServer (accept
+# loop, sessions, key pools), so the CPU-heavy parts of the exchange rounds
+# (bit generation, interception, sifting, reconciliation, the cipher) run on
+# every core instead of one. The kernel spreads new connections over the
+# workers. A Supervisor starts the workers, restarts any that die and sums
+# their metrics, which workers report over a queue.
+#
+#     python prefork.py --port 12345 --workers 32 --metrics-port 9100
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import queue
+import socket
+import threading
+import time
+
+import numpy as np
+
+import metrics
+from async_server import AsyncQKDServer, print_events
+from hybrid_cipher import CIPHER_OTP, CIPHERS
+from keypool import DEFAULT_TARGET_BYTES
+from keystore import KeyStore
+from randomness import DEFAULT_GENERATOR, GENERATORS
+from session import DEFAULT_NUM_BITS, DEFAULT_PIPELINE_DEPTH
+
+STATS_INTERVAL = 1.0  # seconds between worker metric reports
+RESTART_DELAY = 1.0  # seconds before restarting a worker that died
+SUMMARY_INTERVAL = 10.0
+
+
+def reuse_port_supported():
+    return hasattr(socket, "SO_REUSEPORT")
+
+
+def reserve_port(host, port):
+    # Binds (without listening) a SO_REUSEPORT socket, so a port that is
+    # taken fails here and not over and over in the workers
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    try:
+        sock.bind((host, port))
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def run_worker(index, host, port, server_options, stats, quiet=True):
+    # Process entry point
+    def on_session(session):
+        if not quiet:
+            print(f"[worker {index}] [{session.id} {session.peer}] connected")
+            session.subscribe(print_events)
+
+    async def report():
+        while True:
+            stats.put((index, os.getpid(), metrics.REGISTRY.snapshot()))
+            await asyncio.sleep(STATS_INTERVAL)
+
+    async def main():
+        # Each worker spawns its sessions' seeds from its own branch of the seed
+        seed = np.random.SeedSequence(server_options.get("seed"), spawn_key=(index,))
+        server = AsyncQKDServer(host, port, on_session=on_session, reuse_port=True, **dict(server_options, seed=seed))
+        await server.start()
+        reporter = asyncio.create_task(report())
+        try:
+            await server.serve_forever()
+        finally:
+            reporter.cancel()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+
+
+class Supervisor:
+    def __init__(self, host='127.0.0.1', port=12345, workers=None, quiet=True, **server_options):
+        # server_options go to every worker's AsyncQKDServer (num_bits,
+        # eavesdropping_probability, key_reserve, backlog, key_store,
+        # pipeline_depth, cipher, rekey_bytes, rekey_seconds, download_dir,
+        # seed, generator). Workers
+        # can share one key store: a client's lanes are locked by whichever
+        # worker it is connected to.
+        if not reuse_port_supported():
+            raise OSError("SO_REUSEPORT is not available on this platform")
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count()
+        self.quiet = quiet
+        self.server_options = server_options
+        self.restarts = 0
+        self.processes = {}  # worker index -> Process
+        self._context = multiprocessing.get_context("spawn")  # safe with threads (GUI, asyncio) in the parent
+        self._stats = self._context.Queue()
+        self._snapshots = {}  # worker index -> (pid, latest registry snapshot)
+        self._retired = []  # last snapshots of workers that exited
+        self._stopping = threading.Event()
+        self._monitor = None
+        self._reserved = None
+
+    def _spawn(self, index):
+        process = self._context.Process(target=run_worker, name=f"qkd-worker-{index}", daemon=True,
+                                        args=(index, self.host, self.port, self.server_options, self._stats, self.quiet))
+        process.start()
+        self.processes[index] = process
+
+    def start(self):
+        # Starts the workers and a thread that restarts them and collects stats
+        self._reserved = reserve_port(self.host, self.port)
+        for index in range(self.workers):
+            self._spawn(index)
+        self._monitor = threading.Thread(target=self._supervise, daemon=True)
+        self._monitor.start()
+        return self
+
+    def _collect(self, timeout):
+        try:
+            index, pid, snapshot = self._stats.get(timeout=timeout)
+        except queue.Empty:
+            return
+        self._snapshots[index] = (pid, snapshot)
+
+    def _supervise(self):
+        while not self._stopping.is_set():
+            self._collect(STATS_INTERVAL)
+            for index, process in list(self.processes.items()):
+                if process.is_alive() or self._stopping.is_set():
+                    continue
+                print(f"Worker {index} (pid {process.pid}) exited with code {process.exitcode}; restarting")
+                pid, snapshot = self._snapshots.pop(index, (None, None))
+                if snapshot and pid == process.pid:
+                    self._retired.append(snapshot)
+                self.restarts += 1
+                time.sleep(RESTART_DELAY)
+                self._spawn(index)
+
+    def registry(self):
+        # Metrics of all workers summed, as a metrics.Registry
+        live = [snapshot for index, (pid, snapshot) in self._snapshots.items()
+                if index in self.processes and self.processes[index].pid == pid]
+        return metrics.aggregate(live, self._retired)
+
+    def render_metrics(self):
+        return self.registry().render()
+
+    def stats(self):
+        # Totals over all workers
+        values = {metric.name: metric.snapshot() for metric in self.registry().metrics}
+
+        def total(metric, **wanted):
+            return sum(value for labels, value in values[metric.name].items() if wanted.items() <= dict(labels).items())
+
+        return {
+            "workers": sum(process.is_alive() for process in self.processes.values()),
+            "restarts": self.restarts,
+            "sessions": total(metrics.SESSIONS),
+            "rounds": total(metrics.ROUNDS),
+            "final_key_bits": total(metrics.KEY_BITS, stage="final"),
+            "messages": total(metrics.MESSAGES, direction="decrypted"),
+            "aborts": total(metrics.EAVESDROP_ABORTS),
+        }
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            process.join(timeout)
+        if self._reserved:
+            self._reserved.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-forked multi-process QKD messaging server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=12345)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes (default: all cores)")
+    parser.add_argument("--num-bits", type=int, default=DEFAULT_NUM_BITS, help="photons per exchange round")
+    parser.add_argument("--eavesdropping-probability", type=float, default=0.0)
+    parser.add_argument("--key-reserve", type=int, default=DEFAULT_TARGET_BYTES, help="key bytes kept ready per direction")
+    parser.add_argument("--metrics-port", type=int, help="serve the summed worker metrics on this port")
+    parser.add_argument("--key-store", help="directory keeping leftover key across connections and restarts")
+    parser.add_argument("--pipeline-depth", type=int, default=DEFAULT_PIPELINE_DEPTH, help="exchange rounds in flight per connection")
+    parser.add_argument("--cipher", choices=CIPHERS, default=CIPHER_OTP, help="otp, or an AEAD keyed from QKD key (needs cryptography)")
+    parser.add_argument("--download-dir", help="accept files from clients into this directory")
+    parser.add_argument("--seed", type=int, help="replays every worker's sessions")
+    parser.add_argument("--generator", choices=GENERATORS, default=DEFAULT_GENERATOR)
+    parser.add_argument("--quiet", action="store_true", help="do not print messages")
+    args = parser.parse_args()
+
+    supervisor = Supervisor(args.host, args.port, args.workers, args.quiet, num_bits=args.num_bits,
+                            eavesdropping_probability=args.eavesdropping_probability, key_reserve=args.key_reserve,
+                            key_store=KeyStore(args.key_store) if args.key_store else None, pipeline_depth=args.pipeline_depth,
+                            cipher=args.cipher, download_dir=args.download_dir, seed=args.seed, generator=args.generator)
+    supervisor.start()
+    print(f"Server is listening on {args.host}:{args.port} with {supervisor.workers} workers")
+    if args.metrics_port:
+        metrics.serve(args.metrics_port, render=supervisor.render_metrics)
+        print(f"Metrics at http://127.0.0.1:{args.metrics_port}/metrics")
+    try:
+        while True:
+            time.sleep(SUMMARY_INTERVAL)
+            print("Stats: " + ", ".join(f"{name} {value:g}" for name, value in supervisor.stats().items()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        supervisor.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# QBER estimation with finite-size confidence bounds.
+# Instead of always sacrificing half of the sifted key, a round reveals only
+# as many sample bits as are needed for the observed QBER to be on the same
+# side of the abort threshold (ERROR_LIMIT) as the true one, with confidence
+# 1 - epsilon; a round whose observed QBER is above it is taken as
+# eavesdropped. Estimates stream across blocks (or exchange rounds): every
+# block of checked bits narrows the bounds, so later blocks need smaller
+# samples. Errors corrected during reconciliation count as checked bits too,
+# at no extra cost in key: fold them in (update(corrected_bits, key_bits))
+# before privacy amplification, whose upper bound the sample alone leaves
+# too wide for any key to survive.
+
+import numpy as np
+
+import randomness
+
+ERROR_LIMIT = 0.10  # abort threshold, below privacy.MAX_QBER (no key can be distilled above that)
+
+DEFAULT_EPSILON = 1e-3  # probability that the true QBER lies outside the bounds
+MIN_WIDTH = 0.005  # never try to pin the QBER down tighter than this
+MIN_SAMPLE_FRACTION = 0.01
+MAX_SAMPLE_FRACTION = 0.5  # what detect_eavesdropping always used to sacrifice
+
+
+def count_errors(alice_bits, bob_bits):
+    return int(np.count_nonzero(alice_bits != bob_bits))
+
+
+def bound_width(checked_bits, epsilon=DEFAULT_EPSILON):
+    # Hoeffding: the observed error rate of checked_bits independent bits is
+    # within this distance of the true QBER, except with probability epsilon
+    if checked_bits <= 0:
+        return 1.0
+    return float(np.sqrt(np.log(1 / epsilon) / (2 * checked_bits)))
+
+
+def bits_for_width(width, epsilon=DEFAULT_EPSILON):
+    return int(np.ceil(np.log(1 / epsilon) / (2 * width ** 2)))
+
+
+def choose_sample(num_bits, sample_size, rng=None):
+    # Returns (sample indices, mask of the bits that stay in the key)
+    sample = randomness.generator(rng).choice(num_bits, sample_size, replace=False)
+    keep = np.ones(num_bits, dtype=bool)
+    keep[sample] = False
+    return sample, keep
+
+
+class QBEREstimator:
+    # Streaming estimate. decay < 1 weights older blocks down, so a QBER that
+    # changes mid-session (an eavesdropper showing up) is not averaged away.
+    def __init__(self, epsilon=DEFAULT_EPSILON, decay=1.0, threshold=ERROR_LIMIT):
+        self.epsilon = epsilon
+        self.decay = decay
+        self.threshold = threshold
+        self.errors = 0.0
+        self.checked = 0.0  # effective number of checked bits
+        self.blocks = 0
+
+    def update(self, errors, checked_bits):
+        self.errors = self.errors * self.decay + errors
+        self.checked = self.checked * self.decay + checked_bits
+        self.blocks += 1
+
+    def update_bits(self, alice_bits, bob_bits):
+        errors = count_errors(alice_bits, bob_bits)
+        self.update(errors, len(alice_bits))
+        return errors
+
+    @property
+    def qber(self):
+        return self.errors / self.checked if self.checked else 0.0
+
+    @property
+    def width(self):
+        return bound_width(self.checked, self.epsilon)
+
+    @property
+    def lower(self):
+        return max(0.0, self.qber - self.width)
+
+    @property
+    def upper(self):
+        return min(1.0, self.qber + self.width)
+
+    @property
+    def exceeded(self):
+        # Eavesdropping detected: the observed QBER is above the threshold
+        return self.qber > self.threshold
+
+    def sample_size(self, num_bits, min_fraction=MIN_SAMPLE_FRACTION, max_fraction=MAX_SAMPLE_FRACTION):
+        # Fewest new bits that put the observed QBER on the true side of the
+        # threshold, given what earlier blocks already showed
+        width = max(abs(self.threshold - self.qber), MIN_WIDTH)
+        needed = bits_for_width(width, self.epsilon) - self.checked * self.decay
+        return int(np.clip(needed, np.ceil(min_fraction * num_bits), max_fraction * num_bits))
+
+
+def estimate(alice_bits, bob_bits, estimator=None, rng=None, **sample_options):
+    # Checks an adaptive sample of one sifted block. Returns (estimator, the
+    # unsampled Alice bits, the unsampled Bob bits).
+    estimator = estimator or QBEREstimator()
+    sample, keep = choose_sample(len(alice_bits), estimator.sample_size(len(alice_bits), **sample_options), rng)
+    estimator.update_bits(alice_bits[sample], bob_bits[sample])
+    return estimator, alice_bits[keep], bob_bits[keep]
+
+
+def estimate_chunks(chunks, estimator=None, rng=None, **sample_options):
+    # Streaming mode over (sifted Alice bits, sifted Bob bits) blocks, e.g.
+    # bb84.simulate_chunks; yields (estimator, kept Alice bits, kept Bob bits)
+    estimator = estimator or QBEREstimator()
+    for alice_bits, bob_bits in chunks:
+        yield estimate(alice_bits, bob_bits, estimator, rng, **sample_options)
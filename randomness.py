@@ -0,0 +1,66 @@
+# Random number generators for the protocol.
+# Every session owns a numpy Generator built from an explicit seed, so
+# sessions on different threads never share (or contend for) one random
+# state, and the same seed replays a session's photons, bases, interceptions
+# and round seeds exactly. Code that gets no generator uses one per thread.
+#
+# Bits and bases are the bulk of the draws. random_bits() takes them 64 at a
+# time from the bit generator's raw output and unpacks them, instead of one
+# bounded integer per bit as rng.integers(0, 2, n) does.
+#
+# Generators: "pcg64" (NumPy's default), "sfc64" (fastest), "philox"
+# (counter-based) and "system", which draws bits and bases from the
+# operating system's CSPRNG (os.urandom). A system generator cannot be
+# replayed; its other draws come from PCG64 seeded from the same source.
+
+import os
+import threading
+
+import numpy as np
+
+BIT_GENERATORS = {"pcg64": np.random.PCG64, "sfc64": np.random.SFC64, "philox": np.random.Philox, "system": np.random.PCG64}
+GENERATORS = list(BIT_GENERATORS)
+DEFAULT_GENERATOR = "pcg64"
+
+_local = threading.local()
+
+
+class SystemGenerator(np.random.Generator):
+    # Marks a generator whose bits come from os.urandom
+    pass
+
+
+def make_rng(seed=None, generator=DEFAULT_GENERATOR):
+    # seed: None (fresh entropy), an int or a numpy SeedSequence
+    if generator not in BIT_GENERATORS:
+        raise ValueError(f"Unknown generator {generator!r}, expected one of {', '.join(GENERATORS)}")
+    if generator == "system":
+        return SystemGenerator(np.random.PCG64(int.from_bytes(os.urandom(16), "little")))
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return np.random.Generator(BIT_GENERATORS[generator](seed))
+
+
+def thread_rng():
+    # The calling thread's generator, for callers that pass none
+    rng = getattr(_local, "rng", None)
+    if rng is None:
+        rng = _local.rng = make_rng()
+    return rng
+
+
+def generator(rng=None):
+    return thread_rng() if rng is None else rng
+
+
+def random_bits(num_bits, rng=None):
+    # num_bits uniform bits as a uint8 array of 0s and 1s
+    rng = generator(rng)
+    if isinstance(rng, SystemGenerator):
+        raw = np.frombuffer(os.urandom((num_bits + 7) // 8), dtype=np.uint8)
+    elif isinstance(rng, np.random.Generator):
+        # Little-endian bytes, so a seed replays the same bits on any machine
+        raw = rng.bit_generator.random_raw((num_bits + 63) // 64).astype("<u8", copy=False).view(np.uint8)
+    else:
+        return rng.randint(0, 2, num_bits, dtype=np.uint8)  # legacy RandomState
+    return np.unpackbits(raw, count=num_bits)
@@ -0,0 +1,526 @@
+# Per-connection protocol state.
+# A Session owns everything one key exchange + chat stream needs: the bits and
+# bases of the current round, the latest sifted key, the error rate and the
+# key pool. It only turns frames into frames and never touches a socket, so
+# the same session drives the threaded apps and the asyncio server alike.
+# Front-ends (the GUIs) attach to a session with subscribe() instead of
+# holding protocol state themselves.
+
+import collections
+import hashlib
+import itertools
+import time
+import numpy as np
+
+import bb84
+import metrics
+import privacy
+import qber
+import randomness
+from cascade import Cascade, CascadeResponder, decode_request, encode_request
+from framing import (CONTROL_QUIT, DATA_HEADER, FILE_FRAMES, FRAME_BASES, FRAME_CONTROL, FRAME_DATA, FRAME_HANDSHAKE,
+                     FRAME_KEY_REQUEST, FRAME_PARITY, FRAME_RECONCILED, FRAME_RESUME, FRAME_SEALED, FRAME_SIFT, KEY_REQUEST,
+                     RECONCILED, RESUME, SIFT_RESULT, ProtocolError, encode_frame, parse_data)
+from handshake import encode_bits, parse_array, parse_arrays
+from hybrid_cipher import CIPHER_OTP, DEFAULT_REKEY_BYTES, DEFAULT_REKEY_SECONDS, HybridReceiver, HybridSender
+from keypool import DEFAULT_TARGET_BYTES, KeyPool
+from keystore import KeyStoreBusy
+from xor_cipher import xor_bytes, xor_into
+
+DEFAULT_NUM_BITS = 4096  # photons per exchange round
+DEFAULT_PIPELINE_DEPTH = 1  # exchange rounds the server keeps in flight at once
+ESTIMATOR_DECAY = 0.8  # weight of earlier rounds in the QBER estimate
+# Streams derived from the public round seed, apart from the Cascade shuffles
+PRIVACY_STREAM = 1
+SAMPLE_STREAM = 2
+
+# Session events passed to subscribers
+EVENT_KEY = "key"  # a round finished and its key was pooled
+EVENT_MESSAGE = "message"  # a chat message was decrypted
+EVENT_CLOSED = "closed"
+EVENT_RESUMED = "resumed"  # stored key from earlier connections is in the pool
+EVENT_NOT_RESUMED = "not_resumed"  # stored key was in use elsewhere; the value is the KeyStoreBusy error
+EVENT_FILE = "file"  # a file transfer finished; the value is file_transfer.Transfer
+
+NO_STORE = bytes(16)  # resume answer of a server that keeps no key for the client
+
+_session_ids = itertools.count(1)
+
+
+def key_digest(key_bits):
+    # Short public check that both sides ended up with the same key
+    return hashlib.blake2b(np.packbits(key_bits).tobytes(), digest_size=8).digest()
+
+
+class Round:
+    # What one side keeps of an exchange round between its frames. Both
+    # sides handle rounds strictly in the order they were started, so with
+    # several rounds in flight a frame's type says which round it is for:
+    # bases answer the oldest round still waiting for bases, and parity and
+    # reconciled frames the oldest round not reconciled yet.
+    def __init__(self):
+        self.started = time.perf_counter()  # perf_counter times for the phase metrics
+        self.phase_started = self.started
+        self.alice_bits = None  # Server: until Bob's bases arrive
+        self.alice_bases = None
+        self.key = None  # sifted key bits, less the sample
+        self.seed = None  # public seed of the round (Cascade shuffles, Toeplitz hash)
+        self.sample_bits = 0
+        self.sample_errors = 0  # Client
+        self.digest = None  # Client: what the reconciled key must hash to
+        self.responder = None  # Server: answers Bob's parity requests
+
+
+class Session:
+    def __init__(self, initiator, num_bits=DEFAULT_NUM_BITS, eavesdropping_probability=0.0,
+                 key_reserve=DEFAULT_TARGET_BYTES, eavesdropper=False, peer=None, key_store=None, attack=None,
+                 pipeline_depth=DEFAULT_PIPELINE_DEPTH, cipher=CIPHER_OTP, rekey_bytes=DEFAULT_REKEY_BYTES,
+                 rekey_seconds=DEFAULT_REKEY_SECONDS, seed=None, generator=randomness.DEFAULT_GENERATOR):
+        # initiator: True on the server (Alice), which prepares the photons and
+        # drives the exchange rounds; False on the client (Bob)
+        # key_store: keystore.KeyStore keeping pooled key across connections
+        # attack: an attacks.py strategy on this side's photons, instead of
+        # intercept-resend with eavesdropping_probability
+        # pipeline_depth: on the server, how many rounds may be in flight. A
+        # new round's photons and bases cross the wire while earlier rounds
+        # are sifted and reconciled, so more rounds per second fit through a
+        # slow link. The client follows whatever depth the server uses.
+        # cipher: what this side sends with, "otp" (one key byte per message
+        # byte) or a hybrid_cipher AEAD ("aes-gcm", "chacha20-poly1305")
+        # keyed from the pool and rotated every rekey_bytes or rekey_seconds.
+        # Either kind of frame is decrypted whatever this side sends with.
+        # seed: int or numpy SeedSequence behind this side's photons, bases,
+        # interceptions and round seeds, so a session replays exactly (None:
+        # fresh entropy, kept in self.seed); generator: a randomness.GENERATORS name
+        self.id = next(_session_ids)
+        self.peer = peer
+        self.key_store = key_store
+        self.initiator = initiator
+        self.num_bits = num_bits
+        self.eavesdropping_probability = eavesdropping_probability
+        self.eavesdropper = eavesdropper
+        self.attack = attack
+        self.pipeline_depth = pipeline_depth
+        self.seed = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        # Round seeds are drawn when Bob's bases arrive, which with several
+        # rounds in flight interleaves with new rounds, so they get a stream
+        # of their own
+        photon_seed, round_seed = self.seed.spawn(2)
+        self.rng = randomness.make_rng(photon_seed, generator)
+        self._round_seeds = randomness.make_rng(round_seed, generator)
+
+        self.alice_bits = None
+        self.alice_bases = None
+        self.bob_bits = None
+        self.bob_bases = None
+        self.key = np.zeros(0, dtype=np.uint8)  # Key bits of the latest round: sifted, then secret once it completes
+        self.error_rate = 0.0  # percent, from the QBER estimator
+        self.rounds = 0
+        self.estimator = qber.QBEREstimator(decay=ESTIMATOR_DECAY)
+
+        # Parameter estimation, reconciliation and privacy amplification of the latest round
+        self.sample_bits = 0  # sifted bits revealed to estimate the QBER
+        self.sifted_bits = 0  # sifted bits left for the key
+        self.corrected_bits = 0  # errors Cascade found, i.e. the measured QBER
+        self.leaked_bits = 0  # parities (and digest bits) revealed publicly
+        self.reconciliation_passes = 0
+        self.reconciliation_round_trips = 0
+        self._measured = collections.deque()  # rounds waiting for the other side's bases or sift frame
+        self._sifted = collections.deque()  # Server: rounds waiting for Bob's reconciled frame
+        self._sifts = collections.deque()  # Client: sift frames of rounds queued behind the one reconciling
+        self._reconciling = None  # Client: the round Cascade is correcting
+        self._cascade = None
+        self._cascade_steps = None
+
+        self.pool = KeyPool(initiator, target_bytes=key_reserve)
+        self.cipher = cipher
+        self._sealer = None if cipher == CIPHER_OTP else HybridSender(self.pool, cipher, rekey_bytes, rekey_seconds)
+        self._opener = HybridReceiver(self.pool)
+        self.file_receiver = None  # file_transfer.FileReceiver accepting incoming files
+        self.messages_sent = 0
+        self.messages_received = 0
+        self.closed = False
+        self._subscribers = []
+        metrics.SESSIONS.inc(role=self.role)
+
+    def __repr__(self):
+        return f"<Session {self.id} {self.peer}>"
+
+    @property
+    def role(self):
+        return "server" if self.initiator else "client"
+
+    def _phase(self, phase, started):
+        # Records how long a round phase took; returns when it ended
+        now = time.perf_counter()
+        metrics.PHASE_SECONDS.observe(now - started, role=self.role, phase=phase)
+        return now
+
+    def subscribe(self, callback):
+        # callback(event, session, value) runs on whichever thread handled the frame
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    def _emit(self, event, value=None):
+        for callback in list(self._subscribers):
+            callback(event, self, value)
+
+    @property
+    def eavesdropping_detected(self):
+        # The rule rounds are aborted by (qber.ERROR_LIMIT)
+        return self.estimator.exceeded
+
+    @property
+    def interception_probability(self):
+        # The eavesdropper flag puts an intercept-resend attacker on every photon
+        return 1.0 if self.eavesdropper else self.eavesdropping_probability
+
+    def _intercept(self, photons, bases):
+        # Only what Bob reads is used: rounds have no loss, so pulses an
+        # attack drops still arrive, and Bob sifts against the real Alice,
+        # so a man in the middle acts as if the channel were authenticated
+        if self.attack is not None:
+            return self.attack.apply(photons, bases, self.rng).photons
+        eaves_bits, _, intercepted = bb84.eavesdrop_and_measure(photons, bases, len(photons), self.interception_probability, self.rng)
+        return bb84.photon_stream(photons, eaves_bits, intercepted)
+
+    @property
+    def rounds_in_flight(self):
+        # Server: rounds started and not pooled yet
+        return len(self._measured) + len(self._sifted)
+
+    def can_start_round(self):
+        return not self.closed and self.rounds_in_flight < self.pipeline_depth
+
+    def _sample(self, exchange_round, sample_size):
+        # Sample positions come from the public round seed, so only Alice's
+        # sample bits have to be sent
+        rng = np.random.default_rng((exchange_round.seed, SAMPLE_STREAM))
+        return qber.choose_sample(len(exchange_round.key), sample_size, rng)
+
+    def _check_sample(self, sample_errors, sample_bits):
+        # Both sides fold in the same counts in the same order, so their
+        # estimators (and the key lengths they derive) stay identical
+        self.sample_bits = sample_bits
+        self.estimator.update(sample_errors, sample_bits)
+        self.error_rate = self.estimator.qber * 100
+        metrics.QBER.set(self.estimator.qber, role=self.role)
+        return not self.estimator.exceeded
+
+    def _pool_round(self, exchange_round, reconciled_bits, digest_matches):
+        # Hashes away what Eve may know, then pools the secret key. A round
+        # whose keys still differ after reconciliation is dropped.
+        started = time.perf_counter()
+        if digest_matches:
+            self.estimator.update(self.corrected_bits, self.sifted_bits)
+            self.error_rate = self.estimator.qber * 100
+            metrics.QBER.set(self.estimator.qber, role=self.role)
+            self.key = privacy.amplify(reconciled_bits, self.estimator.upper, self.leaked_bits, (exchange_round.seed, PRIVACY_STREAM))
+            finished = self._phase("privacy_amplification", started)
+        else:
+            self.key = np.zeros(0, dtype=np.uint8)
+            finished = started
+            if self.estimator.exceeded:
+                metrics.EAVESDROP_ABORTS.inc(role=self.role)
+            else:
+                metrics.RECONCILIATION_FAILURES.inc(role=self.role)
+        key = bb84.key_bytes(self.key)
+        self.rounds += 1
+        metrics.ROUNDS.inc(role=self.role)
+        metrics.KEY_BITS.inc(len(key) * 8, role=self.role, stage="final")
+        metrics.KEY_RATE.set(len(key) * 8 / (finished - exchange_round.started), role=self.role)
+        self.pool.add(key)
+        self._emit(EVENT_KEY, key)
+
+    # Server (Alice) side of a round
+
+    def start_round(self):
+        # Returns the handshake frame for a new round
+        exchange_round = Round()
+        self.alice_bits, self.alice_bases = bb84.prepare_and_send_bits(self.num_bits, self.rng)
+        exchange_round.alice_bits, exchange_round.alice_bases = self.alice_bits, self.alice_bases
+        photons = self._intercept(self.alice_bits, self.alice_bases)
+        frame = encode_frame(FRAME_HANDSHAKE, encode_bits(photons), encode_bits(self.alice_bases))
+        metrics.KEY_BITS.inc(self.num_bits, role=self.role, stage="raw")
+        exchange_round.phase_started = self._phase("generation", exchange_round.started)
+        self._measured.append(exchange_round)
+        return frame
+
+    def finish_round(self, bases_payload):
+        # Takes Bob's bases frame; sifts, sets a sample aside for the QBER
+        # estimate and returns the sift frame, which starts Bob's reconciliation
+        if not self._measured:
+            raise ProtocolError("Bases for no round in flight")
+        exchange_round = self._measured.popleft()
+        started = self._phase("transfer", exchange_round.phase_started)
+        self.bob_bases = parse_array(bases_payload)[0]
+        if len(self.bob_bases) != len(exchange_round.alice_bases):
+            raise ProtocolError(f"Expected {len(exchange_round.alice_bases)} bases, got {len(self.bob_bases)}")
+        alice_bits, alice_bases = exchange_round.alice_bits, exchange_round.alice_bases
+        exchange_round.alice_bits = exchange_round.alice_bases = None
+        exchange_round.key, _ = bb84.sift(alice_bases, self.bob_bases, alice_bits, alice_bits)
+        sifted_bits = len(exchange_round.key)
+        metrics.KEY_BITS.inc(sifted_bits, role=self.role, stage="sifted")
+        started = self._phase("sifting", started)
+        exchange_round.seed = int(self._round_seeds.integers(0, 2**63))
+        sample, keep = self._sample(exchange_round, self.estimator.sample_size(sifted_bits))
+        exchange_round.sample_bits = len(sample)
+        sample_bits, exchange_round.key = exchange_round.key[sample], exchange_round.key[keep]
+        exchange_round.phase_started = self._phase("qber_check", started)
+        exchange_round.responder = CascadeResponder(exchange_round.key, exchange_round.seed)
+        self._sifted.append(exchange_round)
+        sift = SIFT_RESULT.pack(sifted_bits, exchange_round.seed, key_digest(exchange_round.key))
+        return encode_frame(FRAME_SIFT, sift, encode_bits(sample_bits))
+
+    def _reconciling_round(self):
+        # Bob reconciles rounds in order: parities are for the oldest one
+        if not self._sifted:
+            raise ProtocolError("Reconciliation for no round in flight")
+        return self._sifted[0]
+
+    def answer_parities(self, request_payload):
+        pass_ids, starts, ends = decode_request(request_payload)
+        parities = self._reconciling_round().responder.parities(pass_ids, starts, ends)
+        return encode_frame(FRAME_PARITY, encode_bits(parities))
+
+    def complete_round(self, reconciled_payload):
+        # Bob is done correcting: pool our key if his matches it
+        exchange_round = self._reconciling_round()
+        self._sifted.popleft()
+        sample_errors, leaked_bits, corrected_bits, digest = RECONCILED.unpack(reconciled_payload)
+        self._phase("reconciliation", exchange_round.phase_started)
+        self.sifted_bits = len(exchange_round.key)
+        if not self._check_sample(sample_errors, exchange_round.sample_bits):
+            self.corrected_bits = self.leaked_bits = 0
+            self._pool_round(exchange_round, exchange_round.key, False)
+            return
+        self.corrected_bits = corrected_bits
+        self.leaked_bits = exchange_round.responder.leaked_bits + 8 * len(digest)
+        if leaked_bits != self.leaked_bits:
+            raise ProtocolError(f"Leak mismatch: server counted {self.leaked_bits} bits, client {leaked_bits}")
+        self._pool_round(exchange_round, exchange_round.key, digest == key_digest(exchange_round.key))
+
+    # Client (Bob) side of a round
+
+    def answer_round(self, handshake_payload):
+        # Takes the handshake frame; measures and returns Bob's bases frame
+        exchange_round = Round()
+        photons, self.alice_bases = parse_arrays(handshake_payload)
+        self.num_bits = len(photons)
+        photons = self._intercept(photons, self.alice_bases)
+        self.bob_bases = bb84.random_bits(self.num_bits, self.rng)
+        self.bob_bits = bb84.measure(photons, self.alice_bases, self.bob_bases, self.rng)
+        metrics.KEY_BITS.inc(self.num_bits, role=self.role, stage="raw")
+        started = self._phase("generation", exchange_round.started)
+        exchange_round.key, _ = bb84.sift(self.alice_bases, self.bob_bases, self.bob_bits, self.bob_bits)
+        metrics.KEY_BITS.inc(len(exchange_round.key), role=self.role, stage="sifted")
+        exchange_round.phase_started = self._phase("sifting", started)
+        self._measured.append(exchange_round)
+        return encode_frame(FRAME_BASES, encode_bits(self.bob_bases))
+
+    def start_reconciliation(self, sift_payload):
+        # Returns the first parity request, or the reconciled frame of a
+        # dropped round. A sift frame arriving while an earlier round is still
+        # reconciling waits for it; Cascade runs one round at a time so both
+        # estimators see the rounds in the same order.
+        if self._reconciling is not None:
+            self._sifts.append(bytes(sift_payload))
+            return None
+        if not self._measured:
+            raise ProtocolError("Sift result for no round in flight")
+        exchange_round = self._measured.popleft()
+        started = self._phase("transfer", exchange_round.phase_started)
+        sifted_bits, exchange_round.seed, exchange_round.digest = SIFT_RESULT.unpack_from(sift_payload)
+        if sifted_bits != len(exchange_round.key):
+            raise ProtocolError(f"Sifted length mismatch: server has {sifted_bits} bits, client has {len(exchange_round.key)}")
+        alice_sample = parse_array(sift_payload, SIFT_RESULT.size)[0]
+        sample, keep = self._sample(exchange_round, len(alice_sample))
+        exchange_round.sample_errors = qber.count_errors(alice_sample, exchange_round.key[sample])
+        exchange_round.key = exchange_round.key[keep]
+        self.sifted_bits = len(exchange_round.key)
+        accepted = self._check_sample(exchange_round.sample_errors, len(sample))
+        exchange_round.phase_started = self._phase("qber_check", started)
+        if not accepted:
+            # Too noisy to distill anything: skip reconciliation, drop the round
+            self.corrected_bits = self.leaked_bits = 0
+            self._pool_round(exchange_round, exchange_round.key, False)
+            reconciled = encode_frame(FRAME_RECONCILED, RECONCILED.pack(exchange_round.sample_errors, 0, 0, bytes(8)))
+            return reconciled + self._next_reconciliation()
+        self._reconciling = exchange_round
+        self._cascade = Cascade(exchange_round.key, self.estimator.qber, exchange_round.seed)
+        self._cascade_steps = self._cascade.run()
+        return self._reconcile(None)
+
+    def _next_reconciliation(self):
+        # Starts the round whose sift frame came in during the last one
+        return (self.start_reconciliation(self._sifts.popleft()) or b"") if self._sifts else b""
+
+    def _reconcile(self, parities):
+        # Sends the next parity request, or finishes the round
+        if self._reconciling is None:
+            raise ProtocolError("Parities for no round being reconciled")
+        try:
+            request = self._cascade_steps.send(parities)
+        except StopIteration:
+            exchange_round, cascade = self._reconciling, self._cascade
+            self._reconciling = self._cascade = self._cascade_steps = None
+            self._phase("reconciliation", exchange_round.phase_started)
+            digest = key_digest(cascade.bits)
+            self.corrected_bits = cascade.corrected_bits
+            self.leaked_bits = cascade.leaked_bits + 8 * len(digest)
+            self.reconciliation_passes = cascade.passes_used
+            self.reconciliation_round_trips = cascade.round_trips
+            self._pool_round(exchange_round, cascade.bits, digest == exchange_round.digest)
+            reconciled = RECONCILED.pack(exchange_round.sample_errors, self.leaked_bits, self.corrected_bits, digest)
+            return encode_frame(FRAME_RECONCILED, reconciled) + self._next_reconciliation()
+        return encode_frame(FRAME_PARITY, encode_request(*request))
+
+    # Resuming with stored key. The client opens what it kept for this
+    # server and sends its lane offsets; both sides then keep only key the
+    # other has too (the client pools a round just before the server does,
+    # so a dropped connection can leave it one round ahead) and skip key
+    # either side already used.
+
+    def resume(self):
+        # Client: returns the resume frame, or None without a usable store
+        try:
+            self.pool.attach(self.key_store, "%s:%s" % self.peer)
+        except KeyStoreBusy as e:
+            self._not_resumed(e)
+            return None
+        return encode_frame(FRAME_RESUME, RESUME.pack(self.key_store.identity, *self.pool.offsets()))
+
+    def _not_resumed(self, error):
+        # Fresh rounds make up for the stored key
+        metrics.RESUME_FAILURES.inc(role=self.role)
+        self._emit(EVENT_NOT_RESUMED, error)
+
+    def _resync(self, send_consumed, send_end, recv_consumed, recv_end):
+        # The other peer's send lane is our recv lane and the other way round
+        self.pool.resync((recv_consumed, recv_end), (send_consumed, send_end))
+        self._emit(EVENT_RESUMED, self.pool.available())
+
+    def answer_resume(self, resume_payload):
+        # Server: opens the key kept for the client's store identity
+        identity, *offsets = RESUME.unpack(resume_payload)
+        if self.rounds:
+            raise ProtocolError("Resume after the first exchange round")
+        if self.key_store is not None and identity != NO_STORE:
+            try:
+                self.pool.attach(self.key_store, identity.hex())
+            except KeyStoreBusy as e:
+                self._not_resumed(e)  # e.g. the client's previous connection is still open
+            else:
+                self._resync(*offsets)
+                return encode_frame(FRAME_RESUME, RESUME.pack(self.key_store.identity, *self.pool.offsets()))
+        return encode_frame(FRAME_RESUME, RESUME.pack(NO_STORE, 0, 0, 0, 0))
+
+    def finish_resume(self, resume_payload):
+        identity, *offsets = RESUME.unpack(resume_payload)
+        if identity == NO_STORE:
+            self.pool.detach()  # keep our stored key for a server that has its half
+            return
+        self._resync(*offsets)
+
+    # Messages
+
+    def key_needed(self, num_bytes):
+        # Send-lane key bytes the next message of num_bytes will take
+        return num_bytes if self._sealer is None else self._sealer.key_needed(num_bytes)
+
+    def key_request(self, num_bytes):
+        # Client: only the server runs rounds, and it only keeps key_reserve
+        # ready. Returns the frame asking it for the key of a send of
+        # num_bytes, or None if the send lane already holds enough.
+        if self.initiator:
+            return None
+        consumed, end, _, _ = self.pool.offsets()
+        needed = consumed + self.key_needed(num_bytes)
+        return encode_frame(FRAME_KEY_REQUEST, KEY_REQUEST.pack(needed)) if end < needed else None
+
+    def seal(self, data, timeout=None):
+        # Encrypts a writable buffer with the next send-lane key; returns
+        # (FRAME_DATA or FRAME_SEALED, header, ciphertext). The pad works in
+        # place, so the ciphertext is the buffer itself.
+        if self._sealer is not None:
+            rotations = self._sealer.rotations
+            header, ciphertext = self._sealer.seal(data, timeout)
+            if self._sealer.rotations > rotations:
+                metrics.SESSION_KEYS.inc(role=self.role)
+            return FRAME_SEALED, header, ciphertext
+        offset, key = self.pool.send.take(len(data), timeout=timeout)  # Fresh key bytes, used once
+        return FRAME_DATA, DATA_HEADER.pack(offset, time.time()), xor_into(data, key)
+
+    def unseal(self, frame_type, payload, timeout=None):
+        # Returns (send time, plaintext) of a data or sealed payload. Raises
+        # hybrid_cipher.AuthenticationError for a forged or replayed frame.
+        if frame_type == FRAME_SEALED:
+            return self._opener.open(payload, timeout)
+        offset, sent_at, ciphertext = parse_data(payload)
+        key = self.pool.recv.take_at(offset, len(ciphertext), timeout=timeout)  # The sender's key bytes
+        if memoryview(ciphertext).readonly:
+            return sent_at, xor_bytes(ciphertext, key)
+        return sent_at, xor_into(ciphertext, key)  # In place, right in the receive buffer
+
+    def encrypt(self, message, timeout=None):
+        # Returns (data or sealed frame, ciphertext); blocks up to timeout on
+        # an empty pool
+        encrypted = bytearray(message.encode())
+        frame_type, header, ciphertext = self.seal(encrypted, timeout)
+        self.messages_sent += 1
+        metrics.MESSAGES.inc(role=self.role, direction="encrypted")
+        metrics.MESSAGE_BYTES.inc(len(encrypted), role=self.role, direction="encrypted")
+        return encode_frame(frame_type, header, ciphertext), ciphertext
+
+    def decrypt(self, payload, timeout=None, frame_type=FRAME_DATA):
+        sent_at, decrypted = self.unseal(frame_type, payload, timeout)
+        message = str(decrypted, 'utf-8')
+        self.messages_received += 1
+        metrics.MESSAGES.inc(role=self.role, direction="decrypted")
+        metrics.MESSAGE_BYTES.inc(len(decrypted), role=self.role, direction="decrypted")
+        metrics.MESSAGE_LATENCY.observe(max(0.0, time.time() - sent_at), role=self.role)
+        self._emit(EVENT_MESSAGE, message)
+        return message
+
+    def handle_frame(self, frame_type, payload, timeout=None):
+        # Dispatches one received frame. Returns the reply frame, if any.
+        if frame_type in (FRAME_DATA, FRAME_SEALED):
+            self.decrypt(payload, timeout, frame_type)
+        elif frame_type in FILE_FRAMES and self.file_receiver is not None:
+            transfer = self.file_receiver.handle_frame(self, frame_type, payload, timeout)
+            if transfer:
+                self._emit(EVENT_FILE, transfer)
+        elif frame_type == FRAME_HANDSHAKE and not self.initiator:
+            return self.answer_round(payload)
+        elif frame_type == FRAME_SIFT and not self.initiator:
+            return self.start_reconciliation(payload)
+        elif frame_type == FRAME_PARITY and not self.initiator:
+            return self._reconcile(parse_array(payload)[0])
+        elif frame_type == FRAME_BASES and self.initiator:
+            return self.finish_round(payload)
+        elif frame_type == FRAME_PARITY and self.initiator:
+            return self.answer_parities(payload)
+        elif frame_type == FRAME_RECONCILED and self.initiator:
+            self.complete_round(payload)
+        elif frame_type == FRAME_RESUME and self.initiator:
+            return self.answer_resume(payload)
+        elif frame_type == FRAME_KEY_REQUEST and self.initiator:
+            self.pool.request(*KEY_REQUEST.unpack(payload))
+        elif frame_type == FRAME_RESUME and self.key_store is not None:
+            self.finish_resume(payload)
+        elif frame_type == FRAME_CONTROL and payload == CONTROL_QUIT:
+            self.close()
+        else:
+            raise ProtocolError(f"Unexpected frame type {frame_type}")
+        return None
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            metrics.SESSIONS.dec(role=self.role)
+            self.pool.close()
+            if self.file_receiver is not None:
+                self.file_receiver.close()
+            self._emit(EVENT_CLOSED)
@@ -0,0 +1,45 @@
+import asyncio
+import threading
+
+from async_server import AsyncConnection, AsyncQKDServer
+from session import EVENT_MESSAGE, Session
+
+
+def subscribe_messages(session, received, done):
+    def on_event(event, session, value):
+        if event == EVENT_MESSAGE:
+            received.append(value)
+            done.set()
+    session.subscribe(on_event)
+
+
+def test_offloaded_rounds_keep_both_sides_in_step():
+    # offload_bits=0: every round step of both sides runs on the thread pool
+    received, done = [], threading.Event()
+    server = AsyncQKDServer(port=0, num_bits=2048, key_reserve=64, offload_bits=0,
+                            on_session=lambda s: subscribe_messages(s, received, done))
+    server.start_in_thread()
+
+    async def client():
+        reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+        session = Session(False)
+        replies, replied = [], threading.Event()
+        subscribe_messages(session, replies, replied)
+        connection = AsyncConnection(session, reader, writer, offload_bits=0)
+        receiver = asyncio.create_task(connection.receive_frames())
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.wait_for(connection.send("hello"), 10)
+            assert await loop.run_in_executor(None, done.wait, 10)
+            await asyncio.wrap_future(server.send_threadsafe(server.sessions[0], "hi", timeout=10))
+            assert await loop.run_in_executor(None, replied.wait, 10)
+            return replies
+        finally:
+            receiver.cancel()
+            await connection.close()
+
+    try:
+        assert asyncio.run(client()) == ["hi"]
+        assert received == ["hello"]
+    finally:
+        server.stop_threadsafe().result(10)
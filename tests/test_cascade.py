@@ -0,0 +1,37 @@
+import math
+
+import numpy as np
+
+from cascade import block_sizes, reconcile
+
+
+def noisy_keys(num_bits, qber, seed=1):
+    rng = np.random.default_rng(seed)
+    alice = rng.integers(0, 2, num_bits, dtype=np.uint8)
+    bob = alice ^ (rng.random(num_bits) < qber).astype(np.uint8)
+    return alice, bob
+
+
+def test_matching_keys_take_one_round_trip_per_pass():
+    alice, _ = noisy_keys(10000, 0.0)
+    cascade = reconcile(alice, alice.copy(), 0.02, seed=3)
+    assert cascade.round_trips == cascade.passes_used == 4
+    assert cascade.corrected_bits == 0
+    assert np.array_equal(cascade.bits, alice)
+
+
+def test_one_pass_searches_every_odd_block_at_once():
+    alice, bob = noisy_keys(10000, 0.01)
+    cascade = reconcile(alice, bob, 0.01, seed=3, passes=1)
+    block_size = block_sizes(0.01, len(alice))[0]
+    assert cascade.corrected_bits > 10  # many odd blocks...
+    assert cascade.round_trips == 1 + math.ceil(math.log2(block_size))  # ...one search's round trips
+
+
+def test_keys_match_after_reconciliation():
+    alice, bob = noisy_keys(100000, 0.03)
+    cascade = reconcile(alice, bob, 0.03, seed=3)
+    assert np.array_equal(cascade.bits, alice)
+    assert cascade.corrected_bits == np.count_nonzero(alice != bob)
+    assert cascade.leaked_bits > 0
+    assert cascade.round_trips < cascade.corrected_bits // 10
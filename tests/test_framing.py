@@ -0,0 +1,86 @@
+import socket
+import threading
+
+import pytest
+
+from framing import (DATA_HEADER, FILE_CHUNK, FRAME_DATA, FRAME_FILE_CHUNK, FRAME_HEADER, MAX_PAYLOAD_BYTES, SEALED_HEADER,
+                     FrameReader, FrameWriter, ProtocolError, encode_frame, parse_data)
+from file_transfer import MAX_CHUNK_BYTES
+
+
+def test_oversized_length_is_rejected_before_allocating():
+    left, right = socket.socketpair()
+    with left, right:
+        left.sendall(FRAME_HEADER.pack(FRAME_DATA, 2**32 - 1))
+        reader = FrameReader(right)
+        with pytest.raises(ProtocolError):
+            reader.read_frame()
+        assert len(reader._buffer) < MAX_PAYLOAD_BYTES
+
+
+def test_largest_file_chunk_fits():
+    headers = FILE_CHUNK.size + SEALED_HEADER.size + 16  # AEAD tag
+    assert MAX_CHUNK_BYTES + headers <= MAX_PAYLOAD_BYTES
+    with pytest.raises(ValueError):
+        encode_frame(FRAME_FILE_CHUNK, bytes(MAX_PAYLOAD_BYTES + 1))
+
+
+def test_frames_survive_any_split():
+    frames = [(FRAME_DATA, bytes([i % 256]) * size) for i, size in enumerate((0, 1, 5, 70000, 3, 200000, 17))]
+    wire = b''.join(encode_frame(frame_type, payload) for frame_type, payload in frames)
+    left, right = socket.socketpair()
+    with left, right:
+        def send():
+            for start in range(0, len(wire), 4093):  # splits headers and payloads alike
+                left.sendall(wire[start:start + 4093])
+        sender = threading.Thread(target=send)
+        sender.start()
+        reader = FrameReader(right, buffer_size=1024)
+        received = [(frame_type, bytes(payload)) for frame_type, payload in (reader.read_frame() for _ in frames)]
+        sender.join()
+    assert received == frames
+
+
+def test_writer_keeps_order_and_flushes_on_close():
+    frames = [encode_frame(FRAME_DATA, DATA_HEADER.pack(i, 0.0), bytes(i % 50)) for i in range(2000)]
+    received = []
+    left, right = socket.socketpair()
+    with left, right:
+        def read():
+            reader = FrameReader(right)
+            for _ in frames:
+                frame_type, payload = reader.read_frame()
+                offset, _, ciphertext = parse_data(payload)
+                received.append((frame_type, offset, len(ciphertext)))
+        reader = threading.Thread(target=read)
+        reader.start()
+        writer = FrameWriter(left, max_bytes=4096)  # puts block on the small queue
+        for frame in frames:
+            writer.put(frame)
+        writer.close(5)
+        reader.join(5)
+    assert received == [(FRAME_DATA, i, i % 50) for i in range(2000)]
+    assert writer.frames_written == len(frames)
+
+
+def test_write_error_wakes_blocked_put():
+    left, right = socket.socketpair()
+    with left:
+        writer = FrameWriter(left, max_bytes=4096)
+        frame = bytes(1024)
+        while writer.flush(0.1) or writer._queued_bytes < writer.max_bytes:
+            writer.put(frame, timeout=5)  # until the unread socket and then the queue are full
+        errors = []
+
+        def put():
+            try:
+                writer.put(frame, timeout=30)
+            except Exception as e:
+                errors.append(e)
+        blocked = threading.Thread(target=put)
+        blocked.start()
+        right.close()  # the writer's sendmsg fails
+        blocked.join(5)
+        assert not blocked.is_alive()
+        assert isinstance(errors[0], ConnectionError)
+        assert isinstance(writer.error, OSError)
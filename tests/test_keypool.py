@@ -0,0 +1,85 @@
+import socket
+import threading
+
+import pytest
+
+from async_server import AsyncQKDServer
+from keypool import KeyExhausted, KeyPool
+from peer import Peer
+from session import EVENT_MESSAGE
+
+KEY_RESERVE = 256
+MESSAGE = "y" * 1500  # several times the server's reserve
+
+
+def test_lanes_split_every_round():
+    server, client = KeyPool(True), KeyPool(False)
+    for key in (bytes(range(8)), bytes(range(8, 16))):
+        server.add(key)
+        client.add(key)
+    offset, key = server.send.take(6)
+    assert client.recv.take_at(offset, 6) == key
+    offset, key = client.send.take(3)
+    assert server.recv.take_at(offset, 3) == key
+    with pytest.raises(ValueError):
+        client.recv.take_at(0, 1)  # used already
+    with pytest.raises(KeyExhausted):
+        client.send.take(8, timeout=0)
+
+
+def test_request_asks_the_producer_for_key():
+    pool = KeyPool(True, target_bytes=4)
+    pool.add(bytes(16))
+    assert not pool.needs_refill()
+    pool.request(100)
+    assert pool.needs_refill()
+    pool.add(bytes(200))
+    assert not pool.needs_refill()
+
+
+def subscribe_messages(session, received, done):
+    def on_event(event, session, value):
+        if event == EVENT_MESSAGE:
+            received.append(value)
+            done.set()
+    session.subscribe(on_event)
+
+
+def test_client_message_larger_than_reserve_async_server():
+    received, done = [], threading.Event()
+    server = AsyncQKDServer(port=0, key_reserve=KEY_RESERVE, on_session=lambda s: subscribe_messages(s, received, done))
+    server.start_in_thread()
+    peer = Peer.connect('127.0.0.1', server.port).start()
+    try:
+        peer.wait_for_key()
+        peer.send(MESSAGE, timeout=10)
+        assert done.wait(10)
+        assert received == [MESSAGE]
+    finally:
+        peer.close()
+        server.stop_threadsafe().result(10)
+
+
+def test_client_message_larger_than_reserve_threaded_server():
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen()
+    accepted = []
+    thread = threading.Thread(target=lambda: accepted.append(Peer.accept(listener, key_reserve=KEY_RESERVE)))
+    thread.start()
+    client = Peer.connect('127.0.0.1', listener.getsockname()[1])
+    thread.join()
+    server = accepted[0]
+    received, done = [], threading.Event()
+    subscribe_messages(server.session, received, done)
+    server.start()
+    client.start()
+    try:
+        client.wait_for_key()
+        client.send(MESSAGE, timeout=10)
+        assert done.wait(10)
+        assert received == [MESSAGE]
+    finally:
+        client.close()
+        server.close()
+        listener.close()
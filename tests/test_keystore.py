@@ -0,0 +1,58 @@
+import pytest
+
+from keypool import KeyPool
+from keystore import SLOT_OFFSETS, KeyStore, KeyStoreBusy
+
+PEER = "127.0.0.1:12345"
+
+
+def stored_pool(directory, sync=False):
+    pool = KeyPool(True)
+    pool.attach(KeyStore(str(directory), sync=sync), PEER)
+    return pool
+
+
+def test_key_survives_a_restart(tmp_path):
+    pool = stored_pool(tmp_path, sync=True)
+    pool.add(bytes(range(200)))
+    offset, first = pool.send.take(40)
+    offsets = pool.offsets()
+    pool.close()
+
+    pool = stored_pool(tmp_path)
+    try:
+        assert pool.offsets() == offsets
+        assert pool.send.take(60) == (40, bytes(range(40, 100)))
+        assert pool.recv.take_at(0, 100) == bytes(range(100, 200))
+        assert (offset, first) == (0, bytes(range(40)))
+    finally:
+        pool.close()
+
+
+def test_lanes_are_locked_to_one_connection(tmp_path):
+    pool = stored_pool(tmp_path)
+    try:
+        with pytest.raises(KeyStoreBusy):
+            stored_pool(tmp_path)
+    finally:
+        pool.close()
+    stored_pool(tmp_path).close()  # free again once closed
+
+
+def test_torn_header_write_keeps_the_previous_state(tmp_path):
+    pool = stored_pool(tmp_path)
+    pool.add(bytes(64))
+    pool.send.take(8)
+    send_path = pool.send.path
+    sequence = pool.send._sequence
+    pool.close()
+    with open(send_path, "r+b") as f:
+        f.seek(SLOT_OFFSETS[sequence % 2])
+        f.write(b"torn")  # the latest slot no longer matches its checksum
+
+    pool = stored_pool(tmp_path)
+    try:
+        assert pool.send.consumed == 0  # the write before the take
+        assert pool.send.available() == 32
+    finally:
+        pool.close()
@@ -0,0 +1,32 @@
+import numpy as np
+
+import privacy
+
+
+def toeplitz_matrix(num_bits, output_bits, seed):
+    diagonal = privacy.toeplitz_diagonal(num_bits, output_bits, seed)
+    rows, columns = np.indices((output_bits, num_bits))
+    return diagonal[rows - columns + num_bits - 1]
+
+
+def test_fft_hash_matches_the_matrix_product():
+    rng = np.random.default_rng(0)
+    for num_bits, output_bits in ((1, 1), (7, 3), (64, 64), (1000, 317), (4096, 1)):
+        bits = rng.integers(0, 2, num_bits, dtype=np.uint8)
+        expected = toeplitz_matrix(num_bits, output_bits, 5) @ bits.astype(np.int64) % 2
+        assert np.array_equal(privacy.toeplitz_hash(bits, output_bits, 5), expected)
+
+
+def test_both_sides_derive_the_same_key():
+    bits = np.random.default_rng(1).integers(0, 2, 100000, dtype=np.uint8)
+    alice = privacy.amplify(bits, 0.03, 20000, seed=9)
+    bob = privacy.amplify(bits.copy(), 0.03, 20000, seed=9)
+    assert len(alice) == privacy.secret_key_length(len(bits), 0.03, 20000) > 0
+    assert np.array_equal(alice, bob)
+    assert not np.array_equal(alice, privacy.amplify(bits, 0.03, 20000, seed=10))
+
+
+def test_no_key_above_the_maximum_qber():
+    assert privacy.secret_key_length(10**6, privacy.MAX_QBER, 0) == 0
+    assert privacy.secret_key_length(10**6, 0.05, 10**6) == 0
+    assert privacy.secret_key_length(10**6, 0.02, 0) > privacy.secret_key_length(10**6, 0.05, 0) > 0
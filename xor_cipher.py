@@ -0,0 +1,32 @@
+# Bulk XOR cipher for one-time-pad messaging.
+# Works on bit-packed key bytes (8 key bits per byte, as produced by
+# bb84.key_bytes / the key pool) and XORs whole buffers with NumPy, so
+# payloads move at memory bandwidth instead of one byte per interpreter step.
+# Buffers are used through the buffer protocol: bytes, bytearray, memoryview
+# and NumPy arrays are all accepted without an intermediate copy.
+
+import numpy as np
+
+
+def as_uint8(buffer):
+    return np.frombuffer(memoryview(buffer).cast('B'), dtype=np.uint8)
+
+
+def pack_key(key_bits):
+    # Legacy key arrays hold one 0/1 value per element; pack them 8 per byte
+    return np.packbits(np.asarray(key_bits, dtype=np.uint8)).tobytes()
+
+
+def xor_into(buffer, key):
+    # Encrypts/decrypts a writable buffer (bytearray, writable memoryview) in place
+    data = as_uint8(buffer)
+    pad = as_uint8(key)
+    if len(pad) < len(data):
+        raise ValueError(f"Key too short: {len(pad)} bytes for a {len(data)} byte message")
+    np.bitwise_xor(data, pad[:len(data)], out=data)
+    return buffer
+
+
+def xor_bytes(data, key):
+    # Same as xor_into for read-only input (bytes); returns a new bytearray
+    return xor_into(bytearray(data), key)